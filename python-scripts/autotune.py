@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Tile autotuner for the upscalers on this host.
+
+Sweeps tile size, overlap, batch size and dtype for a model, measures
+throughput and peak memory, and saves the fastest settings that fit the
+memory budget and stay within --min-psnr of the reference output as this
+host's profile (see utils/tuning_profiles.py). Jobs that leave those keys
+unset then use the profile.
+
+The sweep is staged rather than a full grid: each parameter is swept in turn
+with the best values found so far held fixed (ESRGAN: dtype, tile size,
+overlap, batch; FLUX: tile size, padding). The reference is the untuned
+defaults run in float32.
+
+Usage:
+  python autotune.py esrgan --model 4x-UltraSharp.pth
+  python autotune.py esrgan --image ./testset/print.jpg --tile-sizes 256 512 768 1024
+  python autotune.py flux --steps 4
+  python autotune.py show
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_TILE_SIZES = [256, 384, 512, 768, 1024]
+
+
+def _test_image(args):
+    """The --image as uint8 RGB, or a synthetic one: gradients, edges and noise."""
+    import numpy as np
+    from PIL import Image
+
+    if args.image:
+        with Image.open(args.image) as img:
+            return np.array(img.convert("RGB"))
+
+    rng = np.random.default_rng(0)
+    h = w = args.size
+    y, x = np.mgrid[0:h, 0:w]
+    img = np.stack([x / w, y / h, (x + y) / (w + h)], axis=-1) * 255
+    img[(x // 64 + y // 64) % 2 == 0] *= 0.6
+    img += rng.normal(0, 12, img.shape)
+    return img.clip(0, 255).astype(np.uint8)
+
+
+class PeakMemory:
+    """Peak memory (MB) of a block: the CUDA allocator's peak, or sampled process RSS on CPU."""
+
+    def __init__(self, device):
+        self.device = device
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        import torch
+
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        try:
+            import psutil
+        except ImportError:
+            return
+        process = psutil.Process()
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, process.memory_info().rss / (1024 * 1024))
+            self._stop.wait(0.02)
+
+    def __exit__(self, *exc):
+        import torch
+
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+            self.peak_mb = torch.cuda.max_memory_allocated() / (1024 * 1024)
+        else:
+            self._stop.set()
+            self._thread.join()
+
+
+def memory_budget_mb(device, fraction: float) -> float:
+    """fraction of the GPU's memory, or of the RAM available now."""
+    import torch
+
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(0).total_memory / (1024 * 1024) * fraction
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 * 1024) * fraction
+    except ImportError:
+        return float("inf")
+
+
+def _is_oom(error: Exception) -> bool:
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def staged_sweep(base: dict, stages: list, measure, budget_mb: float, min_psnr: float):
+    """
+    Sweep each (key, values) stage in turn from base, keeping the fastest
+    value that fits budget_mb and reaches min_psnr against base's output.
+
+    measure(params) returns dict with mpx_per_sec, peak_memory_mb and output
+    (uint8), or raises on out-of-memory.
+
+    Returns:
+        (best params, metrics of the best run, one row per run)
+    """
+    from utils.metrics import psnr
+
+    reference = None
+    rows = []
+    seen = {}
+
+    def run(params):
+        nonlocal reference
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            try:
+                result = measure(params)
+            except (RuntimeError, MemoryError) as e:
+                if not _is_oom(e):
+                    raise
+                result = {"mpx_per_sec": 0.0, "peak_memory_mb": None, "error": "out of memory"}
+            if "output" in result:
+                output = result.pop("output")
+                if reference is None:
+                    reference = output
+                result["psnr"] = psnr(reference, output)
+            result["fits"] = (
+                "error" not in result
+                and result["peak_memory_mb"] <= budget_mb
+                and result["psnr"] >= min_psnr
+            )
+            seen[key] = result
+            rows.append({**params, **result})
+            _print_row(params, result)
+        return seen[key]
+
+    best = dict(base)
+    best_result = run(best)
+    if reference is None:
+        raise SystemExit("The reference settings do not fit in memory on this host")
+    for key, values in stages:
+        for value in values:
+            params = {**best, key: value}
+            result = run(params)
+            if result["fits"] and (not best_result["fits"] or result["mpx_per_sec"] > best_result["mpx_per_sec"]):
+                best, best_result = params, result
+    return best, best_result, rows
+
+
+def _print_row(params: dict, result: dict):
+    settings = " ".join(f"{k}={v}" for k, v in params.items())
+    if "error" in result:
+        print(f"  {settings:<60} {result['error']}")
+        return
+    print(
+        f"  {settings:<60} {result['mpx_per_sec']:>8.3f} MP/s {result['peak_memory_mb']:>9.0f} MB "
+        f"{result['psnr']:>7.2f} dB{'' if result['fits'] else '  (rejected)'}"
+    )
+
+
+def tune_esrgan(args) -> dict:
+    import torch
+
+    from services.esrgan_upscaler import DEVICE, EsrganUpscaler
+
+    upscaler = EsrganUpscaler(args.models_dir)
+    image = torch.from_numpy(_test_image(args)).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+
+    def measure(params: dict) -> dict:
+        model = upscaler._load_model(args.model, use_fp16=params["use_fp16"])
+        img_tensor = image.to(DEVICE)
+        if params["use_fp16"] and DEVICE.type == "cuda":
+            img_tensor = img_tensor.half()
+        batch = params["tile_batch"]
+
+        def run():
+            return upscaler._upscale_region(
+                model, img_tensor, params["tile_size"], params["tile_overlap"],
+                tile_runner=lambda *a: upscaler._run_tiles(model, *a, batch=batch),
+            )["output"]
+
+        seconds = float("inf")
+        with PeakMemory(DEVICE) as mem:
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                output = run()
+                if DEVICE.type == "cuda":
+                    torch.cuda.synchronize()
+                seconds = min(seconds, time.perf_counter() - start)
+
+        out = output.squeeze(0).permute(1, 2, 0).float().cpu().numpy()
+        out = (out * 255).clip(0, 255).astype("uint8")
+        del output
+        upscaler._clear_memory()
+        return {
+            "mpx_per_sec": out.shape[0] * out.shape[1] / 1e6 / seconds,
+            "peak_memory_mb": mem.peak_mb,
+            "output": out,
+        }
+
+    base = {"use_fp16": False, "tile_size": 512, "tile_overlap": 32, "tile_batch": 1}
+    stages = [
+        ("use_fp16", [True] if DEVICE.type == "cuda" else []),
+        ("tile_size", args.tile_sizes),
+        ("tile_overlap", args.overlaps),
+        ("tile_batch", args.batches),
+    ]
+    budget = memory_budget_mb(DEVICE, args.memory_fraction)
+    print(f"Tuning {args.model} on {DEVICE} (budget {budget:.0f} MB, min PSNR {args.min_psnr} dB)")
+    best, metrics, rows = staged_sweep(base, stages, measure, budget, args.min_psnr)
+
+    # A tile costs the same in either pass, so the second pass needs no cap of its own
+    params = {**best, "tile_size_pass2": best["tile_size"]}
+    return _finish(args, "esrgan", args.model, params, metrics, rows)
+
+
+def tune_flux(args) -> dict:
+    import numpy as np
+    import torch
+    from PIL import Image
+
+    from services.flux_upscaler import FluxUpscaler
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    flux = FluxUpscaler(args.models_dir)
+    flux.load_models(flux_model=args.model)
+
+    work_dir = Path(tempfile.mkdtemp(prefix="autotune-flux-"))
+    image_path = work_dir / "input.png"
+    Image.fromarray(_test_image(args)).save(image_path)
+
+    def measure(params: dict) -> dict:
+        config = {
+            "image_path": str(image_path),
+            "output_dir": str(work_dir),
+            "output_name": "tune",
+            "upscale_by": args.upscale_by,
+            "upscale_factor": args.upscale_by,
+            "steps": args.steps,
+            "seed": 1,
+            "pyramid": False,
+            "retain_raw": False,
+            "tile_height": params["tile_width"],
+            **params,
+        }
+        with PeakMemory(device) as mem:
+            start = time.perf_counter()
+            result = flux.upscale(config)
+            seconds = time.perf_counter() - start
+        with Image.open(result["output_path"]) as img:
+            out = np.array(img.convert("RGB"))
+        return {
+            "mpx_per_sec": out.shape[0] * out.shape[1] / 1e6 / seconds,
+            "peak_memory_mb": mem.peak_mb,
+            "output": out,
+        }
+
+    base = {"tile_width": 512, "tile_padding": 32}
+    stages = [("tile_width", args.tile_sizes), ("tile_padding", args.overlaps)]
+    budget = memory_budget_mb(device, args.memory_fraction)
+    print(f"Tuning {args.model} on {device} (budget {budget:.0f} MB, min PSNR {args.min_psnr} dB)")
+    best, metrics, rows = staged_sweep(base, stages, measure, budget, args.min_psnr)
+
+    params = {"tile_width": best["tile_width"], "tile_height": best["tile_width"], "tile_padding": best["tile_padding"]}
+    return _finish(args, "flux", args.model, params, metrics, rows)
+
+
+def _finish(args, engine: str, model: str, params: dict, metrics: dict, rows: list) -> dict:
+    from utils.tuning_profiles import host_fingerprint, save_profile
+
+    metrics = {k: metrics.get(k) for k in ("mpx_per_sec", "peak_memory_mb", "psnr")}
+    print(f"\nBest: {json.dumps(params)}")
+    if not args.dry_run:
+        path = save_profile(model, engine, params, metrics)
+        print(f"Profile saved to {path} (host {host_fingerprint()})")
+    return {"engine": engine, "model": model, "params": params, "metrics": metrics, "runs": rows}
+
+
+def show(args) -> dict:
+    from utils.tuning_profiles import _read, host_fingerprint, host_info
+
+    fingerprint = host_fingerprint()
+    host = _read().get(fingerprint, {})
+    print(f"Host {fingerprint}: {json.dumps(host_info())}")
+    for model, profile in host.get("models", {}).items():
+        print(f"  {model} ({profile['engine']}, {profile['tuned_at']}): {json.dumps(profile['params'])}")
+    if not host:
+        print("  no profiles")
+    return host
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models-dir", default=None, help="Model cache dir (default: $MODEL_CACHE_DIR)")
+    parser.add_argument("--output", default=None, help="Write the sweep as JSON to this path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def sweep_args(p, model, overlaps):
+        p.add_argument("--model", default=model)
+        p.add_argument("--image", default=None, help="Test image (default: synthetic)")
+        p.add_argument("--size", type=int, default=1024, help="Synthetic test image side")
+        p.add_argument("--tile-sizes", nargs="+", type=int, default=DEFAULT_TILE_SIZES)
+        p.add_argument("--overlaps", nargs="+", type=int, default=overlaps)
+        p.add_argument("--memory-fraction", type=float, default=0.8,
+                       help="Share of GPU memory (or available RAM) a run may peak at")
+        p.add_argument("--min-psnr", type=float, default=40.0,
+                       help="Minimum PSNR against the reference output, in dB")
+        p.add_argument("--dry-run", action="store_true", help="Report without saving the profile")
+
+    esrgan = sub.add_parser("esrgan", help="tile size, overlap, batch and dtype for an ESRGAN model")
+    sweep_args(esrgan, "4x-UltraSharp.pth", [16, 24, 32, 48])
+    esrgan.add_argument("--batches", nargs="+", type=int, default=[1, 2, 4])
+    esrgan.add_argument("--repeats", type=int, default=2, help="Runs per setting; the fastest counts")
+    esrgan.set_defaults(func=tune_esrgan)
+
+    flux = sub.add_parser("flux", help="tile size and padding for the FLUX model")
+    sweep_args(flux, "flux1-dev-Q8_0.gguf", [16, 32, 64])
+    flux.add_argument("--steps", type=int, default=4, help="Sampler steps per run")
+    flux.add_argument("--upscale-by", type=float, default=2)
+    flux.set_defaults(func=tune_flux, size=512)
+
+    show_parser = sub.add_parser("show", help="print this host's profiles")
+    show_parser.set_defaults(func=show)
+
+    args = parser.parse_args()
+    if args.models_dir:
+        # Profiles are stored next to the models
+        os.environ["MODEL_CACHE_DIR"] = args.models_dir
+    report = args.func(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, default=str))
+        print(f"\nReport written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
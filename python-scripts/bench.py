@@ -0,0 +1,946 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the upscaler worker.
+
+Each subcommand measures one optimized path against its reference and
+prints a report (and optionally writes it as JSON).
+
+Usage:
+  python bench.py backends --images ./testset --model 4x-UltraSharp.pth
+  python bench.py model-load --model 4x-UltraSharp.pth
+  python bench.py protocol
+  python bench.py ingest --images ./testset
+  python bench.py cpu-pool --images ./testset --splits 8x2 16x1
+  python bench.py split --images ./testset --workers 4
+  python bench.py adaptive --images ./testset --thresholds 0.005 0.01 0.02
+  python bench.py resume --images ./testset --kill-after 8
+  python bench.py residency --schedule 0 60 400 2500 --prefetch
+  python bench.py imagen --images ./testset --concurrency 1 4 8 --latency 0.5
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff"}
+
+
+def _list_images(images_dir: str) -> list[Path]:
+    paths = sorted(
+        p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    if not paths:
+        raise SystemExit(f"No images found in {images_dir}")
+    return paths
+
+
+def _load_rgb(path: Path):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return np.array(img.convert("RGB"))
+
+
+def _to_uint8(tensor):
+    import numpy as np
+
+    arr = tensor.squeeze(0).permute(1, 2, 0).float().cpu().numpy()
+    return (arr * 255).clip(0, 255).astype(np.uint8)
+
+
+def _write_report(report: dict, output: str = None):
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {output}")
+
+
+def bench_backends(args) -> dict:
+    """Compare CPU execution backends (int8, onnx) against the float32 model."""
+    import torch
+
+    from services.esrgan_upscaler import EsrganUpscaler
+    from utils.metrics import psnr, ssim
+
+    upscaler = EsrganUpscaler(args.models_dir)
+    rows = []
+
+    for path in _list_images(args.images):
+        img = _load_rgb(path)
+        img_tensor = torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+
+        models = {"fp32": upscaler._load_model(args.model, use_fp16=False).to(torch.device("cpu")).float()}
+        for backend in args.backends:
+            models[backend] = upscaler._load_backend_model(args.model, backend)
+
+        timings = {}
+        outputs = {}
+        for name, model in models.items():
+            start = time.perf_counter()
+            out = upscaler._upscale_with_tiles(model, img_tensor, args.tile_size, args.tile_overlap)
+            timings[name] = time.perf_counter() - start
+            outputs[name] = _to_uint8(out)
+
+        out_mpx = outputs["fp32"].shape[0] * outputs["fp32"].shape[1] / 1e6
+        for name in models:
+            rows.append({
+                "image": path.name,
+                "backend": name,
+                "psnr": psnr(outputs["fp32"], outputs[name]),
+                "ssim": ssim(outputs["fp32"], outputs[name]),
+                "seconds": timings[name],
+                "mpx_per_sec": out_mpx / timings[name],
+                "speedup": timings["fp32"] / timings[name],
+            })
+
+    print(f"\n{'image':<32} {'backend':<8} {'PSNR':>8} {'SSIM':>8} {'MP/s':>8} {'speedup':>8}")
+    for r in rows:
+        print(
+            f"{r['image']:<32} {r['backend']:<8} {r['psnr']:>8.2f} {r['ssim']:>8.4f} "
+            f"{r['mpx_per_sec']:>8.3f} {r['speedup']:>7.2f}x"
+        )
+
+    return {
+        "benchmark": "backends",
+        "model": args.model,
+        "tile_size": args.tile_size,
+        "threads": torch.get_num_threads(),
+        "results": rows,
+    }
+
+
+def bench_model_load(args) -> dict:
+    """Compare .pth unpickling against the memory-mapped safetensors store."""
+    from spandrel import ModelLoader
+
+    from services.esrgan_upscaler import EsrganUpscaler
+
+    upscaler = EsrganUpscaler(args.models_dir)
+    store = upscaler.model_store
+    model_path = upscaler.upscale_models_dir / args.model
+
+    if not store.is_valid(args.model):
+        start = time.perf_counter()
+        store.convert(args.model)
+        print(f"Converted {args.model} in {time.perf_counter() - start:.3f}s")
+
+    def best_of(fn) -> float:
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    pth_seconds = best_of(lambda: ModelLoader().load_from_file(str(model_path)))
+    st_seconds = best_of(lambda: store.load(args.model))
+    validate_seconds = best_of(lambda: store.is_valid(args.model))
+
+    print(f"\n{'path':<24} {'seconds':>10}")
+    print(f"{'.pth (ModelLoader)':<24} {pth_seconds:>10.4f}")
+    print(f"{'safetensors (mmap)':<24} {st_seconds:>10.4f}")
+    print(f"{'manifest validation':<24} {validate_seconds:>10.4f}")
+    print(f"\nSpeedup: {pth_seconds / st_seconds:.1f}x")
+
+    return {
+        "benchmark": "model-load",
+        "model": args.model,
+        "repeats": args.repeats,
+        "pth_seconds": pth_seconds,
+        "safetensors_seconds": st_seconds,
+        "validate_seconds": validate_seconds,
+        "manifest_entry": store.entry(args.model),
+    }
+
+
+def bench_protocol(args) -> dict:
+    """Messages/sec and per-message overhead of the jsonl and framed channels."""
+    import io
+    import socket
+    import threading
+
+    from utils.protocol import FramedChannel, JsonLineChannel, encode_frame
+
+    messages = {
+        "heartbeat": {
+            "type": "heartbeat", "stage": "esrgan", "job_id": "0" * 36,
+            "job_elapsed": 12.3, "uptime": 456.7, "rss_mb": 2048.5,
+            "gpu_allocated_mb": 1024.0, "gpu_reserved_mb": 1536.0,
+        },
+        "result": {
+            "type": "result", "job_id": "0" * 36,
+            "output_path": "/app/results/" + "0" * 36 + ".png",
+            "output_paths": ["/app/results/" + "0" * 36 + ".png"],
+            "output_width": 12000, "output_height": 9000,
+            "crop_info": {"direction": "vertical", "amount_px": 312, "amount_inches": 2.08},
+            "processing_time": 123.4, "status": "completed",
+        },
+    }
+
+    def run(make_pair, msg) -> float:
+        sender, receiver, cleanup = make_pair()
+        received = 0
+
+        def consume():
+            nonlocal received
+            for _ in receiver:
+                received += 1
+                if received == args.count:
+                    return
+
+        reader = threading.Thread(target=consume)
+        reader.start()
+        start = time.perf_counter()
+        for _ in range(args.count):
+            sender.send(msg)
+        cleanup()
+        reader.join()
+        return args.count / (time.perf_counter() - start)
+
+    # FramedChannel only holds raw fds, so keep the socket objects alive here
+    open_sockets = []
+
+    def framed_pair():
+        a, b = socket.socketpair()
+        open_sockets.extend([a, b])
+
+        def cleanup():
+            a.shutdown(socket.SHUT_WR)
+
+        return FramedChannel(a.fileno()), FramedChannel(b.fileno()), cleanup
+
+    def jsonl_pair():
+        a, b = socket.socketpair()
+        writer = a.makefile("w")
+        reader = b.makefile("r")
+
+        def cleanup():
+            writer.close()
+            a.shutdown(socket.SHUT_WR)
+
+        return JsonLineChannel(writer=writer), JsonLineChannel(reader=reader), cleanup
+
+    rows = []
+    for name, msg in messages.items():
+        payload_bytes = len(json.dumps(msg, separators=(",", ":")).encode())
+        jsonl_bytes = len((json.dumps(msg) + "\n").encode())
+        framed_bytes = len(encode_frame(msg))
+        rows.append({
+            "message": name,
+            "payload_bytes": payload_bytes,
+            "jsonl_bytes": jsonl_bytes,
+            "framed_bytes": framed_bytes,
+            "jsonl_msgs_per_sec": run(jsonl_pair, msg),
+            "framed_msgs_per_sec": run(framed_pair, msg),
+        })
+
+    print(f"\n{'message':<10} {'payload':>8} {'jsonl B':>8} {'framed B':>9} {'jsonl msg/s':>12} {'framed msg/s':>13}")
+    for r in rows:
+        print(
+            f"{r['message']:<10} {r['payload_bytes']:>8} {r['jsonl_bytes']:>8} {r['framed_bytes']:>9} "
+            f"{r['jsonl_msgs_per_sec']:>12.0f} {r['framed_msgs_per_sec']:>13.0f}"
+        )
+
+    return {"benchmark": "protocol", "count": args.count, "results": rows}
+
+
+def bench_ingest(args) -> dict:
+    """Compare header probing and single-buffer decoding with the old decode paths."""
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    from utils.image_ingest import load_image, probe_image
+
+    def best_of(fn) -> float:
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def old_cv2(path):
+        img = cv2.imread(str(path))
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    def old_pil(path):
+        with Image.open(path) as img:
+            return np.array(img.convert("RGB"))
+
+    rows = []
+    print(f"{'image':<28} {'size':>11} {'path':<16} {'ms':>9}")
+    for path in _list_images(args.images):
+        info = probe_image(path)
+        size = f"{info['width']}x{info['height']}"
+        paths = {
+            "probe": lambda: probe_image(path),
+            "cv2+cvtColor": lambda: old_cv2(path),
+            "pil+np.array": lambda: old_pil(path),
+            "ingest": lambda: load_image(path, info),
+        }
+        if info["format"] == "JPEG":
+            for factor in (2, 4, 8):
+                paths[f"ingest draft/{factor}"] = lambda f=factor: load_image(path, info, f)
+
+        for name, fn in paths.items():
+            ms = best_of(fn) * 1000
+            rows.append({"image": path.name, "size": size, "path": name, "ms": ms})
+            print(f"{path.name[:28]:<28} {size:>11} {name:<16} {ms:>9.2f}")
+
+    return {"benchmark": "ingest", "repeats": args.repeats, "results": rows}
+
+
+def bench_cpu_pool(args) -> dict:
+    """Compare single-process tiling with the CPU process pool at several process x thread splits."""
+    import torch
+
+    from services.esrgan_upscaler import EsrganUpscaler
+    from utils.cpu_tile_pool import CpuTilePool, available_cores, plan_split
+
+    cores = available_cores()
+    splits = [tuple(int(n) for n in split.split("x")) for split in args.splits]
+    if plan_split(cores) not in splits and plan_split(cores)[0] > 1:
+        splits.append(plan_split(cores))
+
+    upscaler = EsrganUpscaler(args.models_dir)
+    model = upscaler._load_model(args.model, use_fp16=False)
+    torch.set_num_threads(cores)
+
+    def run(img_tensor, tile_runner=None) -> dict:
+        return upscaler._upscale_region(
+            model, img_tensor, args.tile_size, args.tile_overlap, tile_runner=tile_runner
+        )
+
+    rows = []
+    print(f"{'image':<28} {'split':>7} {'tiles':>6} {'tiles/s':>8} {'speedup':>8}")
+    for path in _list_images(args.images):
+        img_tensor = torch.from_numpy(_load_rgb(path)).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+
+        baseline = run(img_tensor)
+        results = {"serial": baseline}
+        for processes, threads in splits:
+            pool = CpuTilePool(upscaler.upscale_models_dir, processes, threads, preload=args.model)
+            try:
+                # Warm up: spawn the processes, each loading the model
+                list(pool.executor.map(abs, range(processes)))
+                results[f"{processes}x{threads}"] = run(img_tensor, pool.runner(args.model, model.scale))
+            finally:
+                pool.shutdown()
+
+        for split, result in results.items():
+            rows.append({
+                "image": path.name,
+                "split": split,
+                "tiles": result["tiles"],
+                "tiles_per_second": result["tiles_per_second"],
+                "speedup": result["tiles_per_second"] / baseline["tiles_per_second"],
+            })
+            r = rows[-1]
+            print(f"{path.name[:28]:<28} {split:>7} {r['tiles']:>6} {r['tiles_per_second']:>8.2f} {r['speedup']:>7.2f}x")
+
+    return {
+        "benchmark": "cpu-pool",
+        "model": args.model,
+        "cores": cores,
+        "auto_split": list(plan_split(cores)),
+        "tile_size": args.tile_size,
+        "results": rows,
+    }
+
+
+class _LocalWorker:
+    """A worker.py process on the JSON-line protocol, for driving jobs from benchmarks."""
+
+    def __init__(self, env: dict):
+        import subprocess
+
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", str(Path(__file__).parent / "worker.py")],
+            cwd=str(Path(__file__).parent),
+            env={**env, "WORKER_PROTOCOL": "jsonl"},
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.results = {}
+        self.wait_for(lambda msg: msg.get("type") == "status" and msg.get("message") == "ready")
+
+    def wait_for(self, predicate) -> dict:
+        for line in self.process.stdout:
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if msg.get("type") in ("result", "error"):
+                self.results[msg["job_id"]] = msg
+            if predicate(msg):
+                return msg
+        raise RuntimeError("Worker exited")
+
+    def submit(self, job_id: str, method: str, config: dict):
+        self.process.stdin.write(json.dumps({"job_id": job_id, "method": method, "config": config}) + "\n")
+        self.process.stdin.flush()
+
+    def result(self, job_id: str) -> dict:
+        msg = self.results.get(job_id) or self.wait_for(
+            lambda m: m.get("job_id") == job_id and m["type"] in ("result", "error")
+        )
+        if msg["type"] == "error":
+            raise RuntimeError(f"{job_id}: {msg['error']}")
+        return msg
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(timeout=30)
+
+    def kill(self):
+        """Kill the process outright, as a crash would."""
+        self.process.kill()
+        self.process.wait()
+
+
+def bench_split(args) -> dict:
+    """Compare a single-worker ESRGAN job with the same job split across local workers."""
+    import os
+    import tempfile
+
+    import numpy as np
+
+    env = dict(os.environ)
+    if args.models_dir:
+        env["MODEL_CACHE_DIR"] = args.models_dir
+    output_dir = tempfile.mkdtemp(prefix="bench-split-")
+    env.setdefault("TILE_STORE_DIR", str(Path(output_dir) / "tiles"))
+
+    workers = [_LocalWorker(env) for _ in range(args.workers)]
+    shards = args.shards or args.workers
+    rows = []
+    try:
+        for path in _list_images(args.images):
+            base = {
+                "image_path": str(path),
+                "output_dir": output_dir,
+                "model": args.model,
+                "tile_size": args.tile_size,
+                "upscale_factor": args.upscale_factor,
+                "pyramid": False,
+                "retain_raw": False,
+            }
+
+            start = time.perf_counter()
+            workers[0].submit("single", "esrgan", {**base, "output_name": "single"})
+            workers[0].result("single")
+            single_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for k in range(shards):
+                split = {"split_id": "bench", "shard": k, "shards": shards}
+                workers[k % len(workers)].submit(
+                    f"shard-{k}", "esrgan", {**base, "output_name": "split", "split": split}
+                )
+            for k in range(shards):
+                workers[k % len(workers)].result(f"shard-{k}")
+            merge = {"split_id": "bench", "merge": True}
+            workers[0].submit("merge", "esrgan", {**base, "output_name": "split", "split": merge})
+            workers[0].result("merge")
+            split_seconds = time.perf_counter() - start
+
+            single = _load_rgb(Path(output_dir) / "single.png")
+            merged = _load_rgb(Path(output_dir) / "split.png")
+            rows.append({
+                "image": path.name,
+                "single_seconds": single_seconds,
+                "split_seconds": split_seconds,
+                "speedup": single_seconds / split_seconds,
+                "identical": bool(single.shape == merged.shape and np.array_equal(single, merged)),
+            })
+    finally:
+        for worker in workers:
+            worker.close()
+
+    print(f"\n{'image':<28} {'single s':>9} {'split s':>9} {'speedup':>8} {'identical':>10}")
+    for r in rows:
+        print(
+            f"{r['image'][:28]:<28} {r['single_seconds']:>9.2f} {r['split_seconds']:>9.2f} "
+            f"{r['speedup']:>7.2f}x {str(r['identical']):>10}"
+        )
+
+    return {"benchmark": "split", "workers": args.workers, "shards": shards, "results": rows}
+
+
+def bench_adaptive(args) -> dict:
+    """Quality and speed of flat-tile skipping and deduplication against full model runs."""
+    import torch
+
+    from services.esrgan_upscaler import EsrganUpscaler
+    from utils.metrics import psnr, ssim
+    from utils.tile_analysis import AdaptiveTiles
+
+    upscaler = EsrganUpscaler(args.models_dir)
+    model = upscaler._load_model(args.model, use_fp16=False).to(torch.device("cpu")).float()
+
+    def run(img_tensor, adaptive=None):
+        tile_runner = None
+        if adaptive is not None:
+            tile_runner = adaptive.runner(lambda *a: upscaler._run_tiles(model, *a))
+        start = time.perf_counter()
+        out = upscaler._upscale_region(
+            model, img_tensor, args.tile_size, args.tile_overlap, tile_runner=tile_runner
+        )["output"]
+        return _to_uint8(out), time.perf_counter() - start
+
+    rows = []
+    print(f"{'image':<28} {'threshold':>9} {'skip':>6} {'dedup':>6} {'PSNR':>8} {'SSIM':>8} {'speedup':>8}")
+    for path in _list_images(args.images):
+        img_tensor = torch.from_numpy(_load_rgb(path)).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+        reference, full_seconds = run(img_tensor)
+
+        for threshold in args.thresholds:
+            adaptive = AdaptiveTiles(model.scale, threshold, dedup=True)
+            out, seconds = run(img_tensor, adaptive)
+            stats = adaptive.stats()
+            rows.append({
+                "image": path.name,
+                "threshold": threshold,
+                "skip_ratio": stats["skip_ratio"],
+                "dedup_ratio": stats["dedup_ratio"],
+                "psnr": psnr(reference, out),
+                "ssim": ssim(reference, out),
+                "seconds": seconds,
+                "speedup": full_seconds / seconds,
+            })
+            r = rows[-1]
+            print(
+                f"{path.name[:28]:<28} {threshold:>9.4f} {r['skip_ratio']:>6.2f} {r['dedup_ratio']:>6.2f} "
+                f"{r['psnr']:>8.2f} {r['ssim']:>8.4f} {r['speedup']:>7.2f}x"
+            )
+
+    return {
+        "benchmark": "adaptive",
+        "model": args.model,
+        "tile_size": args.tile_size,
+        "results": rows,
+    }
+
+
+def bench_resume(args) -> dict:
+    """Kill a worker mid-job, resubmit the job to a new worker and check the resumed output."""
+    import os
+    import tempfile
+
+    import numpy as np
+
+    env = dict(os.environ)
+    if args.models_dir:
+        env["MODEL_CACHE_DIR"] = args.models_dir
+    output_dir = Path(tempfile.mkdtemp(prefix="bench-resume-"))
+    checkpoint_dir = output_dir / "checkpoints"
+    env["CHECKPOINT_DIR"] = str(checkpoint_dir)
+    # Checkpoint test images of any size
+    env["CHECKPOINT_MIN_TILES"] = "0"
+
+    rows = []
+    for n, path in enumerate(_list_images(args.images)):
+        base = {
+            "image_path": str(path),
+            "output_dir": str(output_dir),
+            "model": args.model,
+            "tile_size": args.tile_size,
+            "upscale_factor": args.upscale_factor,
+            "checkpoint_every": args.checkpoint_every,
+            "cpu_parallel": False,
+            "pyramid": False,
+            "retain_raw": False,
+        }
+
+        worker = _LocalWorker(env)
+        try:
+            start = time.perf_counter()
+            worker.submit(f"reference-{n}", "esrgan", {**base, "output_name": "reference"})
+            worker.result(f"reference-{n}")
+            full_seconds = time.perf_counter() - start
+
+            # Crash the worker once enough tiles are checkpointed
+            job_id = f"resume-{n}"
+            worker.submit(job_id, "esrgan", {**base, "output_name": "resumed"})
+            saved = checkpoint_dir / job_id / "pass0"
+            while len(list(saved.glob("*.npy"))) < args.kill_after:
+                if worker.process.poll() is not None:
+                    raise RuntimeError("Worker exited before the kill")
+                time.sleep(0.05)
+        finally:
+            worker.kill()
+
+        worker = _LocalWorker(env)
+        try:
+            start = time.perf_counter()
+            worker.submit(job_id, "esrgan", {**base, "output_name": "resumed"})
+            result = worker.result(job_id)
+            resumed_seconds = time.perf_counter() - start
+        finally:
+            worker.close()
+
+        reference = _load_rgb(output_dir / "reference.png")
+        resumed = _load_rgb(output_dir / "resumed.png")
+        rows.append({
+            "image": path.name,
+            "resumed_tiles": result.get("resumed_tiles"),
+            "full_seconds": full_seconds,
+            "resumed_seconds": resumed_seconds,
+            "identical": bool(reference.shape == resumed.shape and np.array_equal(reference, resumed)),
+        })
+
+    print(f"\n{'image':<28} {'resumed':>8} {'full s':>8} {'resumed s':>10} {'identical':>10}")
+    for r in rows:
+        print(
+            f"{r['image'][:28]:<28} {r['resumed_tiles']:>8} {r['full_seconds']:>8.2f} "
+            f"{r['resumed_seconds']:>10.2f} {str(r['identical']):>10}"
+        )
+
+    return {"benchmark": "resume", "kill_after": args.kill_after, "results": rows}
+
+
+def bench_residency(args) -> dict:
+    """
+    Residency transitions and wake-up latency over a simulated job schedule,
+    with stand-in modules in place of the FLUX UNet, VAE and upscale model.
+    """
+    import math
+    import tempfile
+
+    import torch
+
+    from utils.residency import ResidencyManager
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    scratch = Path(tempfile.mkdtemp(prefix="bench-residency-"))
+    width = int(math.sqrt(args.mb * 1024 * 1024 / 4))
+    clock = [0.0]
+    manager = ResidencyManager(args.offload_after, args.release_after, clock=lambda: clock[0])
+    modules = {}
+
+    def register(name):
+        path = scratch / f"{name}.pt"
+        torch.save(torch.nn.Linear(width, width, bias=False).state_dict(), path)
+
+        def load():
+            module = torch.nn.Linear(width, width, bias=False)
+            module.load_state_dict(torch.load(path, mmap=True))
+            modules[name] = module
+
+        def release():
+            modules[name] = None
+
+        load()
+        manager.register(
+            name,
+            to_device=lambda: modules[name].to(device),
+            to_host=lambda: modules[name].to("cpu"),
+            load=load,
+            release=release,
+        )
+
+    for name in ("unet", "vae", "upscale_model"):
+        register(name)
+
+    rows = []
+    print(f"{'t':>8} {'before':<28} {'wake ms':>8}")
+    for at in sorted(args.schedule):
+        # The sweeper runs every --sweep seconds between jobs
+        while clock[0] + args.sweep <= at:
+            clock[0] += args.sweep
+            manager.sweep()
+        clock[0] = at
+        before = {name: s["state"] for name, s in manager.state().items()}
+        if args.prefetch:
+            manager.prefetch(background=False)
+
+        start = time.perf_counter()
+        with manager.use():
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            wake = time.perf_counter() - start
+            clock[0] += args.job_seconds
+
+        rows.append({"t": at, "before": before, "wake_ms": wake * 1000})
+        summary = ",".join(sorted(set(before.values())))
+        print(f"{at:>8.0f} {summary:<28} {wake * 1000:>8.1f}")
+
+    counts = manager.state()
+    print(f"\n{'component':<16} {'state':<10} {'loads':>6} {'to_device':>10} {'to_host':>8} {'releases':>9}")
+    for name, s in counts.items():
+        print(
+            f"{name:<16} {s['state']:<10} {s['loads']:>6} {s['to_device']:>10} "
+            f"{s['to_host']:>8} {s['releases']:>9}"
+        )
+
+    return {
+        "benchmark": "residency",
+        "device": str(device),
+        "module_mb": args.mb,
+        "offload_after": args.offload_after,
+        "release_after": args.release_after,
+        "prefetch": args.prefetch,
+        "jobs": rows,
+        "components": counts,
+    }
+
+
+class _MockImagen:
+    """
+    Local stand-in for the Imagen predict endpoint: rejects requests whose
+    output would exceed max_output_pixels, sleeps `latency` seconds, fails a
+    `failure_rate` fraction of requests with 503 and otherwise answers with
+    a Lanczos upscale.
+    """
+
+    def __init__(self, max_output_pixels: int, latency: float, failure_rate: float, seed: int = 0):
+        import random
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        import numpy as np
+        from PIL import Image
+
+        from utils.image_utils import decode_base64_to_image, encode_array_to_base64
+
+        mock = self
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        rng = random.Random(seed)
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                instance = body["instances"][0]
+                factor = int(body["parameters"]["upscaleConfig"]["upscaleFactor"][1])
+                img = decode_base64_to_image(instance["image"]["bytesBase64Encoded"]).convert("RGB")
+
+                with mock._lock:
+                    mock.requests += 1
+                    mock._in_flight += 1
+                    mock.peak_in_flight = max(mock.peak_in_flight, mock._in_flight)
+                    fail = rng.random() < failure_rate
+                try:
+                    if img.width * img.height * factor ** 2 > max_output_pixels:
+                        with mock._lock:
+                            mock.rejected += 1
+                        self._reply(400, {"error": {"message": "Output image would exceed the size limit"}})
+                        return
+                    time.sleep(latency)
+                    if fail:
+                        with mock._lock:
+                            mock.failed += 1
+                        self._reply(503, {"error": {"message": "Service unavailable"}})
+                        return
+                    out = img.resize((img.width * factor, img.height * factor), Image.LANCZOS)
+                    encoded = encode_array_to_base64(np.asarray(out))
+                    self._reply(200, {"predictions": [{"bytesBase64Encoded": encoded}]})
+                finally:
+                    with mock._lock:
+                        mock._in_flight -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/predict"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_imagen(args) -> dict:
+    """Tiled, concurrent Imagen calls against a local mock endpoint with a size limit."""
+    import tempfile
+
+    import numpy as np
+    from PIL import Image
+
+    from services import imagen_upscaler
+    from utils.metrics import psnr
+
+    imagen_upscaler.IMAGEN_MAX_OUTPUT_PIXELS = args.max_output_pixels
+    imagen_upscaler.IMAGEN_RETRY_BACKOFF_SECONDS = 0.1
+    output_dir = Path(tempfile.mkdtemp(prefix="bench-imagen-"))
+    factor = int(args.upscale_factor[1])
+
+    rows = []
+    print(f"{'image':<28} {'tiling':>7} {'conc':>5} {'tiles':>6} {'retried':>8} {'peak':>5} {'seconds':>8} {'PSNR':>8}")
+    for path in _list_images(args.images):
+        rgb = _load_rgb(path)
+        h, w = rgb.shape[:2]
+        reference = np.asarray(Image.fromarray(rgb).resize((w * factor, h * factor), Image.LANCZOS))
+
+        # One untiled call first: over the limit, the mock rejects it
+        runs = [(False, 1)] + [(True, c) for c in args.concurrency]
+        for tiling, concurrency in runs:
+            mock = _MockImagen(args.max_output_pixels, args.latency, args.failure_rate)
+            upscaler = imagen_upscaler.ImagenUpscaler()
+            upscaler.endpoint = mock.url
+            upscaler.use_auth = False
+            config = {
+                "image_path": str(path),
+                "output_dir": str(output_dir),
+                "output_name": "out",
+                "upscale_factor": args.upscale_factor,
+                "tiling": tiling,
+                "tile_size": args.tile_size,
+                "tile_overlap": args.tile_overlap,
+                "max_concurrency": concurrency,
+                "pyramid": False,
+                "retain_raw": False,
+            }
+            start = time.perf_counter()
+            try:
+                result, error = upscaler.upscale(config), None
+            except imagen_upscaler.ImagenApiError as e:
+                result, error = {}, str(e)
+            seconds = time.perf_counter() - start
+            mock.close()
+
+            row = {
+                "image": path.name,
+                "tiling": tiling,
+                "concurrency": concurrency,
+                "tiles": result.get("tiles"),
+                "tile_retries": result.get("tile_retries"),
+                "requests": mock.requests,
+                "rejected": mock.rejected,
+                "failed": mock.failed,
+                "peak_in_flight": mock.peak_in_flight,
+                "seconds": seconds,
+                "error": error,
+            }
+            if error is None:
+                row["psnr"] = psnr(reference, _load_rgb(Path(result["output_path"])))
+            rows.append(row)
+            quality = f"{row['psnr']:>8.2f}" if error is None else "  failed"
+            print(
+                f"{path.name[:28]:<28} {str(tiling):>7} {concurrency:>5} {str(row['tiles']):>6} "
+                f"{str(row['tile_retries']):>8} {mock.peak_in_flight:>5} {seconds:>8.2f} {quality}"
+            )
+
+    return {
+        "benchmark": "imagen",
+        "max_output_pixels": args.max_output_pixels,
+        "latency": args.latency,
+        "failure_rate": args.failure_rate,
+        "results": rows,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models-dir", default=None, help="Model cache dir (default: $MODEL_CACHE_DIR)")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backends = sub.add_parser("backends", help="int8/onnx vs fp32 quality and throughput on CPU")
+    backends.add_argument("--images", required=True, help="Folder of test images")
+    backends.add_argument("--model", default="4x-UltraSharp.pth")
+    backends.add_argument("--backends", nargs="+", default=["int8", "onnx"], choices=["int8", "onnx"])
+    backends.add_argument("--tile-size", type=int, default=256)
+    backends.add_argument("--tile-overlap", type=int, default=32)
+    backends.set_defaults(func=bench_backends)
+
+    model_load = sub.add_parser("model-load", help=".pth vs mmap safetensors load time")
+    model_load.add_argument("--model", default="4x-UltraSharp.pth")
+    model_load.add_argument("--repeats", type=int, default=5)
+    model_load.set_defaults(func=bench_model_load)
+
+    protocol = sub.add_parser("protocol", help="jsonl vs framed worker channel throughput")
+    protocol.add_argument("--count", type=int, default=50000)
+    protocol.set_defaults(func=bench_protocol)
+
+    ingest = sub.add_parser("ingest", help="header probe and single-decode ingest vs old decoders")
+    ingest.add_argument("--images", required=True, help="Folder of test images")
+    ingest.add_argument("--repeats", type=int, default=5)
+    ingest.set_defaults(func=bench_ingest)
+
+    cpu_pool = sub.add_parser("cpu-pool", help="single-process tiling vs the CPU process pool")
+    cpu_pool.add_argument("--images", required=True, help="Folder of test images")
+    cpu_pool.add_argument("--model", default="4x-UltraSharp.pth")
+    cpu_pool.add_argument("--splits", nargs="*", default=[], help="Extra PROCESSESxTHREADS splits to try")
+    cpu_pool.add_argument("--tile-size", type=int, default=256)
+    cpu_pool.add_argument("--tile-overlap", type=int, default=32)
+    cpu_pool.set_defaults(func=bench_cpu_pool)
+
+    split = sub.add_parser("split", help="single-worker job vs the same job sharded across local workers")
+    split.add_argument("--images", required=True, help="Folder of test images")
+    split.add_argument("--model", default="4x-UltraSharp.pth")
+    split.add_argument("--workers", type=int, default=2)
+    split.add_argument("--shards", type=int, default=None, help="Default: one per worker")
+    split.add_argument("--tile-size", type=int, default=512)
+    split.add_argument("--upscale-factor", type=int, default=4)
+    split.set_defaults(func=bench_split)
+
+    adaptive = sub.add_parser("adaptive", help="flat-tile skipping and dedup vs full model runs")
+    adaptive.add_argument("--images", required=True, help="Folder of test images")
+    adaptive.add_argument("--model", default="4x-UltraSharp.pth")
+    adaptive.add_argument(
+        "--thresholds", nargs="+", type=float, default=[0.0, 0.005, 0.01, 0.02],
+        help="flat_threshold values; 0 measures deduplication alone",
+    )
+    adaptive.add_argument("--tile-size", type=int, default=256)
+    adaptive.add_argument("--tile-overlap", type=int, default=32)
+    adaptive.set_defaults(func=bench_adaptive)
+
+    resume = sub.add_parser("resume", help="kill a worker mid-job and resume from its tile checkpoint")
+    resume.add_argument("--images", required=True, help="Folder of test images")
+    resume.add_argument("--model", default="4x-UltraSharp.pth")
+    resume.add_argument("--kill-after", type=int, default=4, help="Checkpointed tiles before the kill")
+    resume.add_argument("--checkpoint-every", type=int, default=2)
+    resume.add_argument("--tile-size", type=int, default=256)
+    resume.add_argument("--upscale-factor", type=int, default=4)
+    resume.set_defaults(func=bench_resume)
+
+    residency = sub.add_parser("residency", help="idle offload/release of stand-in models over a job schedule")
+    residency.add_argument(
+        "--schedule", nargs="+", type=float, default=[0, 60, 400, 2500],
+        help="Simulated job start times in seconds",
+    )
+    residency.add_argument("--job-seconds", type=float, default=30)
+    residency.add_argument("--offload-after", type=float, default=300)
+    residency.add_argument("--release-after", type=float, default=1800)
+    residency.add_argument("--sweep", type=float, default=15, help="Simulated sweep interval")
+    residency.add_argument("--mb", type=float, default=64, help="Size of each stand-in module")
+    residency.add_argument("--prefetch", action="store_true", help="Prefetch before each job")
+    residency.set_defaults(func=bench_residency)
+
+    imagen = sub.add_parser("imagen", help="tiled concurrent Imagen calls vs one call, against a local mock")
+    imagen.add_argument("--images", required=True, help="Folder of test images")
+    imagen.add_argument("--upscale-factor", default="x2", choices=["x2", "x3", "x4"])
+    imagen.add_argument("--max-output-pixels", type=int, default=1_000_000, help="Mock endpoint's output limit")
+    imagen.add_argument("--latency", type=float, default=0.5, help="Mock seconds per request")
+    imagen.add_argument("--failure-rate", type=float, default=0.1, help="Mock fraction of 503 responses")
+    imagen.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    imagen.add_argument("--tile-size", type=int, default=None, help="Default: the largest within the limit")
+    imagen.add_argument("--tile-overlap", type=int, default=64)
+    imagen.set_defaults(func=bench_imagen)
+
+    args = parser.parse_args()
+    report = args.func(args)
+    _write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Quality-versus-cost evaluation of upscaler settings.
+
+Downscales a folder of high-resolution references by --scale, runs each
+setting on the downscaled copies through the real upscaler classes and
+scores the outputs against the references (PSNR, SSIM, GMSD) next to what
+they cost: wall time, peak memory and pixels run through the model. The
+report marks the Pareto-optimal settings (no other setting is both cheaper
+and better) and the cheapest one that meets the quality bars, e.g. to
+choose between fp16 and fp32, tile sizes, flat-tile skipping or int8.
+
+Settings come from a JSON file holding a list of
+  {"name": "...", "method": "esrgan|flux|imagen|bicubic", "config": {...}}
+or default to an ESRGAN sweep over those options. --stand-in writes a small
+ESRGAN-architecture model (smooth upsampling with a perturbed trunk) in
+place of the real weights, so the harness runs offline on CPU.
+
+Usage:
+  python evaluate.py --references ./hr --scale 4
+  python evaluate.py --references ./hr --settings settings.json --min-psnr 30 --report report.md
+  python evaluate.py --references ./hr --stand-in --scale 2
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from autotune import PeakMemory
+from bench import _list_images, _load_rgb, _write_report
+
+QUALITY_METRICS = {"psnr": True, "ssim": True, "gmsd": False}  # name -> higher is better
+COST_METRICS = ["seconds", "peak_memory_mb", "pixels_computed"]
+
+
+def write_stand_in(path: Path, num_filters: int = 16, num_blocks: int = 2, noise: float = 0.005, seed: int = 0):
+    """
+    Save a 4x ESRGAN state dict that upsamples smoothly (nearest, then a
+    3x3 blur per upconv) plus a trunk of small random weights, so settings
+    differ in output the way they would with a trained model.
+    """
+    import torch
+    from spandrel.architectures.ESRGAN import ESRGAN
+
+    torch.manual_seed(seed)
+    state = ESRGAN(in_nc=3, out_nc=3, num_filters=num_filters, num_blocks=num_blocks, scale=4).state_dict()
+    identity = torch.zeros(3, 3)
+    identity[1, 1] = 1.0
+    blur = torch.tensor([[1.0, 2.0, 1.0], [2.0, 4.0, 2.0], [1.0, 2.0, 1.0]]) / 16
+
+    for key, value in state.items():
+        value.zero_()
+        if key.startswith("model.1.") and key.endswith("weight"):
+            value.normal_(0, noise)
+        elif key.endswith("weight"):
+            kernel = blur if key in ("model.3.weight", "model.6.weight") else identity
+            for c in range(3):
+                value[c, c] = kernel
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(state, path)
+
+
+def default_settings(model: str, cuda: bool) -> list:
+    """ESRGAN variants worth trading off, with a bicubic floor."""
+    base = {"model": model, "tile_size": 512, "tile_overlap": 32, "tile_batch": 1, "use_fp16": False}
+    settings = [
+        {"name": "bicubic", "method": "bicubic", "config": {}},
+        {"name": "fp32", "method": "esrgan", "config": base},
+        {"name": "tile256", "method": "esrgan", "config": {**base, "tile_size": 256}},
+        {"name": "flat0.01", "method": "esrgan", "config": {**base, "flat_threshold": 0.01}},
+        {"name": "int8", "method": "esrgan", "config": {**base, "backend": "int8"}},
+        {"name": "onnx", "method": "esrgan", "config": {**base, "backend": "onnx"}},
+    ]
+    if cuda:
+        settings.insert(2, {"name": "fp16", "method": "esrgan", "config": {**base, "use_fp16": True}})
+    return settings
+
+
+def prepare_references(paths: list, scale: int, lr_dir: Path) -> list:
+    """Crop each reference to a multiple of scale and write its downscaled (bicubic) copy."""
+    from PIL import Image
+
+    pairs = []
+    for path in paths:
+        hr = _load_rgb(path)
+        h, w = hr.shape[0] // scale * scale, hr.shape[1] // scale * scale
+        hr = hr[:h, :w]
+        lr_path = lr_dir / f"{path.stem}.png"
+        Image.fromarray(hr).resize((w // scale, h // scale), Image.BICUBIC).save(lr_path)
+        pairs.append((path.name, hr, lr_path))
+    return pairs
+
+
+class Runner:
+    """Upscaler instances shared across settings, so models stay loaded between runs."""
+
+    def __init__(self, models_dir: str, output_dir: Path):
+        self.models_dir = models_dir
+        self.output_dir = output_dir
+        self.upscalers = {}
+        self.pixels = 0
+
+    def _esrgan(self):
+        from services.esrgan_upscaler import EsrganUpscaler
+
+        upscaler = EsrganUpscaler(self.models_dir)
+        upscale_region = upscaler._upscale_region
+        runner = self
+
+        # Count the input pixels of every model call; tiles skipped as flat
+        # or duplicate never reach the model
+        class CountingModel:
+            def __init__(self, model):
+                self._model = model
+
+            def __call__(self, x):
+                runner.pixels += x.shape[0] * x.shape[2] * x.shape[3]
+                return self._model(x)
+
+            def __getattr__(self, name):
+                return getattr(self._model, name)
+
+        upscaler._upscale_region = lambda model, *args, **kwargs: upscale_region(
+            CountingModel(model), *args, **kwargs
+        )
+        return upscaler
+
+    def _upscaler(self, method: str):
+        if method not in self.upscalers:
+            if method == "esrgan":
+                self.upscalers[method] = self._esrgan()
+            elif method == "flux":
+                from services.flux_upscaler import FluxUpscaler
+                self.upscalers[method] = FluxUpscaler(self.models_dir)
+            elif method == "imagen":
+                from services.imagen_upscaler import ImagenUpscaler
+                self.upscalers[method] = ImagenUpscaler()
+            else:
+                raise ValueError(f"Unknown method: {method}")
+        return self.upscalers[method]
+
+    def run(self, setting: dict, lr_path: Path, scale: int):
+        """Upscale one image with one setting; returns (uint8 output, pixels computed or None)."""
+        import numpy as np
+        from PIL import Image
+
+        method = setting["method"]
+        if method == "bicubic":
+            with Image.open(lr_path) as img:
+                out = img.convert("RGB").resize((img.width * scale, img.height * scale), Image.BICUBIC)
+            return np.asarray(out), 0
+
+        scale_key = {"esrgan": ("upscale_factor", scale), "flux": ("upscale_by", scale)}.get(
+            method, ("upscale_factor", f"x{scale}")
+        )
+        config = {
+            **setting.get("config", {}),
+            "image_path": str(lr_path),
+            "output_dir": str(self.output_dir),
+            "output_name": f"{setting['name']}-{lr_path.stem}",
+            "output_format": "png",
+            scale_key[0]: scale_key[1],
+        }
+        self.pixels = 0
+        result = self._upscaler(method).upscale(config)
+        # Only ESRGAN is counted, and not when tiles run in the CPU process pool
+        pixels = self.pixels if method == "esrgan" and self.pixels else None
+        return _load_rgb(Path(result["output_path"])), pixels
+
+
+def pareto_front(rows: list, cost: str, quality: str) -> set:
+    """Names of the rows no other row beats on both cost and quality."""
+    higher = QUALITY_METRICS[quality]
+    usable = [r for r in rows if r.get(cost) is not None and r.get(quality) is not None]
+
+    def better_or_equal(a, b):
+        q_ok = a[quality] >= b[quality] if higher else a[quality] <= b[quality]
+        return a[cost] <= b[cost] and q_ok
+
+    def strictly_better(a, b):
+        q = a[quality] > b[quality] if higher else a[quality] < b[quality]
+        return a[cost] < b[cost] or q
+
+    return {
+        r["name"] for r in usable
+        if not any(better_or_equal(o, r) and strictly_better(o, r) for o in usable if o is not r)
+    }
+
+
+def meets_bars(row: dict, args) -> bool:
+    if "error" in row:
+        return False
+    return (
+        (args.min_psnr is None or row["psnr"] >= args.min_psnr)
+        and (args.min_ssim is None or row["ssim"] >= args.min_ssim)
+        and (args.max_gmsd is None or row["gmsd"] <= args.max_gmsd)
+    )
+
+
+def markdown_report(summary: list, args, recommended: str | None) -> str:
+    def fmt(value, spec):
+        return "" if value is None else format(value, spec)
+
+    lines = [
+        f"# Upscaler evaluation ({args.scale}x, {summary[0]['images'] if summary else 0} images)",
+        "",
+        f"Pareto front: {args.cost} vs {args.quality}. "
+        f"Bars: PSNR >= {args.min_psnr}, SSIM >= {args.min_ssim}, GMSD <= {args.max_gmsd}.",
+        "",
+        "| setting | method | PSNR | SSIM | GMSD | seconds | peak MB | MP computed | Pareto | meets bars |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for r in summary:
+        if "error" in r:
+            lines.append(f"| {r['name']} | {r['method']} | error: {r['error']} | | | | | | | |")
+            continue
+        pixels = r["pixels_computed"] / 1e6 if r["pixels_computed"] is not None else None
+        lines.append(
+            f"| {r['name']} | {r['method']} | {r['psnr']:.2f} | {r['ssim']:.4f} | {r['gmsd']:.4f} "
+            f"| {r['seconds']:.2f} | {fmt(r['peak_memory_mb'], '.0f')} | {fmt(pixels, '.2f')} "
+            f"| {'yes' if r['pareto'] else ''} | {'yes' if r['meets_bars'] else ''} |"
+        )
+    lines += ["", f"Cheapest setting meeting the bars by {args.cost}: {recommended or 'none'}"]
+    return "\n".join(lines) + "\n"
+
+
+def evaluate(args) -> dict:
+    import torch
+
+    from utils.memory_policy import rss_mb
+    from utils.metrics import gmsd, psnr, ssim
+
+    work_dir = Path(tempfile.mkdtemp(prefix="evaluate-"))
+    models_dir = args.models_dir
+    if args.stand_in:
+        models_dir = str(work_dir / "models")
+        write_stand_in(work_dir / "models" / "upscale_models" / args.model)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.settings:
+        settings = json.loads(Path(args.settings).read_text())
+    else:
+        settings = default_settings(args.model, device.type == "cuda")
+
+    lr_dir = work_dir / "lr"
+    lr_dir.mkdir()
+    (work_dir / "out").mkdir()
+    pairs = prepare_references(_list_images(args.references), args.scale, lr_dir)
+    runner = Runner(models_dir, work_dir / "out")
+
+    print(f"Evaluating {len(settings)} settings on {len(pairs)} images at {args.scale}x on {device}")
+    print(f"{'setting':<16} {'image':<24} {'PSNR':>7} {'SSIM':>7} {'GMSD':>7} {'seconds':>8} {'peak MB':>8}")
+    rows = []
+    for setting in settings:
+        try:
+            if args.warmup:
+                # Model loading and first-call setup stay out of the timings
+                runner.run(setting, pairs[0][2], args.scale)
+            for name, hr, lr_path in pairs:
+                rss_before = rss_mb()
+                with PeakMemory(device) as mem:
+                    start = time.perf_counter()
+                    out, pixels = runner.run(setting, lr_path, args.scale)
+                    seconds = time.perf_counter() - start
+                peak = mem.peak_mb if device.type == "cuda" else max(0.0, mem.peak_mb - rss_before)
+                if out.shape != hr.shape:
+                    raise ValueError(f"Output is {out.shape[1]}x{out.shape[0]}, expected {hr.shape[1]}x{hr.shape[0]}")
+                row = {
+                    "name": setting["name"],
+                    "method": setting["method"],
+                    "image": name,
+                    "psnr": psnr(hr, out),
+                    "ssim": ssim(hr, out),
+                    "gmsd": gmsd(hr, out),
+                    "seconds": seconds,
+                    "peak_memory_mb": peak if mem.peak_mb else None,
+                    "pixels_computed": pixels,
+                }
+                rows.append(row)
+                print(
+                    f"{setting['name'][:16]:<16} {name[:24]:<24} {row['psnr']:>7.2f} {row['ssim']:>7.4f} "
+                    f"{row['gmsd']:>7.4f} {seconds:>8.2f} {peak:>8.0f}"
+                )
+        except Exception as e:
+            rows.append({"name": setting["name"], "method": setting["method"], "error": str(e)})
+            print(f"{setting['name'][:16]:<16} error: {e}")
+
+    summary = []
+    for setting in settings:
+        mine = [r for r in rows if r["name"] == setting["name"]]
+        errors = [r["error"] for r in mine if "error" in r]
+        if errors:
+            summary.append({"name": setting["name"], "method": setting["method"], "error": errors[0]})
+            continue
+        peaks = [r["peak_memory_mb"] for r in mine if r["peak_memory_mb"] is not None]
+        pixels = [r["pixels_computed"] for r in mine]
+        summary.append({
+            "name": setting["name"],
+            "method": setting["method"],
+            "images": len(mine),
+            **{m: sum(r[m] for r in mine) / len(mine) for m in QUALITY_METRICS},
+            "seconds": sum(r["seconds"] for r in mine),
+            "peak_memory_mb": max(peaks) if peaks else None,
+            "pixels_computed": sum(pixels) if None not in pixels else None,
+        })
+
+    front = pareto_front([s for s in summary if "error" not in s], args.cost, args.quality)
+    for s in summary:
+        s["pareto"] = s["name"] in front
+        s["meets_bars"] = meets_bars(s, args)
+    passing = [s for s in summary if s["meets_bars"] and s.get(args.cost) is not None]
+    recommended = min(passing, key=lambda s: s[args.cost])["name"] if passing else None
+    summary.sort(key=lambda s: (s.get(args.cost) is None, s.get(args.cost) or 0))
+
+    report = markdown_report(summary, args, recommended)
+    print()
+    print(report)
+    if args.report:
+        Path(args.report).write_text(report)
+        print(f"Markdown report written to {args.report}")
+
+    return {
+        "scale": args.scale,
+        "device": str(device),
+        "stand_in": args.stand_in,
+        "cost": args.cost,
+        "quality": args.quality,
+        "recommended": recommended,
+        "settings": summary,
+        "results": rows,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--references", required=True, help="Folder of high-resolution reference images")
+    parser.add_argument("--scale", type=int, default=4, help="Downscale factor, and the factor to upscale back by")
+    parser.add_argument("--settings", default=None, help="JSON list of settings (default: an ESRGAN sweep)")
+    parser.add_argument("--model", default="4x-UltraSharp.pth", help="ESRGAN model for the default settings")
+    parser.add_argument("--models-dir", default=None, help="Model directory (default: MODEL_CACHE_DIR)")
+    parser.add_argument("--stand-in", action="store_true", help="Use a small generated ESRGAN model (offline, CPU)")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="Time each setting's first run too")
+    parser.add_argument("--cost", default="seconds", choices=COST_METRICS)
+    parser.add_argument("--quality", default="psnr", choices=list(QUALITY_METRICS))
+    parser.add_argument("--min-psnr", type=float, default=None)
+    parser.add_argument("--min-ssim", type=float, default=None)
+    parser.add_argument("--max-gmsd", type=float, default=None)
+    parser.add_argument("--report", default=None, help="Write the Markdown report here")
+    parser.add_argument("--output", default=None, help="Write the full results as JSON here")
+    args = parser.parse_args()
+
+    _write_report(evaluate(args), args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
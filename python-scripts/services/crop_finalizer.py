@@ -0,0 +1,77 @@
+"""
+Crop Finalizer Service.
+
+Applies a customer-chosen crop offset to a previous job's oversized output
+without touching any model: the retained raw output (utils/raw_store.py)
+is memory-mapped and only the final print window is encoded.
+"""
+
+import os
+import time
+from pathlib import Path
+
+from utils.image_utils import save_image_formats
+from utils.raw_store import RawStore
+from utils.tile_pyramid import build_for_output
+
+
+class CropFinalizer:
+    def __init__(self):
+        self.raw_store = RawStore()
+
+    def finalize(self, config: dict) -> dict:
+        """
+        Crop a retained output to its final print rectangle.
+
+        Args:
+            config: dict with keys:
+                - source_job_id (str): output_name of the job whose raw output was retained
+                - crop_offset (int): Offset in pixels along the cropped axis,
+                  0..crop_info.amount_px
+                - output_dir (str): Output directory
+                - output_name (str, optional): Base output filename
+                - output_format (str, optional): "png" or "tiff", default: the source job's format
+                - pyramid (bool): Write a deep-zoom tile pyramid and preview,
+                  default PYRAMID_ENABLED (off)
+
+        Returns:
+            dict with output_path, output_width, output_height, crop_info, pyramid
+        """
+        start_time = time.time()
+
+        source = config["source_job_id"]
+        output_dir = Path(config.get("output_dir", os.environ.get("OUTPUT_DIR", "/app/results")))
+
+        raw, meta = self.raw_store.open(source)
+        crop_info = dict(meta["crop_info"])
+        amount = crop_info["amount_px"]
+
+        offset = int(config["crop_offset"])
+        if not 0 <= offset <= amount:
+            raise ValueError(f"crop_offset must be between 0 and {amount}, got {offset}")
+
+        # A view into the mmap: only the final window is read and encoded
+        height, width = raw.shape[:2]
+        if crop_info["direction"] == "horizontal":
+            window = raw[:, offset:offset + width - amount]
+        else:
+            window = raw[offset:offset + height - amount]
+
+        output_name = config.get("output_name", f"{source}_crop{offset}")
+        output_formats = [config.get("output_format") or meta.get("output_format", "png")]
+        saved_paths = save_image_formats(window, output_name, str(output_dir), output_formats)
+        pyramid = build_for_output(config, output_name, str(output_dir), window)
+
+        crop_info.update(policy="offset", offset_px=offset)
+        output_height, output_width = window.shape[:2]
+        del window, raw
+
+        return {
+            "output_path": saved_paths[0] if saved_paths else None,
+            "output_paths": saved_paths,
+            "output_width": output_width,
+            "output_height": output_height,
+            "crop_info": crop_info,
+            "pyramid": pyramid,
+            "processing_time": time.time() - start_time,
+        }
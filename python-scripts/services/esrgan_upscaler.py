@@ -5,60 +5,111 @@ Extracted from resolution-upscaling/real_esrgan_upscaler.ipynb.
 Uses spandrel for model loading with tiled processing and blending.
 """
 
-import gc
 import os
 import time
 import numpy as np
 import torch
-import cv2
 from pathlib import Path
 from PIL import Image
-from spandrel import ImageModelDescriptor, ModelLoader
 
+from utils.cpu_tile_pool import CPU_TILE_PARALLEL, CpuTilePool, plan_split, tile_rate
+from utils.crop_planner import plan_crop, resample_region, source_box
 from utils.dimension_calculator import calculate_scale_for_crop
+from utils.image_ingest import load_image, pick_draft_factor, probe_image
 from utils.image_utils import save_image_formats
+from utils.job_checkpoint import JobCheckpoint
+from utils.job_context import JobContext
+from utils.memory_policy import policy as memory_policy
+from utils.model_store import ModelStore
+from utils.onnx_runtime import load_or_export
+from utils.quantization import load_or_quantize
+from utils.raw_store import retain_for_crop
+from utils.tile_analysis import AdaptiveTiles
+from utils.tile_pyramid import build_for_output
+from utils.tile_store import TileStore
+from utils.tuning_profiles import tuned_defaults
+from utils.tiling import shard_tiles, tile_grid, tiles_area, tiles_extent, tiles_in_region
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+CPU = torch.device("cpu")
+
+BACKENDS = ("torch", "int8", "onnx")
 
 
 class EsrganUpscaler:
     def __init__(self, models_dir: str = None):
         self.models_dir = Path(models_dir or os.environ.get("MODEL_CACHE_DIR", "/app/models"))
         self.upscale_models_dir = self.models_dir / "upscale_models"
+        self.model_store = ModelStore(self.upscale_models_dir)
         self._loaded_model = None
         self._loaded_model_name = None
+        self._loaded_model_half = False
+        self._backend_models = {}
+        self._cpu_pool = None
+        self.tile_store = TileStore()
 
-    def _clear_memory(self):
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.ipc_collect()
-        gc.collect()
+    def _clear_memory(self, force: bool = False):
+        """Full collection if forced or the memory policy's thresholds are crossed."""
+        memory_policy.release(force)
 
     def _load_model(self, model_name: str, use_fp16: bool = True):
-        """Load upscale model via spandrel, caching for reuse."""
+        """Load upscale model via the safetensors store, caching for reuse."""
+        half = use_fp16 and DEVICE.type == "cuda"
         if self._loaded_model_name == model_name and self._loaded_model is not None:
-            return self._loaded_model
+            if self._loaded_model_half == half:
+                return self._loaded_model
 
         # Unload previous model
         if self._loaded_model is not None:
             del self._loaded_model
-            self._clear_memory()
+            self._clear_memory(force=True)
 
         model_path = self.upscale_models_dir / model_name
         if not model_path.exists():
             raise FileNotFoundError(f"Model not found: {model_path}")
 
-        model = ModelLoader().load_from_file(str(model_path))
-        assert isinstance(model, ImageModelDescriptor), "Not an image model!"
+        model = self.model_store.load(model_name)
 
         model = model.to(DEVICE)
-        if use_fp16 and DEVICE.type == "cuda":
+        if half:
             model = model.half()
         model.eval()
 
         self._loaded_model = model
         self._loaded_model_name = model_name
+        self._loaded_model_half = half
+        return model
+
+    def _model_scale(self, model_name: str, use_fp16: bool) -> int:
+        """Model scale from the store manifest, loading the model if it isn't there."""
+        entry = self.model_store.entry(model_name)
+        if entry is not None:
+            return int(entry["scale"])
+        return self._load_model(model_name, use_fp16).scale
+
+    def _load_backend_model(self, model_name: str, backend: str):
+        """
+        Load the CPU variant of a model for a non-torch backend.
+
+        "int8" quantizes the model on first use, calibrated on a fixed
+        synthetic tile set (see utils/quantization.py). "onnx" exports it to ONNX and runs it with
+        ONNX Runtime. Both are cached on disk next to the .pth so later
+        workers skip the conversion.
+        """
+        key = (backend, model_name)
+        if key in self._backend_models:
+            return self._backend_models[key]
+
+        model_path = self.upscale_models_dir / model_name
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model not found: {model_path}")
+
+        if backend == "int8":
+            model = load_or_quantize(model_path, lambda: self._load_model(model_name))
+        else:
+            model = load_or_export(model_path, lambda: self._load_model(model_name))
+
+        self._backend_models[key] = model
         return model
 
     def _upscale_with_tiles(
@@ -67,68 +118,258 @@ class EsrganUpscaler:
         img_tensor: torch.Tensor,
         tile_size: int,
         tile_overlap: int,
+        ctx: JobContext = None,
     ) -> torch.Tensor:
-        """Upscale image using tiled processing with feathered blending."""
+        """
+        Upscale image using tiled processing with feathered blending.
+
+        If a job context is given, ctx.checkpoint() runs before every tile so
+        the job can be cancelled or preempted between tiles.
+        """
+        return self._upscale_region(model, img_tensor, tile_size, tile_overlap, ctx)["output"]
+
+    def _upscale_region(
+        self,
+        model,
+        img_tensor: torch.Tensor,
+        tile_size: int,
+        tile_overlap: int,
+        ctx: JobContext = None,
+        region: tuple = None,
+        origin: tuple = (0, 0),
+        full_size: tuple = None,
+        tile_runner=None,
+    ) -> dict:
+        """
+        Tiled upscale that only runs the tiles intersecting `region`.
+
+        img_tensor may be a crop of a larger image: origin is its (y, x)
+        offset in that image and full_size the image's (h, w). The tile grid
+        is laid out over the full image, so pixels inside the region come
+        out exactly as in an unrestricted run.
+
+        Args:
+            region: (y1, y2, x1, x2) in full-image input pixels, or None for all
+            tile_runner: callable(img_tensor, tiles, origin, ctx) yielding
+                (tile, output) in tile order, e.g. CpuTilePool.runner();
+                default runs tiles one by one on the model's device
+
+        Returns:
+            dict with output (tensor covering extent * scale), extent
+            (y1, y2, x1, x2 of the tiles run), area_run and area_total
+            (input pixels processed vs. a full run), tiles and
+            tiles_per_second
+        """
         scale = model.scale
-        _, _, h, w = img_tensor.shape
+        h, w = full_size or img_tensor.shape[2:]
+        started = time.time()
+
+        if ctx is not None:
+            ctx.checkpoint()
 
         if h <= tile_size and w <= tile_size:
             with torch.no_grad():
-                return model(img_tensor)
-
-        out_h, out_w = h * scale, w * scale
-        output = torch.zeros(
-            (1, 3, out_h, out_w), device=img_tensor.device, dtype=img_tensor.dtype
-        )
-        weight = torch.zeros(
-            (1, 1, out_h, out_w), device=img_tensor.device, dtype=img_tensor.dtype
-        )
-
-        stride = tile_size - tile_overlap
-        h_tiles = max(1, (h - tile_overlap) // stride + (1 if (h - tile_overlap) % stride else 0))
-        w_tiles = max(1, (w - tile_overlap) // stride + (1 if (w - tile_overlap) % stride else 0))
-
-        for i in range(h_tiles):
-            for j in range(w_tiles):
-                y1 = min(i * stride, h - tile_size) if h > tile_size else 0
-                x1 = min(j * stride, w - tile_size) if w > tile_size else 0
-                y2 = min(y1 + tile_size, h)
-                x2 = min(x1 + tile_size, w)
-
-                tile = img_tensor[:, :, y1:y2, x1:x2]
-                with torch.no_grad():
-                    tile_out = model(tile)
-
-                out_y1, out_y2 = y1 * scale, y2 * scale
-                out_x1, out_x2 = x1 * scale, x2 * scale
-
-                tile_h, tile_w = tile_out.shape[2:]
-                mask = torch.ones(
-                    (1, 1, tile_h, tile_w), device=tile_out.device, dtype=tile_out.dtype
-                )
+                output = model(img_tensor)
+            return {
+                "output": output,
+                "extent": (0, h, 0, w),
+                "area_run": h * w,
+                "area_total": h * w,
+                "tiles": 1,
+                "tiles_per_second": tile_rate(1, started),
+            }
+
+        tiles = tile_grid(h, w, tile_size, tile_overlap)
+        selected = tiles if region is None else tiles_in_region(tiles, region)
+        ey1, ey2, ex1, ex2 = tiles_extent(selected)
+
+        # Accumulators come from the memory policy's pool, reused across jobs
+        out_h, out_w = (ey2 - ey1) * scale, (ex2 - ex1) * scale
+        buffers = memory_policy.buffers
+        output = buffers.take((1, 3, out_h, out_w), img_tensor.device, img_tensor.dtype)
+        weight = buffers.take((1, 1, out_h, out_w), img_tensor.device, img_tensor.dtype)
+
+        run_tiles = tile_runner or (lambda *args: self._run_tiles(model, *args))
+        for t, tile_out in run_tiles(img_tensor, selected, origin, ctx):
+            i, j = t["i"], t["j"]
+            y1, y2, x1, x2 = t["y1"], t["y2"], t["x1"], t["x2"]
+            tile_out = tile_out.to(output.device, output.dtype)
+
+            out_y1, out_y2 = (y1 - ey1) * scale, (y2 - ey1) * scale
+            out_x1, out_x2 = (x1 - ex1) * scale, (x2 - ex1) * scale
+
+            tile_h, tile_w = tile_out.shape[2:]
+            mask = torch.ones(
+                (1, 1, tile_h, tile_w), device=tile_out.device, dtype=tile_out.dtype
+            )
+
+            feather = tile_overlap * scale // 2
+            if feather > 0:
+                if i > 0:
+                    for k in range(feather):
+                        mask[:, :, k, :] *= k / feather
+                if i < t["rows"] - 1:
+                    for k in range(feather):
+                        mask[:, :, -(k + 1), :] *= k / feather
+                if j > 0:
+                    for k in range(feather):
+                        mask[:, :, :, k] *= k / feather
+                if j < t["cols"] - 1:
+                    for k in range(feather):
+                        mask[:, :, :, -(k + 1)] *= k / feather
+
+            output[:, :, out_y1:out_y2, out_x1:out_x2] += tile_out * mask
+            weight[:, :, out_y1:out_y2, out_x1:out_x2] += mask
+
+        blended = output / weight.clamp(min=1e-8)
+        buffers.give(output)
+        buffers.give(weight)
+        return {
+            "output": blended,
+            "extent": (ey1, ey2, ex1, ex2),
+            "area_run": tiles_area(selected),
+            "area_total": tiles_area(tiles),
+            "tiles": len(selected),
+            "tiles_per_second": tile_rate(len(selected), started),
+        }
 
-                feather = tile_overlap * scale // 2
-                if feather > 0:
-                    if i > 0:
-                        for k in range(feather):
-                            mask[:, :, k, :] *= k / feather
-                    if i < h_tiles - 1:
-                        for k in range(feather):
-                            mask[:, :, -(k + 1), :] *= k / feather
-                    if j > 0:
-                        for k in range(feather):
-                            mask[:, :, :, k] *= k / feather
-                    if j < w_tiles - 1:
-                        for k in range(feather):
-                            mask[:, :, :, -(k + 1)] *= k / feather
-
-                output[:, :, out_y1:out_y2, out_x1:out_x2] += tile_out * mask
-                weight[:, :, out_y1:out_y2, out_x1:out_x2] += mask
-
-        output = output / weight.clamp(min=1e-8)
-        return output
-
-    def upscale(self, config: dict) -> dict:
+    def _run_tiles(
+        self,
+        model,
+        img_tensor: torch.Tensor,
+        tiles: list[dict],
+        origin: tuple,
+        ctx: JobContext = None,
+        batch: int = 1,
+    ):
+        """
+        Run tiles in order, yielding (tile, output). With batch > 1, up to
+        that many consecutive tiles of the same size go through the model
+        in one call.
+        """
+        oy, ox = origin
+        n = 0
+        while n < len(tiles):
+            if ctx is not None and n:
+                ctx.checkpoint()
+            size = (tiles[n]["y2"] - tiles[n]["y1"], tiles[n]["x2"] - tiles[n]["x1"])
+            group = [tiles[n]]
+            for t in tiles[n + 1:n + batch]:
+                if (t["y2"] - t["y1"], t["x2"] - t["x1"]) != size:
+                    break
+                group.append(t)
+
+            crops = [img_tensor[:, :, t["y1"] - oy:t["y2"] - oy, t["x1"] - ox:t["x2"] - ox] for t in group]
+            with torch.no_grad():
+                out = model(torch.cat(crops) if len(crops) > 1 else crops[0])
+            for k, t in enumerate(group):
+                yield t, out[k:k + 1]
+            n += len(group)
+
+    def _cpu_tile_pool(
+        self, config: dict, device: torch.device, backend: str, model_name: str
+    ) -> CpuTilePool | None:
+        """
+        The process pool for CPU tile parallelism, or None when it does not
+        apply: GPU runs, non-torch backends, one-core machines, or jobs
+        that don't enable it (config cpu_parallel, default
+        CPU_TILE_PARALLEL). The pool is kept for later jobs.
+        """
+        if device.type != "cpu" or backend != "torch" or not config.get("cpu_parallel", CPU_TILE_PARALLEL):
+            return None
+        processes, threads = plan_split()
+        if processes < 2:
+            return None
+        if self._cpu_pool is not None and (self._cpu_pool.processes, self._cpu_pool.threads) != (processes, threads):
+            self._cpu_pool.shutdown()
+            self._cpu_pool = None
+        if self._cpu_pool is None:
+            self._cpu_pool = CpuTilePool(self.upscale_models_dir, processes, threads, preload=model_name)
+        return self._cpu_pool
+
+    def _plan_roi(
+        self,
+        roi: dict,
+        h: int,
+        w: int,
+        scale: int,
+        resize_to: tuple,
+        use_two_pass: bool,
+        tile_size_pass2: int,
+        tile_overlap: int,
+    ) -> dict:
+        """
+        Work back from the crop: the input region the final resize reads,
+        then (for two passes) the first-pass region that feeds it.
+
+        Returns:
+            dict with box (resize box in model output pixels), region (last
+            pass input region), pass1_region and last_size (last pass input
+            (h, w))
+        """
+        last_h, last_w = (h * scale, w * scale) if use_two_pass else (h, w)
+        model_out_size = (last_w * scale, last_h * scale)
+        box = source_box(roi["rect"], resize_to, model_out_size)
+        region = resample_region(box, resize_to, model_out_size, scale)
+
+        pass1_region = region
+        if use_two_pass:
+            pass2_tiles = tiles_in_region(
+                tile_grid(last_h, last_w, tile_size_pass2, tile_overlap), region
+            )
+            ey1, ey2, ex1, ex2 = tiles_extent(pass2_tiles)
+            pass1_region = (ey1 // scale, -(-ey2 // scale), ex1 // scale, -(-ex2 // scale))
+
+        return {"box": box, "region": region, "pass1_region": pass1_region, "last_size": (last_h, last_w)}
+
+    def _run_shard(
+        self,
+        model,
+        img_tensor: torch.Tensor,
+        tile_size: int,
+        tile_overlap: int,
+        split: dict,
+        ctx: JobContext = None,
+        tile_runner=None,
+        region: tuple = None,
+    ) -> dict:
+        """
+        Run one shard of a split job: this shard's slice of the tiles goes
+        to the tile store for the merge. Tiles already stored (from an
+        earlier attempt) are skipped. An image that fits in one tile is
+        left entirely to the merge.
+        """
+        start_time = time.time()
+        split_id, shard, shards = split["split_id"], split["shard"], split["shards"]
+        self.tile_store.purge_stale()
+
+        h, w = img_tensor.shape[2:]
+        mine = []
+        if h > tile_size or w > tile_size:
+            tiles = tile_grid(h, w, tile_size, tile_overlap)
+            selected = tiles if region is None else tiles_in_region(tiles, region)
+            mine = shard_tiles(selected, shards, shard)
+
+        todo = [t for t in mine if not self.tile_store.has(split_id, t)]
+        run_tiles = tile_runner or (lambda *args: self._run_tiles(model, *args))
+        if todo:
+            for t, tile_out in run_tiles(img_tensor, todo, (0, 0), ctx):
+                self.tile_store.put(split_id, t, tile_out)
+
+        del img_tensor
+        self._clear_memory()
+
+        return {
+            "split_id": split_id,
+            "shard": shard,
+            "shards": shards,
+            "tiles": len(mine),
+            "tiles_run": len(todo),
+            "tiles_per_second": tile_rate(len(todo), start_time),
+            "processing_time": time.time() - start_time,
+        }
+
+    def upscale(self, config: dict, ctx: JobContext = None) -> dict:
         """
         Upscale an image using Real-ESRGAN.
 
@@ -140,38 +381,89 @@ class EsrganUpscaler:
                 - model (str): Model filename, default "4x-UltraSharp.pth"
                 - tile_size (int): Tile size, default 512
                 - tile_overlap (int): Tile overlap, default 32
+                - tile_batch (int): Same-size tiles per model call (torch
+                  backend without the CPU process pool), default 1
+                - tile_size_pass2 (int, optional): Second-pass tile size,
+                  default min(tile_size, 384)
                 - use_fp16 (bool): Use FP16, default True
+                  (these five default to this host's autotune profile for
+                  the model when there is one, see utils/tuning_profiles.py)
+                - backend (str): "torch", "int8" (quantized) or "onnx" (ONNX Runtime),
+                  default "torch". int8 and onnx always run on CPU.
                 - use_two_pass (bool): Two-pass 16x upscale, default False
+                - draft_decode (bool): Decode JPEG input at reduced resolution
+                  when the target needs less than the model's full output,
+                  default False
+                - crop_policy (str, optional): "offset", "center" or "saliency".
+                  With a print target that needs cropping, output only the
+                  final print rectangle and skip tiles outside it
+                - crop_offset (int, optional): Crop offset in output pixels
+                  along the cropped axis (implies crop_policy "offset")
+                - cpu_parallel (bool): On CPU-only nodes, run tiles in a
+                  process pool sized from the core count, default False
+                  (CPU_TILE_PARALLEL=true turns it on for the node)
+                - retain_raw (bool): Keep the uncompressed oversized output
+                  for finalize_crop, default False (RETAIN_RAW_OUTPUT=true
+                  turns it on for the node)
+                - split (dict, optional): Run as part of a split job.
+                  {"split_id", "shard", "shards"} runs one shard of the tiles
+                  into the tile store and returns without an output;
+                  {"split_id", "merge": True} blends every shard's tiles and
+                  finishes the job. Not supported with use_two_pass
+                - flat_threshold (float): Upscale tiles whose detail score
+                  (see utils/tile_analysis.py) is below this with bicubic
+                  interpolation instead of the model, default 0 (off)
+                - dedup_tiles (bool): Run byte-identical tiles through the
+                  model once and reuse the output, default True
+                - checkpoint_every (int, optional): Save finished tiles every
+                  this many tiles so a resubmitted job resumes where it
+                  stopped (see utils/job_checkpoint.py), default 0 (off).
+                  Only applies to jobs of CHECKPOINT_MIN_TILES (64) or
+                  more first-pass tiles. Needs a job context
+                - pyramid (bool): Write a deep-zoom tile pyramid and preview
+                  next to the output, default False (PYRAMID_ENABLED=true
+                  turns it on for the node)
                 - output_format (str): "png" or "tiff", default "png"
                 - target_dpi (int, optional): Target DPI
                 - target_width_inches (float, optional): Target print width
                 - target_height_inches (float, optional): Target print height
                 - upscale_factor (int, optional): Simple scale factor (if no print target)
+            ctx: optional JobContext, checked between tiles for cancellation
+                and preemption (raises JobCancelled)
 
         Returns:
-            dict with output_path, output_width, output_height, crop_info
+            dict with output_path, output_width, output_height, crop_info,
+            compute_skipped (fraction of tile compute skipped by crop_policy),
+            raw_expires_at (when the retained raw output expires, if kept),
+            pyramid (tile pyramid metadata, see utils/tile_pyramid.py),
+            tiles_per_second (per pass), cpu_split ([processes, threads]
+            when tiles ran in the CPU process pool), tile_stats (flat and
+            duplicate tile counts with skip_ratio and dedup_ratio),
+            resumed_tiles (tiles read back from an earlier attempt's checkpoint)
         """
         start_time = time.time()
 
         image_path = Path(config["image_path"])
         output_dir = Path(config.get("output_dir", os.environ.get("OUTPUT_DIR", "/app/results")))
         model_name = config.get("model", "4x-UltraSharp.pth")
+
+        # This host's autotuned values fill in what the job leaves out
+        config = {**tuned_defaults(model_name), **config}
         tile_size = config.get("tile_size", 512)
         tile_overlap = config.get("tile_overlap", 32)
         use_fp16 = config.get("use_fp16", True)
         use_two_pass = config.get("use_two_pass", False)
+        backend = config.get("backend", "torch")
+        tile_batch = config.get("tile_batch", 1) if backend == "torch" else 1
         output_formats = [config.get("output_format", "png")]
         output_name = config.get("output_name", f"{image_path.stem}_esrgan")
 
-        if not image_path.exists():
-            raise FileNotFoundError(f"Input file not found: {image_path}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
 
-        # Load image
-        img = cv2.imread(str(image_path))
-        if img is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        h, w = img.shape[:2]
+        # Read dimensions from the header; rejects oversized inputs before decoding
+        info = probe_image(image_path)
+        h, w = info["height"], info["width"]
 
         # Determine output dimensions
         target_width_inches = config.get("target_width_inches")
@@ -195,38 +487,157 @@ class EsrganUpscaler:
             output_height = h * factor
             crop_info = None
 
-        # Load model
-        model = self._load_model(model_name, use_fp16)
-
-        # Convert to tensor
-        img_tensor = (
-            torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).float() / 255.0
-        )
-        img_tensor = img_tensor.to(DEVICE)
-        if use_fp16 and DEVICE.type == "cuda":
+        # Decode once, at reduced JPEG resolution if the target doesn't need more
+        draft_factor = 1
+        if config.get("draft_decode", False):
+            total_scale = self._model_scale(model_name, use_fp16) ** (2 if use_two_pass else 1)
+            draft_factor = pick_draft_factor(
+                info, -(-output_width // total_scale), -(-output_height // total_scale)
+            )
+        image = load_image(image_path, info, draft_factor)
+
+        # int8 and onnx backends only run on CPU, in float32 at the boundary
+        device = DEVICE if backend == "torch" else CPU
+        use_half = use_fp16 and device.type == "cuda"
+
+        # Convert to tensor: move the uint8 view, then convert on the device
+        img_tensor = image.tensor_nchw().to(device).float().div_(255.0)
+        if use_half:
             img_tensor = img_tensor.half()
 
-        # First pass
-        output_tensor = self._upscale_with_tiles(model, img_tensor, tile_size, tile_overlap)
+        # Crop up front: only the final print rectangle is computed
+        crop_policy = config.get("crop_policy") or ("offset" if config.get("crop_offset") is not None else None)
+        roi = None
+        if crop_policy and crop_info:
+            roi = plan_crop(
+                scale_info, crop_policy, config.get("crop_offset"),
+                image.pixels if crop_policy == "saliency" else None,
+            )
+            crop_info.update(policy=roi["policy"], offset_px=roi["offset_px"])
+        del image
 
-        # Optional second pass
-        if use_two_pass:
-            tile_size_pass2 = min(tile_size, 384)
-            output_tensor = self._upscale_with_tiles(
-                model, output_tensor, tile_size_pass2, tile_overlap
+        # Load model
+        if backend != "torch":
+            model = self._load_backend_model(model_name, backend)
+        else:
+            model = self._load_model(model_name, use_fp16)
+
+        h, w = img_tensor.shape[2:]
+        scale = model.scale
+        tile_size_pass2 = config.get("tile_size_pass2") or min(tile_size, 384)
+        resize_to = (output_width, output_height)
+
+        # On CPU-only nodes, shard tiles across processes
+        pool = self._cpu_tile_pool(config, device, backend, model_name)
+        if pool is not None:
+            tile_runner = pool.runner(model_name, scale)
+        else:
+            tile_runner = lambda *args: self._run_tiles(model, *args, batch=tile_batch)
+        tile_rates = []
+
+        # Save finished tiles so a resubmitted job resumes after a crash.
+        # Shards already resume from the tile store
+        checkpoint = None
+        if config.get("split") is None:
+            checkpoint = JobCheckpoint.from_config(
+                config, ctx, len(tile_grid(h, w, tile_size, tile_overlap))
             )
+        if checkpoint is not None:
+            tile_runner = checkpoint.runner(tile_runner)
+
+        # Interpolate flat tiles and run byte-identical tiles once
+        adaptive = AdaptiveTiles.from_config(config, scale)
+        if adaptive is not None:
+            tile_runner = adaptive.runner(tile_runner)
+
+        # Work back from the crop to the input region each pass must cover
+        roi_plan = None
+        if roi is not None:
+            roi_plan = self._plan_roi(roi, h, w, scale, resize_to, use_two_pass, tile_size_pass2, tile_overlap)
+
+        # Split jobs: each shard runs a slice of the tiles into the tile
+        # store; the merge blends them exactly as a single worker would
+        split = config.get("split")
+        if split is not None:
+            if use_two_pass:
+                raise ValueError("Two-pass jobs cannot be split into shards")
+            if "shard" in split:
+                result = self._run_shard(
+                    model, img_tensor, tile_size, tile_overlap, split, ctx, tile_runner,
+                    region=roi_plan["pass1_region"] if roi_plan else None,
+                )
+                result["tile_stats"] = adaptive.stats() if adaptive is not None else None
+                return result
+            tile_runner = self.tile_store.runner(split["split_id"], img_tensor.device, img_tensor.dtype)
+
+        if roi is None:
+            # First pass
+            result = self._upscale_region(
+                model, img_tensor, tile_size, tile_overlap, ctx, tile_runner=tile_runner
+            )
+            tile_rates.append(result["tiles_per_second"])
+            area_run = area_total = 1
+
+            # Optional second pass
+            if use_two_pass:
+                result = self._upscale_region(
+                    model, result["output"], tile_size_pass2, tile_overlap, ctx, tile_runner=tile_runner
+                )
+                tile_rates.append(result["tiles_per_second"])
+            output_tensor = result["output"]
+            del result
+            box = None
+        else:
+            result = self._upscale_region(
+                model, img_tensor, tile_size, tile_overlap, ctx, region=roi_plan["pass1_region"],
+                tile_runner=tile_runner,
+            )
+            tile_rates.append(result["tiles_per_second"])
+            area_run, area_total = result["area_run"], result["area_total"]
+
+            if use_two_pass:
+                ey1, _, ex1, _ = result["extent"]
+                result = self._upscale_region(
+                    model, result["output"], tile_size_pass2, tile_overlap, ctx,
+                    region=roi_plan["region"],
+                    origin=(ey1 * scale, ex1 * scale),
+                    full_size=roi_plan["last_size"],
+                    tile_runner=tile_runner,
+                )
+                tile_rates.append(result["tiles_per_second"])
+                area_run += result["area_run"]
+                area_total += result["area_total"]
+
+            # The output covers only the tiles run; shift the resize box to match
+            output_tensor = result["output"]
+            ey1, _, ex1, _ = result["extent"]
+            bx1, by1, bx2, by2 = roi_plan["box"]
+            box = (bx1 - ex1 * scale, by1 - ey1 * scale, bx2 - ex1 * scale, by2 - ey1 * scale)
+            resize_to = (roi["rect"][2] - roi["rect"][0], roi["rect"][3] - roi["rect"][1])
+            output_width, output_height = resize_to
+            del result
+
+        if split is not None:
+            # Every shard's tiles are blended in; they are no longer needed
+            self.tile_store.delete(split["split_id"])
+        if checkpoint is not None:
+            checkpoint.delete()
 
         # Convert to numpy
         output = output_tensor.squeeze(0).permute(1, 2, 0).float().cpu().numpy()
         output = (output * 255).clip(0, 255).astype(np.uint8)
 
-        # Resize to target dimensions
+        # Resize to target dimensions (only the crop box in ROI mode)
         pil_img = Image.fromarray(output)
-        pil_img = pil_img.resize((output_width, output_height), Image.LANCZOS)
+        pil_img = pil_img.resize(resize_to, Image.LANCZOS, box=box)
         output_rgb = np.array(pil_img)
 
+        # Keep the oversized output so the crop can be finalized later
+        raw_expires_at = retain_for_crop(config, output_name, output_rgb, crop_info)
+
         # Save
         saved_paths = save_image_formats(output_rgb, output_name, str(output_dir), output_formats)
+        pyramid = build_for_output(config, output_name, str(output_dir), output_rgb)
 
         # Cleanup tensors
         del img_tensor, output_tensor
@@ -240,5 +651,12 @@ class EsrganUpscaler:
             "output_width": output_width,
             "output_height": output_height,
             "crop_info": crop_info,
+            "compute_skipped": round(1 - area_run / area_total, 4),
+            "tiles_per_second": tile_rates,
+            "cpu_split": [pool.processes, pool.threads] if pool is not None else None,
+            "tile_stats": adaptive.stats() if adaptive is not None and adaptive.tiles else None,
+            "resumed_tiles": checkpoint.resumed if checkpoint is not None else 0,
+            "raw_expires_at": raw_expires_at,
+            "pyramid": pyramid,
             "processing_time": processing_time,
         }
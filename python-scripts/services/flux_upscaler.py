@@ -5,18 +5,31 @@ Extracted from resolution-upscaling/flux_upscaler_5060ti.ipynb.
 Uses ComfyUI nodes for FLUX-based diffusion upscaling with tiled processing.
 """
 
-import gc
+import math
 import os
 import sys
 import time
 import random
-import numpy as np
+from contextlib import contextmanager
 import torch
 from pathlib import Path
-from PIL import Image
 
+from utils.crop_planner import LANCZOS_SUPPORT, plan_crop
 from utils.dimension_calculator import calculate_scale_for_crop
-from utils.image_utils import save_image_formats
+from utils.image_ingest import load_image, probe_image
+from utils.image_utils import (
+    pil_to_uint8_memmap,
+    resize_to_uint8_memmap,
+    save_image_formats,
+    tensor_to_uint8_memmap,
+)
+from utils.job_context import JobContext
+from utils.memory_policy import policy as memory_policy
+from utils.raw_store import retain_for_crop
+from utils.residency import ResidencyManager
+from utils.tile_pyramid import build_for_output
+from utils.tiled_vae import TiledVAE, default_memory_budget_mb, max_pixels_for_budget, pick_tile_size
+from utils.tuning_profiles import tuned_defaults
 
 # ComfyUI path must be on sys.path before importing its modules
 COMFYUI_DIR = os.environ.get("COMFYUI_DIR", "/app/hf/ComfyUI")
@@ -34,12 +47,18 @@ class FluxUpscaler:
         self.loras_dir = self.models_dir / "loras"
 
         self._models_loaded = False
+        self.flux_model = None
+        self.flux_vae = None
+        self.flux_upscale_model = None
         self.model = None
         self.vae = None
         self.positive = None
         self.negative = None
         self.upscale_model_load = None
 
+        # Offloads idle components between jobs (see utils/residency.py)
+        self.residency = ResidencyManager()
+
         # ComfyUI node instances
         self._nodes_initialized = False
 
@@ -71,7 +90,7 @@ class FluxUpscaler:
             [str(self.loras_dir)], folder_paths.supported_pt_extensions
         )
 
-        from nodes import DualCLIPLoader, VAELoader, LoadImage
+        from nodes import DualCLIPLoader, VAELoader
         from custom_nodes.ComfyUI_GGUF.nodes import UnetLoaderGGUF
         from comfy_extras.nodes_upscale_model import UpscaleModelLoader
         from comfy_extras.nodes_flux import CLIPTextEncodeFlux
@@ -80,7 +99,6 @@ class FluxUpscaler:
         self._clip_loader = DualCLIPLoader()
         self._unet_loader = UnetLoaderGGUF()
         self._vae_loader = VAELoader()
-        self._load_image = LoadImage()
         self._upscale_model_loader = UpscaleModelLoader()
         self._positive_prompt_encode = CLIPTextEncodeFlux()
         self._negative_prompt_encode = CLIPTextEncodeFlux()
@@ -88,12 +106,40 @@ class FluxUpscaler:
 
         self._nodes_initialized = True
 
-    def _clear_memory(self):
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.ipc_collect()
-        gc.collect()
+    @contextmanager
+    def _capture_output(self):
+        """
+        Keep UltimateSDUpscale's final uint8 PIL image instead of letting it
+        build a full float32 tensor from it. Yields a list that holds the
+        image once the node returns (its tensor output is then a 1x1
+        placeholder); the list stays empty on node versions without the
+        pil_to_tensor hook, whose float output is used as before.
+        """
+        import custom_nodes.ComfyUI_UltimateSDUpscale.nodes as usdu_nodes
+
+        captured = []
+        original = getattr(usdu_nodes, "pil_to_tensor", None)
+        if original is None:
+            yield captured
+            return
+
+        def capture(img):
+            captured.append(img.convert("RGB"))
+            return torch.zeros((1, 1, 1, 3))
+
+        usdu_nodes.pil_to_tensor = capture
+        try:
+            yield captured
+        finally:
+            usdu_nodes.pil_to_tensor = original
+            # The node keeps its working images until the next job
+            shared = getattr(usdu_nodes, "shared", None)
+            if shared is not None and hasattr(shared, "batch"):
+                shared.batch = []
+
+    def _clear_memory(self, force: bool = False):
+        """Full collection if forced or the memory policy's thresholds are crossed."""
+        memory_policy.release(force)
 
     def load_models(
         self,
@@ -116,20 +162,126 @@ class FluxUpscaler:
         self.negative = self._negative_prompt_encode.encode(clip, "", "", guidance)[0]
 
         del clip
-        self._clear_memory()
+        self._clear_memory(force=True)
 
         # Load UNet
         self.model = self._unet_loader.load_unet(flux_model)[0]
+        self.flux_model = flux_model
 
         # Load upscale model
         self.upscale_model_load = self._upscale_model_loader.load_model(upscale_model)[0]
+        self.flux_upscale_model = upscale_model
 
         # Load VAE
         self.vae = self._vae_loader.load_vae(flux_vae)[0]
+        self.flux_vae = flux_vae
 
+        self._register_components()
         self._models_loaded = True
 
-    def upscale(self, config: dict) -> dict:
+    @staticmethod
+    def _patcher_to_gpu(patcher):
+        import comfy.model_management
+        comfy.model_management.load_models_gpu([patcher])
+
+    @staticmethod
+    def _patcher_to_cpu(patcher):
+        """Unload a ComfyUI ModelPatcher from the GPU; its weights go back to the offload device."""
+        import comfy.model_management
+        loaded = comfy.model_management.current_loaded_models
+        for i in reversed(range(len(loaded))):
+            if loaded[i].model is patcher:
+                loaded.pop(i).model_unload()
+        comfy.model_management.soft_empty_cache()
+
+    def _register_components(self):
+        """Hand the UNet, VAE and upscale model to the residency manager."""
+
+        def reload(attr, loader):
+            def load():
+                setattr(self, attr, loader()[0])
+            return load
+
+        def drop(attr):
+            def release():
+                setattr(self, attr, None)
+                self._clear_memory(force=True)
+            return release
+
+        # The loaders leave weights on the CPU until ComfyUI samples with them
+        self.residency.register(
+            "unet",
+            to_device=lambda: self._patcher_to_gpu(self.model),
+            to_host=lambda: self._patcher_to_cpu(self.model),
+            load=reload("model", lambda: self._unet_loader.load_unet(self.flux_model)),
+            release=drop("model"),
+        )
+        self.residency.register(
+            "vae",
+            to_device=lambda: self._patcher_to_gpu(self.vae.patcher),
+            to_host=lambda: self._patcher_to_cpu(self.vae.patcher),
+            load=reload("vae", lambda: self._vae_loader.load_vae(self.flux_vae)),
+            release=drop("vae"),
+        )
+        # ImageUpscaleWithModel moves the upscale model to the GPU for each
+        # run and back afterwards, so it only ever needs releasing
+        self.residency.register(
+            "upscale_model",
+            to_device=lambda: None,
+            to_host=lambda: None,
+            load=reload(
+                "upscale_model_load",
+                lambda: self._upscale_model_loader.load_model(self.flux_upscale_model),
+            ),
+            release=drop("upscale_model_load"),
+        )
+
+    def _select_vae(self, config: dict, tile_width: int, tile_height: int, tile_padding: int):
+        """
+        Pick the VAE to hand to UltimateSDUpscale: the plain VAE, or a
+        TiledVAE when tiling is forced or (in "auto" mode) when a diffusion
+        tile would not fit the VAE memory budget in one pass.
+
+        Returns:
+            (vae, vae_tile_size) where vae_tile_size is None when untiled
+        """
+        tiled_vae = config.get("tiled_vae", "auto")
+        if isinstance(tiled_vae, str) and tiled_vae != "auto":
+            tiled_vae = tiled_vae.lower() == "true"
+        budget_mb = config.get("vae_memory_budget_mb") or default_memory_budget_mb()
+
+        if tiled_vae == "auto":
+            tile_pixels = (tile_width + 2 * tile_padding) * (tile_height + 2 * tile_padding)
+            tiled_vae = tile_pixels > max_pixels_for_budget(budget_mb)
+
+        if not tiled_vae:
+            return self.vae, None
+
+        vae_tile_size = config.get("vae_tile_size") or pick_tile_size(budget_mb)
+        vae_tile_overlap = config.get("vae_tile_overlap", 64)
+        return TiledVAE(self.vae, vae_tile_size, vae_tile_overlap), vae_tile_size
+
+    def _checkpoint_on_progress(self, ctx: JobContext):
+        """
+        Install a ComfyUI progress-bar hook that calls ctx.checkpoint().
+
+        KSampler advances the progress bar once per step, so this checks for
+        cancellation and preemption between sampler steps of every tile.
+        Returns the previous hook so the caller can restore it.
+        """
+        import comfy.utils
+
+        previous = comfy.utils.PROGRESS_BAR_HOOK
+
+        def hook(*args, **kwargs):
+            if previous is not None:
+                previous(*args, **kwargs)
+            ctx.checkpoint()
+
+        comfy.utils.set_progress_bar_global_hook(hook)
+        return previous
+
+    def upscale(self, config: dict, ctx: JobContext = None) -> dict:
         """
         Upscale an image using FLUX diffusion.
 
@@ -148,17 +300,44 @@ class FluxUpscaler:
                 - upscale_model (str): Upscale model name
                 - tile_width (int): Tile width, default 512
                 - tile_height (int): Tile height, default 512
+                - tile_size (int, optional): Sets both tile_width and tile_height
                 - mask_blur (int): Mask blur, default 8
                 - tile_padding (int): Tile padding, default 32
+                  (tile width, height and padding default to this host's
+                  autotune profile for the FLUX model when there is one,
+                  see utils/tuning_profiles.py)
+                - tiled_vae (bool | "auto"): Tile VAE encode/decode, default "auto"
+                  (tiled when a diffusion tile exceeds the VAE memory budget)
+                - vae_tile_size (int, optional): VAE tile size in pixels
+                  (default: picked from the memory budget)
+                - vae_tile_overlap (int): VAE tile overlap in pixels, default 64
+                - vae_memory_budget_mb (int, optional): VAE memory budget
+                  (default: half of free VRAM, or FLUX_VAE_MEMORY_BUDGET_MB)
                 - output_format (str): "png" or "tiff", default "png"
                 - target_dpi (int, optional): Target DPI
                 - target_width_inches (float, optional): Target print width
                 - target_height_inches (float, optional): Target print height
+                - crop_policy (str, optional): "offset", "center" or "saliency".
+                  With a print target that needs cropping, diffuse only the
+                  input region behind the final print rectangle
+                - crop_offset (int, optional): Crop offset in output pixels
+                  along the cropped axis (implies crop_policy "offset")
+                - retain_raw (bool): Keep the uncompressed oversized output
+                  for finalize_crop, default False (RETAIN_RAW_OUTPUT=true
+                  turns it on for the node)
+                - pyramid (bool): Write a deep-zoom tile pyramid and preview
+                  next to the output, default False (PYRAMID_ENABLED=true
+                  turns it on for the node)
                 - positive_prompt (str, optional): Positive prompt
                 - guidance (float, optional): Guidance scale, default 3.5
+            ctx: optional JobContext, checked between sampler steps for
+                cancellation and preemption (raises JobCancelled)
 
         Returns:
-            dict with output_path, output_width, output_height, crop_info
+            dict with output_path, output_width, output_height, crop_info,
+            compute_skipped (fraction of diffusion tiles skipped by crop_policy),
+            raw_expires_at (when the retained raw output expires, if kept),
+            pyramid (tile pyramid metadata, see utils/tile_pyramid.py)
         """
         if not self._models_loaded:
             self.load_models(
@@ -166,8 +345,20 @@ class FluxUpscaler:
                 guidance=config.get("guidance", 3.5),
             )
 
+        # Components stay on the GPU for the whole job, including while it
+        # is suspended by a preempting job
+        with self.residency.use():
+            return self._upscale(config, ctx)
+
+    def _upscale(self, config: dict, ctx: JobContext = None) -> dict:
         start_time = time.time()
 
+        # tile_size sets both tile dimensions; this host's autotuned values
+        # fill in the rest of what the job leaves out
+        if config.get("tile_size"):
+            config = {"tile_width": config["tile_size"], "tile_height": config["tile_size"], **config}
+        config = {**tuned_defaults(self.flux_model), **config}
+
         image_path = Path(config["image_path"])
         output_dir = Path(config.get("output_dir", os.environ.get("OUTPUT_DIR", "/app/results")))
         output_name = config.get("output_name", f"{image_path.stem}_flux")
@@ -188,12 +379,9 @@ class FluxUpscaler:
         if seed == 0:
             seed = random.randint(0, 2**32 - 1)
 
-        if not image_path.exists():
-            raise FileNotFoundError(f"Input file not found: {image_path}")
-
-        # Load image via ComfyUI
-        loaded_image = self._load_image.load_image(str(image_path))[0]
-        input_height, input_width = loaded_image.shape[1], loaded_image.shape[2]
+        # Read dimensions from the header; rejects oversized inputs before decoding
+        info = probe_image(image_path)
+        input_width, input_height = info["width"], info["height"]
 
         # Determine output dimensions
         target_width_inches = config.get("target_width_inches")
@@ -232,46 +420,120 @@ class FluxUpscaler:
                 clip, custom_prompt, "", guidance_val
             )[0]
             del clip
-            self._clear_memory()
+            self._clear_memory(force=True)
+
+        vae, vae_tile_size = self._select_vae(config, tile_width, tile_height, tile_padding)
+
+        image = load_image(image_path, info)
+        pixels = image.tensor_nhwc()
+        resize_to = (output_width, output_height)
+        box = None
+        compute_skipped = 0.0
+
+        # Crop up front: diffuse only the input region behind the print
+        # rectangle, padded so edge tiles keep their context
+        crop_policy = config.get("crop_policy") or ("offset" if config.get("crop_offset") is not None else None)
+        if crop_policy and crop_info:
+            roi = plan_crop(
+                scale_info, crop_policy, config.get("crop_offset"),
+                image.pixels if crop_policy == "saliency" else None,
+            )
+            crop_info.update(policy=roi["policy"], offset_px=roi["offset_px"])
+
+            sx, sy = output_width / input_width, output_height / input_height
+            x1, y1, x2, y2 = roi["rect"]
+            pad = math.ceil(tile_padding / upscale_by) + LANCZOS_SUPPORT
+            ix1, iy1 = max(0, math.floor(x1 / sx) - pad), max(0, math.floor(y1 / sy) - pad)
+            ix2 = min(input_width, math.ceil(x2 / sx) + pad)
+            iy2 = min(input_height, math.ceil(y2 / sy) + pad)
+            pixels = pixels[:, iy1:iy2, ix1:ix2]
+
+            def usdu_tiles(w, h):
+                return math.ceil(w * upscale_by / tile_width) * math.ceil(h * upscale_by / tile_height)
+
+            compute_skipped = 1 - usdu_tiles(ix2 - ix1, iy2 - iy1) / usdu_tiles(input_width, input_height)
+            box = (x1 / sx - ix1, y1 / sy - iy1, x2 / sx - ix1, y2 / sy - iy1)
+            resize_to = (x2 - x1, y2 - y1)
+            output_width, output_height = resize_to
+
+        # Decoded once; ComfyUI takes (1, H, W, 3) float
+        loaded_image = pixels.float().div_(255.0)
+        crop_height, crop_width = loaded_image.shape[1:3]
+        del image, pixels
+
+        if ctx is not None:
+            ctx.checkpoint()
+            previous_hook = self._checkpoint_on_progress(ctx)
+
+        # Final pixels go through disk-backed uint8 buffers in SCRATCH_DIR
+        scratch_dir = Path(os.environ.get("SCRATCH_DIR", "/app/temp"))
+        full_path = scratch_dir / f"{output_name}.full.rgb"
+        resized_path = scratch_dir / f"{output_name}.rgb"
 
         # Run FLUX upscale
-        with torch.inference_mode():
-            image_out = self._upscaler.upscale(
-                image=loaded_image,
-                model=self.model,
-                positive=positive,
-                negative=negative,
-                vae=self.vae,
-                upscale_by=upscale_by,
-                seed=seed,
-                steps=steps,
-                cfg=cfg,
-                sampler_name=sampler_name,
-                scheduler=scheduler,
-                denoise=denoise,
-                upscale_model=self.upscale_model_load,
-                mode_type="Linear",
-                tile_width=tile_width,
-                tile_height=tile_height,
-                mask_blur=mask_blur,
-                tile_padding=tile_padding,
-                seam_fix_mode="None",
-                seam_fix_denoise=1.0,
-                seam_fix_mask_blur=8,
-                seam_fix_width=64,
-                seam_fix_padding=16,
-                force_uniform_tiles=True,
-                tiled_decode=False,
-            )[0]
-
-        # Resize to target dimensions
-        img_np = (image_out[0].cpu().numpy() * 255).astype(np.uint8)
-        pil_img = Image.fromarray(img_np)
-        pil_img = pil_img.resize((output_width, output_height), Image.LANCZOS)
-        output_rgb = np.array(pil_img)
-
-        # Save
-        saved_paths = save_image_formats(output_rgb, output_name, str(output_dir), output_formats)
+        try:
+            with torch.inference_mode(), self._capture_output() as captured:
+                image_out = self._upscaler.upscale(
+                    image=loaded_image,
+                    model=self.model,
+                    positive=positive,
+                    negative=negative,
+                    vae=vae,
+                    upscale_by=upscale_by,
+                    seed=seed,
+                    steps=steps,
+                    cfg=cfg,
+                    sampler_name=sampler_name,
+                    scheduler=scheduler,
+                    denoise=denoise,
+                    upscale_model=self.upscale_model_load,
+                    mode_type="Linear",
+                    tile_width=tile_width,
+                    tile_height=tile_height,
+                    mask_blur=mask_blur,
+                    tile_padding=tile_padding,
+                    seam_fix_mode="None",
+                    seam_fix_denoise=1.0,
+                    seam_fix_mask_blur=8,
+                    seam_fix_width=64,
+                    seam_fix_padding=16,
+                    force_uniform_tiles=True,
+                    tiled_decode=False,
+                )[0]
+            del loaded_image
+
+            # Stream the node's output to disk: straight from its uint8
+            # image when captured, else strip by strip from its float tensor
+            if captured:
+                img_u8 = pil_to_uint8_memmap(captured.pop(), str(full_path))
+            else:
+                img_u8 = tensor_to_uint8_memmap(image_out[0], str(full_path))
+            del image_out
+
+            # Resize to target dimensions, strip by strip into a second buffer
+            if box is not None:
+                # Box was computed in input pixels of the cropped region
+                ax = img_u8.shape[1] / crop_width
+                ay = img_u8.shape[0] / crop_height
+                box = (box[0] * ax, box[1] * ay, box[2] * ax, box[3] * ay)
+            output_rgb = resize_to_uint8_memmap(img_u8, resize_to, str(resized_path), box=box)
+            del img_u8
+            full_path.unlink(missing_ok=True)
+
+            # Keep the oversized output so the crop can be finalized later
+            raw_expires_at = retain_for_crop(config, output_name, output_rgb, crop_info)
+
+            # Save
+            saved_paths = save_image_formats(output_rgb, output_name, str(output_dir), output_formats)
+            pyramid = build_for_output(config, output_name, str(output_dir), output_rgb)
+            del output_rgb
+        finally:
+            if ctx is not None:
+                import comfy.utils
+                comfy.utils.set_progress_bar_global_hook(previous_hook)
+            # Never leave full-size scratch buffers behind, even on failure
+            full_path.unlink(missing_ok=True)
+            resized_path.unlink(missing_ok=True)
 
         self._clear_memory()
         processing_time = time.time() - start_time
@@ -282,5 +544,9 @@ class FluxUpscaler:
             "output_width": output_width,
             "output_height": output_height,
             "crop_info": crop_info,
+            "vae_tile_size": vae_tile_size,
+            "compute_skipped": round(compute_skipped, 4),
+            "raw_expires_at": raw_expires_at,
+            "pyramid": pyramid,
             "processing_time": processing_time,
         }
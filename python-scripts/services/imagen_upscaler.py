@@ -3,11 +3,22 @@ Google Imagen 4.0 Upscaler Service.
 
 Extracted from resolution-upscaling/imagen_upscaler.ipynb.
 Uses Google Cloud Vertex AI API for cloud-based AI upscaling.
+
+Inputs whose upscaled size would exceed the API's output limit
+(IMAGEN_MAX_OUTPUT_PIXELS, default 17 million) are split into overlapping
+tiles that each fit it. Tiles are sent concurrently (IMAGEN_MAX_CONCURRENCY
+requests at a time, default 4), failed tiles are retried on their own, and
+the results are stitched with feathered blending.
+
+IMAGEN_ENDPOINT replaces the Vertex AI predict URL (e.g. a proxy or a local
+mock); IMAGEN_AUTH=none sends requests without a Google access token.
 """
 
+import math
 import os
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import numpy as np
 from pathlib import Path
@@ -17,17 +28,62 @@ import google.auth
 import google.auth.transport.requests
 
 from utils.dimension_calculator import calculate_scale_for_crop
+from utils.image_ingest import load_image, probe_image
+from utils.job_context import JobContext
+from utils.raw_store import retain_for_crop
+from utils.tile_pyramid import build_for_output
+from utils.tiling import tile_grid
 from utils.image_utils import (
+    encode_array_to_base64,
     encode_image_to_base64,
     decode_base64_to_image,
     save_image_formats,
 )
 
+IMAGEN_MAX_OUTPUT_PIXELS = int(os.environ.get("IMAGEN_MAX_OUTPUT_PIXELS", 17_000_000))
+IMAGEN_MAX_CONCURRENCY = int(os.environ.get("IMAGEN_MAX_CONCURRENCY", 4))
+IMAGEN_TILE_RETRIES = int(os.environ.get("IMAGEN_TILE_RETRIES", 2))
+IMAGEN_RETRY_BACKOFF_SECONDS = float(os.environ.get("IMAGEN_RETRY_BACKOFF_SECONDS", 2))
+
+# Responses worth retrying; anything else (bad request, quota exhausted for
+# the day, permissions) fails the same way again
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class ImagenApiError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        """Connection errors and throttling/server errors."""
+        return self.status is None or self.status in RETRYABLE_STATUSES
+
+
+def _feather_mask(tile: dict, height: int, width: int, feather: int) -> np.ndarray:
+    """(H, W, 1) weights ramping up from 0 along edges shared with neighbouring tiles."""
+    mask = np.ones((height, width, 1), dtype=np.float32)
+    if feather <= 0:
+        return mask
+    ramp = np.arange(feather, dtype=np.float32) / feather
+    if tile["i"] > 0:
+        mask[:feather] *= ramp[:, None, None]
+    if tile["i"] < tile["rows"] - 1:
+        mask[-feather:] *= ramp[::-1, None, None]
+    if tile["j"] > 0:
+        mask[:, :feather] *= ramp[None, :, None]
+    if tile["j"] < tile["cols"] - 1:
+        mask[:, -feather:] *= ramp[None, ::-1, None]
+    return mask
+
 
 class ImagenUpscaler:
     def __init__(self):
         self.project_id = os.environ.get("GCP_PROJECT_ID", "artinafti")
         self.region = os.environ.get("GCP_REGION", "us-central1")
+        self.endpoint = os.environ.get("IMAGEN_ENDPOINT")
+        self.use_auth = os.environ.get("IMAGEN_AUTH", "adc") != "none"
         self._credentials = None
         self._project = None
 
@@ -43,8 +99,10 @@ class ImagenUpscaler:
         self._project = project
         return credentials
 
-    def _get_access_token(self) -> str:
-        """Get fresh access token from credentials."""
+    def _get_access_token(self) -> str | None:
+        """Get fresh access token from credentials (None with IMAGEN_AUTH=none)."""
+        if not self.use_auth:
+            return None
         credentials = self._get_credentials()
         auth_req = google.auth.transport.requests.Request()
         credentials.refresh(auth_req)
@@ -52,20 +110,25 @@ class ImagenUpscaler:
 
     def _call_imagen_api(
         self,
-        image_path: str,
+        image_base64: str,
         upscale_factor: str = "x4",
         output_mime_type: str = "image/png",
         prompt: str = "Upscale the image with high quality and sharp details",
+        access_token: str = None,
     ) -> Image.Image:
-        """Call Imagen 4.0 upscale API and return PIL Image."""
-        endpoint = (
+        """
+        Call Imagen 4.0 upscale API on a base64-encoded image file and return
+        a PIL Image. Raises ImagenApiError. A fresh access token is fetched
+        unless one is given.
+        """
+        endpoint = self.endpoint or (
             f"https://{self.region}-aiplatform.googleapis.com/v1/"
             f"projects/{self.project_id}/locations/{self.region}/"
             f"publishers/google/models/imagen-4.0-upscale-preview:predict"
         )
 
-        access_token = self._get_access_token()
-        image_base64 = encode_image_to_base64(image_path)
+        if access_token is None:
+            access_token = self._get_access_token()
 
         output_options = {"mimeType": output_mime_type}
 
@@ -83,14 +146,16 @@ class ImagenUpscaler:
             },
         }
 
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json; charset=utf-8",
-        }
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
 
-        response = requests.post(
-            endpoint, headers=headers, json=request_body, timeout=300
-        )
+        try:
+            response = requests.post(
+                endpoint, headers=headers, json=request_body, timeout=300
+            )
+        except requests.RequestException as e:
+            raise ImagenApiError(f"Imagen API request failed: {e}") from e
 
         if response.status_code != 200:
             error_msg = response.text
@@ -100,20 +165,101 @@ class ImagenUpscaler:
                     error_msg = error_json["error"].get("message", error_msg)
             except Exception:
                 pass
-            raise Exception(f"Imagen API error ({response.status_code}): {error_msg}")
+            raise ImagenApiError(
+                f"Imagen API error ({response.status_code}): {error_msg}", response.status_code
+            )
 
         result = response.json()
         if "predictions" not in result or len(result["predictions"]) == 0:
-            raise Exception("No predictions in API response")
+            raise ImagenApiError("No predictions in API response")
 
         prediction = result["predictions"][0]
         upscaled_base64 = prediction.get("bytesBase64Encoded")
         if not upscaled_base64:
-            raise Exception("No image data in prediction")
+            raise ImagenApiError("No image data in prediction")
 
         return decode_base64_to_image(upscaled_base64)
 
-    def upscale(self, config: dict) -> dict:
+    def _upscale_tiled(
+        self,
+        pixels: np.ndarray,
+        upscale_factor: str,
+        prompt: str,
+        tile_size: int,
+        tile_overlap: int,
+        concurrency: int,
+        retries: int,
+        ctx: JobContext = None,
+    ) -> tuple:
+        """
+        Upscale (H, W, 3) uint8 pixels tile by tile, at most `concurrency`
+        requests in flight. Tiles that fail with a retryable error are sent
+        again, up to `retries` more rounds with exponential backoff.
+
+        Returns:
+            (stitched (H*scale, W*scale, 3) uint8 array, tile count, retried tile count)
+        """
+        scale = int(upscale_factor[1])
+        height, width = pixels.shape[:2]
+        tiles = tile_grid(height, width, tile_size, tile_overlap)
+        access_token = self._get_access_token()
+
+        output = np.zeros((height * scale, width * scale, 3), dtype=np.float32)
+        weight = np.zeros((height * scale, width * scale, 1), dtype=np.float32)
+        feather = tile_overlap * scale // 2
+
+        def call(t):
+            tile = np.ascontiguousarray(pixels[t["y1"]:t["y2"], t["x1"]:t["x2"]])
+            img = self._call_imagen_api(
+                encode_array_to_base64(tile), upscale_factor, prompt=prompt, access_token=access_token
+            )
+            size = ((t["x2"] - t["x1"]) * scale, (t["y2"] - t["y1"]) * scale)
+            if img.size != size:
+                img = img.resize(size, Image.LANCZOS)
+            return np.asarray(img.convert("RGB"))
+
+        pending = tiles
+        retried = 0
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for attempt in range(retries + 1):
+                futures = {pool.submit(call, t): t for t in pending}
+                failed = []
+                try:
+                    for future in as_completed(futures):
+                        t = futures[future]
+                        try:
+                            tile_out = future.result()
+                        except ImagenApiError as e:
+                            if not e.retryable or attempt == retries:
+                                raise
+                            failed.append(t)
+                            continue
+
+                        h, w = tile_out.shape[:2]
+                        y, x = t["y1"] * scale, t["x1"] * scale
+                        mask = _feather_mask(t, h, w, feather)
+                        output[y:y + h, x:x + w] += tile_out * mask
+                        weight[y:y + h, x:x + w] += mask
+                        if ctx is not None:
+                            ctx.checkpoint()
+                except BaseException:
+                    # Don't spend API calls on tiles of a failed or cancelled job
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+                if not failed:
+                    break
+                retried += len(failed)
+                pending = failed
+                time.sleep(IMAGEN_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+        output /= np.maximum(weight, 1e-8)
+        del weight
+        stitched = np.clip(np.rint(output), 0, 255).astype(np.uint8)
+        return stitched, len(tiles), retried
+
+    def upscale(self, config: dict, ctx: JobContext = None) -> dict:
         """
         Upscale an image using Google Imagen 4.0 API.
 
@@ -125,14 +271,35 @@ class ImagenUpscaler:
                 - upscale_factor (str): "x2", "x3", or "x4", default "x4"
                 - output_format (str): "png" or "tiff", default "png"
                 - prompt (str, optional): Upscale prompt
+                - tiling (bool | "auto"): Split the input into tiles, default
+                  "auto" (tiled when the upscaled image would exceed
+                  IMAGEN_MAX_OUTPUT_PIXELS)
+                - tile_size (int, optional): Tile size in input pixels
+                  (default and maximum: the largest square within the limit)
+                - tile_overlap (int): Tile overlap in input pixels, default 64
+                - max_concurrency (int): Tile requests in flight, default
+                  IMAGEN_MAX_CONCURRENCY
+                - tile_retries (int): Retry rounds for failed tiles, default
+                  IMAGEN_TILE_RETRIES
                 - gcp_project_id (str, optional): Override GCP project
                 - gcp_region (str, optional): Override GCP region
                 - target_dpi (int, optional): Target DPI
                 - target_width_inches (float, optional): Target print width
                 - target_height_inches (float, optional): Target print height
+                - retain_raw (bool): Keep the uncompressed oversized output
+                  for finalize_crop, default False (RETAIN_RAW_OUTPUT=true
+                  turns it on for the node)
+                - pyramid (bool): Write a deep-zoom tile pyramid and preview
+                  next to the output, default False (PYRAMID_ENABLED=true
+                  turns it on for the node)
+            ctx: optional JobContext, checked between tiles for cancellation
+                and preemption (raises JobCancelled)
 
         Returns:
-            dict with output_path, output_width, output_height, crop_info
+            dict with output_path, output_width, output_height, crop_info,
+            tiles (API calls made), tile_retries (tiles sent again),
+            raw_expires_at (when the retained raw output expires, if kept),
+            pyramid (tile pyramid metadata, see utils/tile_pyramid.py)
         """
         start_time = time.time()
 
@@ -148,12 +315,24 @@ class ImagenUpscaler:
         if config.get("gcp_region"):
             self.region = config["gcp_region"]
 
-        if not image_path.exists():
-            raise FileNotFoundError(f"Input file not found: {image_path}")
-
-        # Get input dimensions
-        with Image.open(image_path) as img:
-            input_width, input_height = img.size
+        # Input dimensions from the header only. Untiled, the file bytes are
+        # sent as-is, so use the encoded (not EXIF-rotated) size; tiles are
+        # cut from the decoded (rotated) pixels
+        info = probe_image(image_path)
+        input_width, input_height = info["stored_width"], info["stored_height"]
+
+        factor = int(upscale_factor[1])
+        max_input_pixels = IMAGEN_MAX_OUTPUT_PIXELS // factor ** 2
+        tiling = config.get("tiling", "auto")
+        if isinstance(tiling, str) and tiling != "auto":
+            tiling = tiling.lower() == "true"
+        if tiling == "auto":
+            tiling = input_width * input_height > max_input_pixels
+
+        pixels = None
+        if tiling:
+            pixels = load_image(image_path, info).pixels
+            input_height, input_width = pixels.shape[:2]
 
         # Determine output dimensions
         target_width_inches = config.get("target_width_inches")
@@ -179,18 +358,41 @@ class ImagenUpscaler:
             crop_info = None
 
         # Call Imagen API
-        upscaled_img = self._call_imagen_api(
-            image_path=str(image_path),
-            upscale_factor=upscale_factor,
-            prompt=prompt,
-        )
+        tiles, tile_retries = 1, 0
+        if tiling:
+            max_tile = math.isqrt(max_input_pixels) // 8 * 8
+            tile_size = min(config.get("tile_size") or max_tile, max_tile)
+            tile_overlap = min(config.get("tile_overlap", 64), tile_size // 4)
+            stitched, tiles, tile_retries = self._upscale_tiled(
+                pixels,
+                upscale_factor,
+                prompt,
+                tile_size,
+                tile_overlap,
+                config.get("max_concurrency") or IMAGEN_MAX_CONCURRENCY,
+                config.get("tile_retries", IMAGEN_TILE_RETRIES),
+                ctx,
+            )
+            del pixels
+            upscaled_img = Image.fromarray(stitched)
+            del stitched
+        else:
+            upscaled_img = self._call_imagen_api(
+                encode_image_to_base64(str(image_path)),
+                upscale_factor=upscale_factor,
+                prompt=prompt,
+            )
 
         # Resize to exact target dimensions
         final_img = upscaled_img.resize((output_width, output_height), Image.LANCZOS)
         output_rgb = np.array(final_img)
 
+        # Keep the oversized output so the crop can be finalized later
+        raw_expires_at = retain_for_crop(config, output_name, output_rgb, crop_info)
+
         # Save
         saved_paths = save_image_formats(output_rgb, output_name, str(output_dir), output_formats)
+        pyramid = build_for_output(config, output_name, str(output_dir), output_rgb)
 
         processing_time = time.time() - start_time
 
@@ -200,5 +402,9 @@ class ImagenUpscaler:
             "output_width": output_width,
             "output_height": output_height,
             "crop_info": crop_info,
+            "tiles": tiles,
+            "tile_retries": tile_retries,
+            "raw_expires_at": raw_expires_at,
+            "pyramid": pyramid,
             "processing_time": processing_time,
         }
@@ -0,0 +1,129 @@
+"""
+Synthetic Upscaler Service.
+
+Stands in for the real upscalers when the worker runs with WORKER_SYNTHETIC
+set, so the NestJS job path (UpscalerService, BullMQ, UpscalerProcessor,
+PythonExecutorService) can be load-tested without models or a GPU (see
+scripts/load-test.py). No inference runs: each job sleeps for a simulated
+latency, holds a simulated amount of memory, writes a flat output image of
+the simulated size and fails at a simulated rate.
+
+WORKER_SYNTHETIC is "true" for the defaults below, or a JSON object of
+per-method overrides, e.g.
+  {"esrgan": {"latency": 0.5, "failure_rate": 0.05}, "flux": {"latency": 20}}
+
+Per-method settings:
+  - latency (float): Seconds per job
+  - jitter (float): Latency varies uniformly by +/- this fraction
+  - memory_mb (float): Memory held while the job runs
+  - output_scale (float): Output size relative to the input, unless the
+    job sets upscale_factor/upscale_by
+  - failure_rate (float): Fraction of jobs that raise an error
+
+Jobs can override any of these with a "synthetic" dict in their config.
+"""
+
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from utils.image_ingest import probe_image
+from utils.job_context import JobContext
+
+DEFAULTS = {
+    "esrgan": {"latency": 2.0, "jitter": 0.2, "memory_mb": 256, "output_scale": 4, "failure_rate": 0.0},
+    "flux": {"latency": 30.0, "jitter": 0.1, "memory_mb": 1024, "output_scale": 4, "failure_rate": 0.0},
+    "imagen": {"latency": 8.0, "jitter": 0.3, "memory_mb": 64, "output_scale": 4, "failure_rate": 0.0},
+    "finalize_crop": {"latency": 0.2, "jitter": 0.1, "memory_mb": 16, "output_scale": 1, "failure_rate": 0.0},
+}
+
+# Sleep in slices so cancellation and preemption are seen promptly
+CHECKPOINT_SECONDS = 0.1
+
+
+def synthetic_settings() -> dict | None:
+    """Per-method settings from WORKER_SYNTHETIC, or None when synthetic mode is off."""
+    value = os.environ.get("WORKER_SYNTHETIC", "").strip()
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    overrides = {} if value.lower() in ("1", "true", "yes") else json.loads(value)
+    return {
+        method: {**defaults, **overrides.get(method, {})}
+        for method, defaults in DEFAULTS.items()
+    }
+
+
+class SyntheticUpscaler:
+    def __init__(self, method: str, settings: dict):
+        self.method = method
+        self.settings = settings
+        self._rng = random.Random()
+
+    def _output_size(self, config: dict, settings: dict) -> tuple:
+        scale = config.get("upscale_factor") or config.get("upscale_by") or settings["output_scale"]
+        if isinstance(scale, str):
+            scale = int(scale.lstrip("x"))
+        image_path = config.get("image_path")
+        if image_path and Path(image_path).exists():
+            info = probe_image(Path(image_path))
+            width, height = info["width"], info["height"]
+        else:
+            width = height = 512
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def upscale(self, config: dict, ctx: JobContext = None) -> dict:
+        """
+        Simulate a job of this method.
+
+        Args:
+            config: the job's config; image_path, output_dir, output_name,
+                output_format and the scale keys are honoured, and an
+                optional "synthetic" dict overrides the method's settings
+            ctx: optional JobContext, checked between sleep slices for
+                cancellation and preemption (raises JobCancelled)
+
+        Returns:
+            dict with output_path, output_width, output_height and
+            processing_time like the real upscalers, plus synthetic=True
+        """
+        start_time = time.time()
+        settings = {**self.settings, **config.get("synthetic", {})}
+
+        jitter = settings["jitter"]
+        latency = settings["latency"] * (1 + self._rng.uniform(-jitter, jitter))
+        ballast = bytearray(int(settings["memory_mb"] * 1024 * 1024))
+        # Touch every page so the memory is really resident
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+
+        deadline = start_time + latency
+        while (remaining := deadline - time.time()) > 0:
+            time.sleep(min(remaining, CHECKPOINT_SECONDS))
+            if ctx is not None:
+                ctx.checkpoint()
+        del ballast
+
+        if self._rng.random() < settings["failure_rate"]:
+            raise RuntimeError(f"Synthetic {self.method} failure")
+
+        output_width, output_height = self._output_size(config, settings)
+        output_dir = Path(config.get("output_dir", os.environ.get("OUTPUT_DIR", "/app/results")))
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_name = config.get("output_name", f"synthetic_{self.method}")
+        output_format = config.get("output_format", "png")
+        output_path = output_dir / f"{output_name}.{'tiff' if output_format == 'tiff' else 'png'}"
+        Image.new("RGB", (output_width, output_height), (128, 128, 128)).save(output_path)
+
+        return {
+            "output_path": str(output_path),
+            "output_paths": [str(output_path)],
+            "output_width": output_width,
+            "output_height": output_height,
+            "crop_info": None,
+            "synthetic": True,
+            "processing_time": time.time() - start_time,
+        }
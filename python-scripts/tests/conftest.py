@@ -0,0 +1,69 @@
+"""
+Tests for the Python worker and its utilities.
+
+Run from the repo root or python-scripts/:
+  python -m pytest python-scripts/tests -q
+
+Modules are imported the way worker.py imports them (utils.*, services.*),
+so python-scripts/ goes on sys.path. The /app/... default directories are
+redirected to a temporary tree before any service is imported, and models
+are small random-weight ESRGAN stand-ins (see evaluate.write_stand_in).
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+PYTHON_SCRIPTS = Path(__file__).resolve().parent.parent
+REPO_ROOT = PYTHON_SCRIPTS.parent
+
+if str(PYTHON_SCRIPTS) not in sys.path:
+    sys.path.insert(0, str(PYTHON_SCRIPTS))
+
+TEST_ROOT = Path(tempfile.mkdtemp(prefix="upscaler-tests-"))
+atexit.register(shutil.rmtree, TEST_ROOT, ignore_errors=True)
+
+for _name, _sub in {
+    "MODEL_CACHE_DIR": "models",
+    "OUTPUT_DIR": "results",
+    "SCRATCH_DIR": "temp",
+    "TILE_STORE_DIR": "temp/tiles",
+    "RAW_OUTPUT_DIR": "temp/raw",
+    "CHECKPOINT_DIR": "temp/checkpoints",
+}.items():
+    os.environ.setdefault(_name, str(TEST_ROOT / _sub))
+os.environ.setdefault("TUNING_PROFILES_PATH", str(TEST_ROOT / "tuning_profiles.json"))
+
+STAND_IN_MODEL = "4x-UltraSharp.pth"
+
+
+@pytest.fixture(scope="session")
+def models_dir() -> Path:
+    """MODEL_CACHE_DIR with a stand-in ESRGAN saved as STAND_IN_MODEL."""
+    from evaluate import write_stand_in
+
+    path = Path(os.environ["MODEL_CACHE_DIR"])
+    if not (path / "upscale_models" / STAND_IN_MODEL).exists():
+        write_stand_in(path / "upscale_models" / STAND_IN_MODEL)
+    return path
+
+
+@pytest.fixture
+def test_image(tmp_path) -> Path:
+    """A 200x150 PNG with gradients, edges and noise (not a multiple of any tile size)."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:150, 0:200]
+    img = np.stack([x / 200, y / 150, (x + y) / 350], axis=-1) * 255
+    img[(x // 24 + y // 24) % 2 == 0] *= 0.6
+    img += rng.normal(0, 8, img.shape)
+    path = tmp_path / "input.png"
+    Image.fromarray(img.clip(0, 255).astype(np.uint8)).save(path)
+    return path
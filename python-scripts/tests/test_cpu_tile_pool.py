@@ -0,0 +1,72 @@
+"""The CPU tile pool against the serial tile path."""
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import STAND_IN_MODEL
+from utils.cpu_tile_pool import CpuTilePool
+
+BASE = {
+    "model": STAND_IN_MODEL,
+    "tile_size": 64,
+    "tile_overlap": 8,
+    "use_fp16": False,
+    "upscale_factor": 4,
+    "pyramid": False,
+    "retain_raw": False,
+}
+
+
+@pytest.fixture(scope="module")
+def pool(models_dir):
+    pool = CpuTilePool(models_dir / "upscale_models", processes=3, threads=1, preload=STAND_IN_MODEL)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def upscaler(models_dir, pool, monkeypatch):
+    """An EsrganUpscaler whose cpu_parallel jobs run in the 3-process pool."""
+    from services import esrgan_upscaler
+
+    upscaler = esrgan_upscaler.EsrganUpscaler(models_dir=str(models_dir))
+    monkeypatch.setattr(esrgan_upscaler, "plan_split", lambda: (pool.processes, pool.threads))
+    upscaler._cpu_pool = pool
+    return upscaler
+
+
+def test_pool_yields_tiles_in_order(pool, upscaler):
+    from utils.tiling import tile_grid
+
+    torch.manual_seed(0)
+    img = torch.rand(1, 3, 150, 200)
+    # Edge tiles are smaller and tend to finish before the full tiles
+    # submitted ahead of them
+    tiles = tile_grid(150, 200, 64, 8)
+    model = upscaler._load_model(STAND_IN_MODEL, use_fp16=False)
+    serial = [(t, out.clone()) for t, out in upscaler._run_tiles(model, img, tiles, (0, 0))]
+    pooled = [(t, out.clone()) for t, out in pool.run_tiles(STAND_IN_MODEL, model.scale, img, tiles)]
+
+    assert [t for t, _ in pooled] == tiles
+    for (_, a), (_, b) in zip(serial, pooled):
+        assert torch.equal(a, b)
+
+
+def test_pool_output_matches_serial_byte_for_byte(upscaler, test_image, tmp_path):
+    from PIL import Image
+
+    base = {**BASE, "image_path": str(test_image), "output_dir": str(tmp_path)}
+    serial = upscaler.upscale({**base, "output_name": "serial", "cpu_parallel": False})
+    pooled = upscaler.upscale({**base, "output_name": "pooled", "cpu_parallel": True})
+
+    assert pooled["cpu_split"] == [3, 1]
+    assert serial["cpu_split"] is None
+    assert np.array_equal(
+        np.asarray(Image.open(pooled["output_path"])), np.asarray(Image.open(serial["output_path"]))
+    )
+
+
+def test_pool_is_off_by_default(upscaler, test_image, tmp_path):
+    result = upscaler.upscale({**BASE, "image_path": str(test_image), "output_dir": str(tmp_path)})
+    assert result["cpu_split"] is None
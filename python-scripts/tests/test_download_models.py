@@ -0,0 +1,168 @@
+"""scripts/download-models.py against a local HTTP stand-in for the hub."""
+
+import hashlib
+import importlib.util
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import REPO_ROOT
+
+_spec = importlib.util.spec_from_file_location("download_models", REPO_ROOT / "scripts" / "download-models.py")
+download_models = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(download_models)
+
+PAYLOAD = bytes(range(256)) * 4096 * 3  # 3 MiB, three read chunks
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class StandInHub(ThreadingHTTPServer):
+    """
+    Serves PAYLOAD for any path with Range support. The first GET is cut
+    off after `drop_after` bytes; HEAD reports the LFS size and hash
+    unless `publish_hash` is off.
+    """
+
+    def __init__(self, drop_after: int = None, publish_hash: bool = True):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.drop_after = drop_after
+        self.publish_hash = publish_hash
+        self.requests = []
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", None))
+        self.send_response(302)
+        self.send_header("Location", "/lfs")
+        self.send_header("X-Linked-Size", str(len(PAYLOAD)))
+        if self.server.publish_hash:
+            self.send_header("X-Linked-Etag", f'"{PAYLOAD_SHA256}"')
+        self.end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        self.server.requests.append(("GET", range_header))
+        start = int(range_header.split("=")[1].rstrip("-")) if range_header else 0
+        body = PAYLOAD[start:]
+
+        self.send_response(206 if range_header else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.drop_after is not None:
+            # Interrupt the transfer once, mid-body
+            drop_after, self.server.drop_after = self.server.drop_after, None
+            self.wfile.write(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def hub(request):
+    server = StandInHub(**getattr(request, "param", {}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download_models.time, "sleep", lambda seconds: None)
+
+
+def model_entry(**pinned) -> dict:
+    return {"repo_id": "org/repo", "filename": "model.pth", "dest": "upscale_models",
+            "size": None, "sha256": None, **pinned}
+
+
+def download(hub, tmp_path, model, **kwargs) -> bool:
+    # main() creates the destination folders
+    (tmp_path / model["dest"]).mkdir(exist_ok=True)
+    return download_models.download_model(model, tmp_path, hub.endpoint, download_models.Progress(), **kwargs)
+
+
+@pytest.mark.parametrize("hub", [{"drop_after": 2_500_000}], indirect=True)
+def test_interrupted_download_resumes_with_range_and_verifies(hub, tmp_path):
+    assert download(hub, tmp_path, model_entry(size=len(PAYLOAD), sha256=PAYLOAD_SHA256))
+
+    dest = tmp_path / "upscale_models" / "model.pth"
+    assert dest.read_bytes() == PAYLOAD
+    assert not dest.with_name("model.pth.part").exists()
+    gets = [r for r in hub.requests if r[0] == "GET"]
+    assert gets[0] == ("GET", None)
+    # Whole chunks written before the cut are kept; the partial one is refetched
+    assert gets[1] == ("GET", f"bytes={2 * download_models.CHUNK_SIZE}-")
+    assert json.loads(dest.with_name("model.pth.sha256").read_text())["source"] == "manifest"
+
+
+def test_resumes_from_a_part_file_left_by_a_killed_run(hub, tmp_path):
+    part = tmp_path / "upscale_models" / "model.pth.part"
+    part.parent.mkdir()
+    part.write_bytes(PAYLOAD[:123_456])
+
+    assert download(hub, tmp_path, model_entry(size=len(PAYLOAD), sha256=PAYLOAD_SHA256))
+    assert (tmp_path / "upscale_models" / "model.pth").read_bytes() == PAYLOAD
+    assert hub.requests == [("GET", "bytes=123456-")]
+
+
+def test_verified_file_is_skipped_without_network(hub, tmp_path):
+    pinned = model_entry(size=len(PAYLOAD), sha256=PAYLOAD_SHA256)
+    assert download(hub, tmp_path, pinned)
+    hub.requests.clear()
+
+    assert download(hub, tmp_path, pinned)
+    assert hub.requests == []
+
+
+def test_hash_mismatch_fails_and_installs_nothing(hub, tmp_path):
+    assert not download(hub, tmp_path, model_entry(size=len(PAYLOAD), sha256="0" * 64))
+    assert not (tmp_path / "upscale_models" / "model.pth").exists()
+    assert not (tmp_path / "upscale_models" / "model.pth.part").exists()
+
+
+def test_unpinned_entry_is_refused_unless_allowed(hub, tmp_path):
+    # Even though the hub reports a hash
+    assert not download(hub, tmp_path, model_entry())
+    assert hub.requests == []
+
+    assert download(hub, tmp_path, model_entry(), allow_unverified=True)
+    dest = tmp_path / "upscale_models" / "model.pth"
+    assert dest.read_bytes() == PAYLOAD
+    assert json.loads(dest.with_name("model.pth.sha256").read_text())["source"] == "hub"
+
+    # A file verified only against the hub is still refused without the flag
+    hub.requests.clear()
+    assert not download(hub, tmp_path, model_entry())
+    assert hub.requests == []
+
+
+@pytest.mark.parametrize("hub", [{"publish_hash": False}], indirect=True)
+def test_no_known_hash_installs_unverified_only_when_allowed(hub, tmp_path):
+    assert not download(hub, tmp_path, model_entry())
+    assert not any(r[0] == "GET" for r in hub.requests)
+
+    assert download(hub, tmp_path, model_entry(), allow_unverified=True)
+    sidecar = tmp_path / "upscale_models" / "model.pth.sha256"
+    assert json.loads(sidecar.read_text())["source"] == "unverified"
+
+
+def test_pin_writes_verified_hashes_into_the_manifest(hub, tmp_path):
+    models = [model_entry()]
+    assert download(hub, tmp_path, models[0], allow_unverified=True)
+
+    manifest = tmp_path / "manifest.json"
+    assert download_models.pin_manifest(manifest, models, tmp_path) == 1
+    pinned = json.loads(manifest.read_text())["models"][0]
+    assert (pinned["size"], pinned["sha256"]) == (len(PAYLOAD), PAYLOAD_SHA256)
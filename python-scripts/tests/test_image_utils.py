@@ -0,0 +1,18 @@
+"""Disk-backed uint8 conversion of large outputs."""
+
+import numpy as np
+import torch
+
+from utils.image_utils import tensor_to_uint8_memmap
+
+
+def test_tensor_to_uint8_memmap_rounds_and_clips(tmp_path):
+    values = torch.tensor([-0.002, 0.0, 0.5 / 255, 0.499, 0.5, 1.0, 1.004, 2.0])
+    image = values.view(1, -1, 1).expand(5, -1, 3).contiguous()
+
+    out = tensor_to_uint8_memmap(image, str(tmp_path / "out.u8"), strip_rows=2)
+
+    assert out.shape == (5, 8, 3)
+    # Out-of-range values saturate rather than wrapping to the other end
+    assert out[0, :, 0].tolist() == [0, 0, 1, 127, 128, 255, 255, 255]
+    assert np.array_equal(out, np.broadcast_to(out[:1, :, :1], out.shape))
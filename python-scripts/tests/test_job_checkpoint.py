@@ -0,0 +1,166 @@
+"""Crash and resume of checkpointed ESRGAN jobs."""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import PYTHON_SCRIPTS, STAND_IN_MODEL
+from utils.job_context import JobCancelled, JobContext
+
+BASE = {
+    "model": STAND_IN_MODEL,
+    "tile_size": 64,
+    "tile_overlap": 8,
+    "use_fp16": False,
+    "upscale_factor": 4,
+    "cpu_parallel": False,
+    "pyramid": False,
+    "retain_raw": False,
+    "checkpoint_every": 2,
+}
+
+# Runs the job and kills the process at the given tile boundary, the way
+# a worker crash does: nothing after the last written batch is saved
+CRASH_SCRIPT = textwrap.dedent("""
+    import json, os, sys
+    from services.esrgan_upscaler import EsrganUpscaler
+    from utils.job_context import JobContext
+
+    config, crash_at = json.loads(sys.argv[1]), int(sys.argv[2])
+    boundaries = []
+
+    def crash(ctx):
+        boundaries.append(ctx)
+        if len(boundaries) == crash_at:
+            os._exit(17)
+
+    EsrganUpscaler(models_dir=os.environ["MODEL_CACHE_DIR"]).upscale(
+        config, JobContext("crashed-job", on_checkpoint=crash)
+    )
+""")
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_small_jobs(monkeypatch):
+    """The test image has 12 tiles, below the CHECKPOINT_MIN_TILES floor."""
+    from utils import job_checkpoint
+
+    monkeypatch.setattr(job_checkpoint, "CHECKPOINT_MIN_TILES", 0)
+
+
+def load(path) -> np.ndarray:
+    return np.asarray(Image.open(path).convert("RGB"))
+
+
+def upscaler(models_dir):
+    from services.esrgan_upscaler import EsrganUpscaler
+
+    return EsrganUpscaler(models_dir=str(models_dir))
+
+
+def checkpointed_tiles(job_id: str) -> int:
+    from utils.job_checkpoint import CHECKPOINT_DIR
+
+    return sum(1 for _ in (PYTHON_SCRIPTS / CHECKPOINT_DIR / job_id).glob("pass0/**/*.npy"))
+
+
+def test_resume_after_crash_is_bit_identical(models_dir, test_image, tmp_path):
+    import json
+
+    config = {**BASE, "image_path": str(test_image), "output_dir": str(tmp_path), "output_name": "resumed"}
+    reference = upscaler(models_dir).upscale({**config, "output_name": "reference"})
+
+    crashed = subprocess.run(
+        [sys.executable, "-c", CRASH_SCRIPT, json.dumps(config), "8"],
+        cwd=str(PYTHON_SCRIPTS),
+        env={**os.environ, "PYTHONPATH": str(PYTHON_SCRIPTS), "CHECKPOINT_MIN_TILES": "0"},
+        capture_output=True,
+    )
+    assert crashed.returncode == 17, crashed.stderr.decode()[-2000:]
+    # Boundary 1 precedes the first tile: 7 tiles were done at the crash,
+    # and the 7th was still waiting for its batch of 2
+    assert checkpointed_tiles("crashed-job") == 6
+
+    result = upscaler(models_dir).upscale(config, JobContext("crashed-job"))
+    assert result["resumed_tiles"] == 6
+    assert np.array_equal(load(result["output_path"]), load(reference["output_path"]))
+    # Deleted once the job completes
+    assert checkpointed_tiles("crashed-job") == 0
+
+
+def test_resume_after_cancel_keeps_every_finished_tile(models_dir, test_image, tmp_path):
+    config = {**BASE, "image_path": str(test_image), "output_dir": str(tmp_path), "output_name": "resumed"}
+    reference = upscaler(models_dir).upscale({**config, "output_name": "reference"})
+
+    seen = []
+
+    def cancel_after_fifth_tile(ctx):
+        seen.append(ctx)
+        if len(seen) == 6:
+            ctx.cancel("preempted")
+
+    model = upscaler(models_dir)
+    with pytest.raises(JobCancelled):
+        model.upscale(config, JobContext("cancelled-job", on_checkpoint=cancel_after_fifth_tile))
+
+    result = model.upscale(config, JobContext("cancelled-job"))
+    assert result["resumed_tiles"] == 5
+    assert np.array_equal(load(result["output_path"]), load(reference["output_path"]))
+
+
+@pytest.fixture(scope="module")
+def pool(models_dir):
+    from utils.cpu_tile_pool import CpuTilePool
+
+    pool = CpuTilePool(models_dir / "upscale_models", processes=3, threads=1, preload=STAND_IN_MODEL)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("resume_in_pool", [True, False])
+def test_resume_of_a_pool_job_is_bit_identical(models_dir, pool, test_image, tmp_path, monkeypatch, resume_in_pool):
+    from services import esrgan_upscaler
+
+    monkeypatch.setattr(esrgan_upscaler, "plan_split", lambda: (pool.processes, pool.threads))
+    config = {**BASE, "image_path": str(test_image), "output_dir": str(tmp_path), "output_name": "resumed"}
+    reference = upscaler(models_dir).upscale({**config, "output_name": "reference"})
+
+    seen = []
+
+    def cancel_partway(ctx):
+        seen.append(ctx)
+        if len(seen) == 6:
+            ctx.cancel("preempted")
+
+    model = upscaler(models_dir)
+    model._cpu_pool = pool
+    job_id = f"pool-job-{resume_in_pool}"
+    with pytest.raises(JobCancelled):
+        model.upscale({**config, "cpu_parallel": True}, JobContext(job_id, on_checkpoint=cancel_partway))
+
+    # The retry may land on a node with or without the pool
+    result = model.upscale({**config, "cpu_parallel": resume_in_pool}, JobContext(job_id))
+    assert result["cpu_split"] == ([3, 1] if resume_in_pool else None)
+    assert 0 < result["resumed_tiles"] < 12
+    assert np.array_equal(load(result["output_path"]), load(reference["output_path"]))
+
+
+def test_checkpoints_are_opt_in_and_skip_small_jobs(monkeypatch):
+    from utils import job_checkpoint
+    from utils.job_checkpoint import JobCheckpoint
+
+    ctx = JobContext("opt-in")
+    assert JobCheckpoint.from_config({}, ctx, tiles=1000) is None
+    assert JobCheckpoint.from_config({"checkpoint_every": 0}, ctx, tiles=1000) is None
+    assert JobCheckpoint.from_config({"checkpoint_every": 4}, None, tiles=1000) is None
+
+    monkeypatch.setattr(job_checkpoint, "CHECKPOINT_MIN_TILES", 64)
+    assert JobCheckpoint.from_config({"checkpoint_every": 4}, ctx, tiles=63) is None
+    checkpoint = JobCheckpoint.from_config({"checkpoint_every": 4}, ctx, tiles=64)
+    assert checkpoint is not None and checkpoint.every == 4
+    checkpoint.delete()
@@ -0,0 +1,78 @@
+"""BufferPool reuse, and its safety against clear() from another thread."""
+
+import sys
+import threading
+
+import torch
+
+from utils.memory_policy import BufferPool
+
+
+def test_reuses_a_returned_buffer_zeroed():
+    pool = BufferPool(max_mb=16)
+    first = pool.take((1, 3, 64, 64), "cpu", torch.float32)
+    first.fill_(7)
+    pool.give(first)
+
+    second = pool.take((1, 3, 60, 64), "cpu", torch.float32)
+    assert pool.hits == 1
+    assert second.data_ptr() == first.data_ptr()
+    assert not second.any()
+
+
+def test_does_not_reuse_buffers_of_another_dtype_or_far_larger():
+    pool = BufferPool(max_mb=16)
+    pool.give(torch.ones(4096))
+    assert not pool.take((4096,), "cpu", torch.float16).any()
+    assert not pool.take((1000,), "cpu", torch.float32).any()
+    assert pool.hits == 0
+
+
+def test_clear_from_another_thread_while_jobs_take_and_give():
+    """The residency sweeper can run a full collection in the middle of a job."""
+    pool = BufferPool(max_mb=64)
+    errors = []
+    stop = threading.Event()
+
+    def job():
+        try:
+            for i in range(3000):
+                view = pool.take((1, 3, 32 + i % 4, 32), "cpu", torch.float32)
+                assert not view.any()
+                view.fill_(1)
+                pool.give(view)
+        except Exception as e:  # noqa: BLE001 - any failure fails the test
+            errors.append(e)
+
+    def sweeper():
+        while not stop.is_set():
+            pool.clear()
+
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        jobs = [threading.Thread(target=job) for _ in range(3)]
+        clearing = threading.Thread(target=sweeper)
+        clearing.start()
+        for t in jobs:
+            t.start()
+        for t in jobs:
+            t.join()
+        stop.set()
+        clearing.join()
+    finally:
+        sys.setswitchinterval(previous)
+
+    assert errors == []
+    assert pool.hits + pool.misses == 9000
+
+
+def test_picks_the_smallest_fitting_buffer_anywhere_in_the_pool():
+    pool = BufferPool(max_mb=16)
+    large, small = torch.ones(2000), torch.ones(1100)
+    pool.give(large)
+    pool.give(small)
+
+    view = pool.take((1000,), "cpu", torch.float32)
+    assert view.data_ptr() == small.data_ptr()
+    assert pool.nbytes() == large.numel() * large.element_size()
@@ -0,0 +1,109 @@
+"""Framed and JSON-line channels, and the worker's reader surviving bad messages."""
+
+import io
+import os
+import socket
+import subprocess
+import sys
+
+from conftest import PYTHON_SCRIPTS
+from utils.protocol import HEADER, MAX_FRAME_BYTES, FrameDecoder, FramedChannel, JsonLineChannel, encode_frame
+
+
+def raw_frame(payload: bytes) -> bytes:
+    return HEADER.pack(len(payload)) + payload
+
+
+def read_all(data: bytes) -> list[dict]:
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, data)
+    os.close(write_fd)
+    try:
+        return list(FramedChannel(read_fd))
+    finally:
+        os.close(read_fd)
+
+
+def test_frames_round_trip_across_chunk_boundaries():
+    data = encode_frame({"job_id": "a"}) + encode_frame({"job_id": "b", "config": {"x": [1, 2]}})
+    decoder = FrameDecoder()
+    messages = []
+    for i in range(len(data)):
+        messages += decoder.feed(data[i:i + 1])
+    assert messages == [{"job_id": "a"}, {"job_id": "b", "config": {"x": [1, 2]}}]
+
+
+def test_bad_frames_become_invalid_messages_and_reading_continues():
+    data = (
+        encode_frame({"job_id": "before"})
+        + raw_frame(b"{not json")
+        + raw_frame(b"\xff\xfe")
+        + raw_frame(b"[1, 2]")
+        + encode_frame({"job_id": "after"})
+    )
+    messages = read_all(data)
+
+    assert [m.get("job_id") for m in messages] == ["before", None, None, None, "after"]
+    assert [m.get("type") for m in messages[1:4]] == ["invalid"] * 3
+    assert all(m["error"] for m in messages[1:4])
+
+
+def test_oversized_length_prefix_ends_the_stream_with_an_invalid_message():
+    data = encode_frame({"job_id": "before"}) + HEADER.pack(MAX_FRAME_BYTES + 1) + b"junk"
+    messages = read_all(data)
+    assert messages[0] == {"job_id": "before"}
+    assert messages[-1]["type"] == "invalid"
+    assert "too large" in messages[-1]["error"]
+
+
+def test_json_line_channel_reports_bad_lines():
+    reader = io.StringIO('{"job_id": "a"}\nnot json\n"just a string"\n\n{"job_id": "b"}\n')
+    messages = list(JsonLineChannel(reader=reader, writer=io.StringIO()))
+    assert [m.get("type") for m in messages] == [None, "invalid", "invalid", None]
+
+
+def test_worker_keeps_reading_after_a_bad_frame(tmp_path):
+    """A malformed frame is answered with an error and the next job still runs."""
+    parent, child = socket.socketpair()
+    env = dict(
+        os.environ,
+        WORKER_PROTOCOL="framed",
+        WORKER_CHANNEL_FD=str(child.fileno()),
+        WORKER_SYNTHETIC='{"esrgan": {"latency": 0.05, "memory_mb": 1}}',
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-u", "worker.py"],
+        cwd=PYTHON_SCRIPTS, env=env, pass_fds=[child.fileno()],
+        stdout=subprocess.DEVNULL,
+    )
+    child.close()
+    parent.settimeout(30)
+    decoder = FrameDecoder()
+
+    def receive_until(predicate):
+        while True:
+            for msg in decoder.feed(parent.recv(65536)):
+                if predicate(msg):
+                    return msg
+
+    try:
+        receive_until(lambda m: m.get("message") == "ready")
+        parent.sendall(raw_frame(b"{oops") + encode_frame({
+            "job_id": "j1",
+            "method": "esrgan",
+            "config": {"output_dir": str(tmp_path), "output_name": "out", "upscale_factor": 2},
+        }))
+
+        error = receive_until(lambda m: m.get("type") == "error")
+        assert error["job_id"] == "unknown"
+        assert "Invalid JSON" in error["error"]
+
+        result = receive_until(lambda m: m.get("type") == "result")
+        assert result["job_id"] == "j1"
+        assert result["status"] == "completed"
+        assert (tmp_path / "out.png").exists()
+    finally:
+        worker.kill()
+        worker.wait()
+        parent.close()
+
@@ -0,0 +1,56 @@
+"""Int8 calibration is fixed, reproducible and part of the cache key."""
+
+import shutil
+
+import torch
+
+from conftest import STAND_IN_MODEL
+from utils import quantization
+from utils.quantization import CALIBRATION_VERSION, calibration_tiles, load_or_quantize, quantized_cache_path
+
+
+def test_calibration_tiles_are_deterministic():
+    first, second = calibration_tiles(), calibration_tiles()
+    assert len(first) == len(second) >= 4
+    for a, b in zip(first, second):
+        assert a.shape == (1, 3, quantization.CALIBRATION_TILE_SIZE, quantization.CALIBRATION_TILE_SIZE)
+        assert 0 <= a.min() and a.max() <= 1
+        assert torch.equal(a, b)
+
+
+def _quantize_in(directory, models_dir):
+    from services.esrgan_upscaler import EsrganUpscaler
+
+    model_path = directory / STAND_IN_MODEL
+    shutil.copy(models_dir / "upscale_models" / STAND_IN_MODEL, model_path)
+    upscaler = EsrganUpscaler(str(models_dir))
+    return load_or_quantize(model_path, lambda: upscaler._load_model(STAND_IN_MODEL, use_fp16=False))
+
+
+def test_quantization_is_reproducible_across_hosts(tmp_path, models_dir):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = _quantize_in(tmp_path / "a", models_dir)
+    second = _quantize_in(tmp_path / "b", models_dir)
+
+    tile = torch.rand(1, 3, 48, 40, generator=torch.Generator().manual_seed(1))
+    assert torch.equal(first(tile), second(tile))
+
+
+def test_cache_is_keyed_by_calibration_version(tmp_path, models_dir):
+    model = _quantize_in(tmp_path, models_dir)
+    cache_path = quantized_cache_path(tmp_path / STAND_IN_MODEL)
+    assert f"cal{CALIBRATION_VERSION}" in cache_path.name
+
+    # Reused while the calibration matches
+    calls = []
+    load_or_quantize(tmp_path / STAND_IN_MODEL, lambda: calls.append(1))
+    assert calls == []
+
+    # Rebuilt when the cached file was calibrated differently
+    torch.jit.save(model.module, str(cache_path), _extra_files={"scale": "4", "calibration": "0"})
+    rebuilt = _quantize_in(tmp_path, models_dir)
+    extra_files = {"calibration": ""}
+    torch.jit.load(str(cache_path), _extra_files=extra_files)
+    assert extra_files["calibration"] in (str(CALIBRATION_VERSION), str(CALIBRATION_VERSION).encode())
+    assert rebuilt.scale == 4
@@ -0,0 +1,28 @@
+"""Raw output retention for deferred crop finalization."""
+
+import numpy as np
+
+from utils import raw_store
+from utils.raw_store import RawStore, retain_for_crop
+
+CROP_INFO = {"direction": "horizontal", "amount_px": 8}
+
+
+def test_retention_is_opt_in(monkeypatch):
+    rgb = np.zeros((16, 24, 3), np.uint8)
+    assert retain_for_crop({}, "raw-default", rgb, CROP_INFO) is None
+
+    monkeypatch.setattr(raw_store, "RETAIN_RAW_OUTPUT", True)
+    assert retain_for_crop({}, "raw-node", rgb, CROP_INFO) is not None
+    assert retain_for_crop({"retain_raw": False}, "raw-job-off", rgb, CROP_INFO) is None
+
+
+def test_retained_output_reopens_unchanged():
+    rgb = np.random.default_rng(0).integers(0, 256, (16, 24, 3), dtype=np.uint8)
+    assert retain_for_crop({"retain_raw": True}, "raw-job", rgb, CROP_INFO) is not None
+    # Outputs cropped to a chosen offset are final; nothing to retain
+    assert retain_for_crop({"retain_raw": True}, "raw-final", rgb, {**CROP_INFO, "offset_px": 0}) is None
+
+    arr, meta = RawStore().open("raw-job")
+    assert np.array_equal(arr, rgb)
+    assert meta["crop_info"] == CROP_INFO
@@ -0,0 +1,153 @@
+"""Idle offload, release and reload of resident models, including during a job."""
+
+import threading
+import time
+
+import torch
+
+from utils.residency import DEVICE, HOST, RELEASED, ResidencyManager
+
+
+class StandInModels:
+    """Small modules registered the way FluxUpscaler registers its components."""
+
+    def __init__(self, manager: ResidencyManager, names=("unet", "vae")):
+        self.modules = {}
+        self.location = {}
+        self.events = []
+        for name in names:
+            self.modules[name] = torch.nn.Linear(8, 8)
+            self.location[name] = "cpu"
+            manager.register(
+                name,
+                to_device=self._mover(name, "device"),
+                to_host=self._mover(name, "host"),
+                load=self._loader(name),
+                release=self._releaser(name),
+            )
+
+    def _mover(self, name, where):
+        def move():
+            self.location[name] = where
+            self.events.append((name, where))
+        return move
+
+    def _loader(self, name):
+        def load():
+            torch.manual_seed(0)
+            self.modules[name] = torch.nn.Linear(8, 8)
+            self.events.append((name, "load"))
+        return load
+
+    def _releaser(self, name):
+        def release():
+            self.modules[name] = None
+            self.events.append((name, "release"))
+        return release
+
+
+def make_manager():
+    clock = [0.0]
+    manager = ResidencyManager(offload_after=300, release_after=1800, clock=lambda: clock[0])
+    return manager, clock
+
+
+def states(manager):
+    return {name: s["state"] for name, s in manager.state().items()}
+
+
+def test_idle_components_are_offloaded_released_and_reloaded_by_the_next_job():
+    manager, clock = make_manager()
+    models = StandInModels(manager)
+
+    with manager.use():
+        assert states(manager) == {"unet": DEVICE, "vae": DEVICE}
+
+    clock[0] = 299
+    assert manager.sweep() == []
+    clock[0] = 300
+    assert manager.sweep() == [("unet", HOST), ("vae", HOST)]
+    clock[0] = 1800
+    assert manager.sweep() == [("unet", RELEASED), ("vae", RELEASED)]
+    assert models.modules == {"unet": None, "vae": None}
+
+    with manager.use("unet"):
+        assert models.modules["unet"] is not None
+        assert models.location["unet"] == "device"
+        assert states(manager) == {"unet": DEVICE, "vae": RELEASED}
+
+    counts = manager.state()["unet"]
+    assert (counts["loads"], counts["to_device"], counts["to_host"], counts["releases"]) == (1, 2, 1, 1)
+
+
+def test_sweeper_never_moves_models_while_a_job_uses_them():
+    manager, clock = make_manager()
+    models = StandInModels(manager)
+    transitions = []
+    manager.start(interval=0.01, on_transition=transitions.extend)
+
+    in_job = threading.Event()
+    finish = threading.Event()
+    seen = []
+
+    def job():
+        with manager.use():
+            in_job.set()
+            # Long past both thresholds while the job still runs
+            clock[0] = 10_000
+            while not finish.is_set():
+                seen.append(models.modules["unet"] is not None and models.location["unet"] == "device")
+                time.sleep(0.005)
+
+    worker = threading.Thread(target=job)
+    worker.start()
+    assert in_job.wait(5)
+    time.sleep(0.2)  # ~20 sweeps
+    assert transitions == []
+    finish.set()
+    worker.join()
+    assert seen and all(seen)
+
+    # Idle from the end of the job on: offloaded, then released
+    clock[0] += 300
+    deadline = time.time() + 5
+    while ("unet", HOST) not in transitions and time.time() < deadline:
+        time.sleep(0.01)
+    assert ("unet", HOST) in transitions
+    clock[0] += 1500
+    while ("unet", RELEASED) not in transitions and time.time() < deadline:
+        time.sleep(0.01)
+    assert ("unet", RELEASED) in transitions
+
+    # And the next job brings it back
+    with manager.use():
+        assert models.modules["unet"] is not None
+        assert models.location["unet"] == "device"
+
+
+def test_prefetch_waits_for_the_running_job_then_reloads_into_host_memory():
+    manager, clock = make_manager()
+    models = StandInModels(manager, names=("unet",))
+    clock[0] = 2000
+    manager.sweep()
+    manager.sweep()
+    assert states(manager) == {"unet": RELEASED}
+
+    models.events.clear()
+    with manager.use():
+        # A job is running: the reload is queued behind it
+        thread = manager.prefetch()
+        thread.join(0.1)
+        assert thread.is_alive()
+    thread.join(5)
+    assert models.events == [("unet", "load"), ("unet", "device")]
+
+
+def test_jobs_that_preempt_a_job_can_nest_use_on_the_same_thread():
+    manager, clock = make_manager()
+    StandInModels(manager)
+    with manager.use():
+        with manager.use("vae"):
+            assert manager.state()["vae"]["busy"]
+        assert manager.state()["vae"]["busy"]
+    assert not manager.state()["vae"]["busy"]
@@ -0,0 +1,227 @@
+"""
+Multi-process tile execution for CPU-only nodes.
+
+One model(tile) call cannot keep a many-core CPU busy: PyTorch's intra-op
+threads scale poorly for the small convolutions in ESRGAN-style models.
+CpuTilePool instead runs tiles concurrently in a pool of spawned processes,
+each with a few intra-op threads:
+
+- Each process loads the model through ModelStore, whose safetensors
+  weights are memory-mapped, so the weight pages are shared rather than
+  copied per process.
+- The input image is placed in shared memory once per pass.
+- Finished tiles are written into a ring of shared-memory output slots.
+  The parent blends each slot into the output and then reuses it.
+
+Only tile indices and slot numbers cross the process boundary. Outputs
+are handed back in tile order, so the blend, and with it the output, is
+the same as running the tiles one by one.
+
+The pool is off unless a job sets cpu_parallel=True or the node sets
+CPU_TILE_PARALLEL=true. CPU_TILE_PROCESSES / CPU_TILE_THREADS override
+the automatic split.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from utils.job_context import JobContext
+from utils.model_store import ModelStore
+
+CPU_TILE_PARALLEL = os.environ.get("CPU_TILE_PARALLEL", "false") == "true"
+CPU_TILE_PROCESSES = int(os.environ.get("CPU_TILE_PROCESSES", 0))
+CPU_TILE_THREADS = int(os.environ.get("CPU_TILE_THREADS", 0))
+
+# Output slots per process: one being written, one waiting to be blended
+SLOTS_PER_PROCESS = 2
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on (respects affinity / cpusets)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def plan_split(cores: int = None) -> tuple[int, int]:
+    """
+    Choose processes x threads for a core count.
+
+    Small convs stop gaining from intra-op threads after two to four, so
+    the cores go to processes first. A few threads each keep the process
+    count, and with it the per-process activation memory, reasonable on
+    very wide machines.
+    """
+    cores = cores or available_cores()
+    if CPU_TILE_THREADS:
+        threads = CPU_TILE_THREADS
+    elif cores >= 32:
+        threads = 4
+    elif cores >= 8:
+        threads = 2
+    else:
+        threads = 1
+    processes = CPU_TILE_PROCESSES or max(1, cores // threads)
+    return processes, threads
+
+
+# Per-process state, set up by _init_process
+_store = None
+_models = {}
+
+
+def _init_process(models_dir: str, threads: int, preload: str = None):
+    global _store
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _store = ModelStore(Path(models_dir))
+    if preload:
+        _get_model(preload)
+
+
+def _get_model(model_name: str):
+    model = _models.get(model_name)
+    if model is None:
+        _models.clear()
+        model = _store.load(model_name).to(torch.device("cpu"))
+        model.eval()
+        _models[model_name] = model
+    return model
+
+
+def _run_tile(model_name, input_name, input_shape, slots_name, slots_shape, slot, y1, y2, x1, x2):
+    """Run one tile from the shared input into a shared output slot. Returns the output (h, w)."""
+    model = _get_model(model_name)
+
+    inp = SharedMemory(name=input_name)
+    slots = SharedMemory(name=slots_name)
+    try:
+        tile = np.ndarray(input_shape, dtype=np.float32, buffer=inp.buf)[:, :, y1:y2, x1:x2].copy()
+        with torch.no_grad():
+            out = model(torch.from_numpy(tile))[0].numpy()
+        h, w = out.shape[1:]
+        np.ndarray(slots_shape, dtype=np.float32, buffer=slots.buf)[slot, :, :h, :w] = out
+        return h, w
+    finally:
+        inp.close()
+        slots.close()
+
+
+class CpuTilePool:
+    def __init__(self, models_dir: Path, processes: int, threads: int, preload: str = None):
+        """
+        Args:
+            models_dir: upscale_models directory (as used by ModelStore)
+            processes, threads: the split, usually from plan_split()
+            preload: model every process loads as it starts; other models
+                are loaded on first use
+        """
+        self.models_dir = Path(models_dir)
+        self.processes = processes
+        self.threads = threads
+        self.executor = ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(str(self.models_dir), threads, preload),
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def runner(self, model_name: str, scale: int):
+        """A tile_runner for EsrganUpscaler._upscale_region bound to a model."""
+        def run(img_tensor, tiles, origin, ctx=None):
+            return self.run_tiles(model_name, scale, img_tensor, tiles, origin, ctx)
+        return run
+
+    def run_tiles(
+        self,
+        model_name: str,
+        scale: int,
+        img_tensor: torch.Tensor,
+        tiles: list[dict],
+        origin: tuple = (0, 0),
+        ctx: JobContext = None,
+    ):
+        """
+        Run tiles in the pool, yielding (tile, output) in tile order.
+
+        Tiles complete in any order; a tile that finishes early keeps its
+        slot until every tile before it has been yielded, so the caller
+        blends in the same order as the serial path and gets the same
+        floats. Each output tensor is a view of a shared slot and is only
+        valid until the next item is requested. ctx.checkpoint() runs
+        between completions.
+        """
+        oy, ox = origin
+        src = img_tensor.detach().to("cpu", torch.float32).contiguous().numpy()
+        max_h = max(t["y2"] - t["y1"] for t in tiles) * scale
+        max_w = max(t["x2"] - t["x1"] for t in tiles) * scale
+        slots_shape = (self.processes * SLOTS_PER_PROCESS, 3, max_h, max_w)
+
+        inp = SharedMemory(create=True, size=src.nbytes)
+        slots_mem = SharedMemory(create=True, size=int(np.prod(slots_shape)) * 4)
+        pending = {}
+        try:
+            np.ndarray(src.shape, dtype=np.float32, buffer=inp.buf)[:] = src
+            slots = np.ndarray(slots_shape, dtype=np.float32, buffer=slots_mem.buf)
+            free = list(range(slots_shape[0]))
+            # Finished tiles waiting for their turn: index -> (slot, h, w)
+            finished = {}
+            submitted = 0
+            next_index = 0
+
+            while next_index < len(tiles):
+                while free and submitted < len(tiles):
+                    t = tiles[submitted]
+                    slot = free.pop()
+                    future = self.executor.submit(
+                        _run_tile, model_name, inp.name, src.shape, slots_mem.name, slots_shape, slot,
+                        t["y1"] - oy, t["y2"] - oy, t["x1"] - ox, t["x2"] - ox,
+                    )
+                    pending[future] = (submitted, slot)
+                    submitted += 1
+
+                # Tiles are submitted in order, so the next one to yield is
+                # either finished or still pending
+                if next_index not in finished:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index, slot = pending.pop(future)
+                        finished[index] = (slot, *future.result())
+
+                while next_index in finished:
+                    slot, h, w = finished.pop(next_index)
+                    yield tiles[next_index], torch.from_numpy(slots[slot, :, :h, :w]).unsqueeze(0)
+                    free.append(slot)
+                    next_index += 1
+
+                if ctx is not None and next_index < len(tiles):
+                    ctx.checkpoint()
+        finally:
+            # Tiles already running still write into the slots; let them finish
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            slots = None
+            for mem in (inp, slots_mem):
+                mem.unlink()
+                try:
+                    mem.close()
+                except BufferError:
+                    # The caller still holds the last yielded view; the
+                    # mapping goes away with it
+                    pass
+
+
+def tile_rate(tiles: int, started: float) -> float:
+    """Tiles per second since `started` (a time.time() value)."""
+    return round(tiles / max(time.time() - started, 1e-6), 2)
@@ -0,0 +1,133 @@
+"""
+Region-of-interest planning for crop-aware upscaling.
+
+calculate_scale_for_crop() oversizes one axis so the crop offset can be
+chosen later. When the caller picks the crop up front (an explicit offset,
+or a "center" / "saliency" policy), the upscalers only need to compute the
+final print rectangle, plus whatever margin resampling needs around it.
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+CROP_POLICIES = ("offset", "center", "saliency")
+
+# Longest side of the thumbnail used for saliency scoring
+SALIENCY_MAX_SIDE = 512
+
+# LANCZOS kernel radius in source pixels (times the downscale ratio)
+LANCZOS_SUPPORT = 3
+
+
+def _saliency_offset(pixels: np.ndarray, horizontal: bool, window_fraction: float) -> float:
+    """
+    Position (0..1 of the free range) of the crop window with the most
+    gradient energy. Near-ties go to the window closest to the center.
+    """
+    h, w = pixels.shape[:2]
+    shrink = min(1.0, SALIENCY_MAX_SIDE / max(h, w))
+    if shrink < 1.0:
+        pixels = cv2.resize(pixels, (max(1, round(w * shrink)), max(1, round(h * shrink))),
+                            interpolation=cv2.INTER_AREA)
+
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY).astype(np.float32)
+    energy = cv2.magnitude(
+        cv2.Sobel(gray, cv2.CV_32F, 1, 0),
+        cv2.Sobel(gray, cv2.CV_32F, 0, 1),
+    )
+    profile = energy.sum(axis=0 if horizontal else 1)
+
+    n = len(profile)
+    window = min(n, max(1, round(n * window_fraction)))
+    if window >= n:
+        return 0.5
+
+    cumulative = np.concatenate([[0.0], np.cumsum(profile)])
+    scores = cumulative[window:] - cumulative[:-window]
+    candidates = np.flatnonzero(scores >= scores.max() * 0.99)
+    center = (len(scores) - 1) / 2
+    best = candidates[np.argmin(np.abs(candidates - center))]
+    return best / (len(scores) - 1)
+
+
+def plan_crop(scale_info: dict, policy: str, offset: int = None, pixels: np.ndarray = None) -> dict:
+    """
+    Resolve a crop policy to the final rectangle in output pixels.
+
+    Args:
+        scale_info: Result of calculate_scale_for_crop()
+        policy: "offset", "center" or "saliency"
+        offset: Crop offset in output pixels along the cropped axis ("offset")
+        pixels: Decoded (H, W, 3) uint8 input ("saliency")
+
+    Returns:
+        dict with policy, offset_px and rect (x1, y1, x2, y2) in output pixels
+    """
+    if policy not in CROP_POLICIES:
+        raise ValueError(f"Unknown crop policy: {policy} (expected one of {CROP_POLICIES})")
+
+    amount = scale_info["crop_amount_px"]
+    horizontal = scale_info["crop_direction"] == "horizontal"
+
+    if policy == "offset":
+        if offset is None:
+            raise ValueError("crop_policy 'offset' requires crop_offset")
+        offset_px = int(offset)
+    elif policy == "center":
+        offset_px = amount // 2
+    else:
+        if pixels is None:
+            raise ValueError("crop_policy 'saliency' requires the decoded image")
+        output_len = scale_info["output_width_px" if horizontal else "output_height_px"]
+        final_len = scale_info["final_width_px" if horizontal else "final_height_px"]
+        offset_px = round(_saliency_offset(pixels, horizontal, final_len / output_len) * amount)
+
+    offset_px = max(0, min(amount, offset_px))
+    final_w, final_h = scale_info["final_width_px"], scale_info["final_height_px"]
+    x1, y1 = (offset_px, 0) if horizontal else (0, offset_px)
+    return {
+        "policy": policy,
+        "offset_px": offset_px,
+        "rect": (x1, y1, x1 + final_w, y1 + final_h),
+    }
+
+
+def source_box(rect: tuple, output_size: tuple, source_size: tuple) -> tuple:
+    """
+    Map an output rectangle (x1, y1, x2, y2) to float coordinates in a
+    source image that is resized to output_size, as used by PIL's
+    Image.resize(box=...).
+    """
+    out_w, out_h = output_size
+    src_w, src_h = source_size
+    sx, sy = src_w / out_w, src_h / out_h
+    x1, y1, x2, y2 = rect
+    return (x1 * sx, y1 * sy, x2 * sx, y2 * sy)
+
+
+def resample_region(box: tuple, output_size: tuple, source_size: tuple, scale: int) -> tuple:
+    """
+    Region (y1, y2, x1, x2) of the model input whose upscaled pixels a
+    LANCZOS resize of `box` reads, including the filter support.
+
+    Args:
+        box: Source box from source_box(), in model output pixels
+        output_size: (width, height) the model output is resized to
+        source_size: (width, height) of the model output
+        scale: Model output pixels per model input pixel
+    """
+    src_w, src_h = source_size
+    ratio_x = max(1.0, src_w / output_size[0])
+    ratio_y = max(1.0, src_h / output_size[1])
+    margin_x = LANCZOS_SUPPORT * ratio_x + 1
+    margin_y = LANCZOS_SUPPORT * ratio_y + 1
+
+    bx1, by1, bx2, by2 = box
+    return (
+        max(0, math.floor((by1 - margin_y) / scale)),
+        min(src_h // scale, math.ceil((by2 + margin_y) / scale)),
+        max(0, math.floor((bx1 - margin_x) / scale)),
+        min(src_w // scale, math.ceil((bx2 + margin_x) / scale)),
+    )
@@ -0,0 +1,179 @@
+"""
+Shared image ingest for all upscaler backends.
+
+probe_image() reads only the file header (via PIL's lazy open) to get the
+displayed dimensions, format and EXIF orientation. That is enough for
+validation and calculate_scale_for_crop, and lets oversized inputs be
+rejected before any pixels are decoded.
+
+load_image() decodes the file exactly once into a single writable
+(H, W, 3) uint8 RGB buffer. Backends take zero-copy views of it: NCHW for
+ESRGAN, NHWC for ComfyUI, or a PIL image. JPEGs can be decoded at 1/2, 1/4
+or 1/8 resolution (libjpeg DCT scaling) when the plan only needs a smaller
+input.
+"""
+
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+from utils.image_utils import uint8_array_to_pil
+
+# Largest accepted input, in pixels (default 100 MP)
+MAX_INPUT_PIXELS = int(os.environ.get("MAX_INPUT_PIXELS", 100_000_000))
+
+# EXIF orientations that rotate the image by 90 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# OpenCV >= 4.10 can decode straight to RGB (full resolution only)
+IMREAD_COLOR_RGB = getattr(cv2, "IMREAD_COLOR_RGB", None)
+
+DRAFT_FACTORS = (8, 4, 2)
+DRAFT_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _orientation(img: Image.Image) -> int:
+    # getexif() on a PNG without an early eXIf chunk decodes the whole file
+    if img.format == "PNG" and "exif" not in img.info:
+        return 1
+    return img.getexif().get(ExifTags.Base.Orientation, 1)
+
+
+def probe_image(image_path) -> dict:
+    """
+    Read dimensions and format from the image header without decoding pixels.
+
+    Args:
+        image_path: Path to the image file
+
+    Returns:
+        dict with width, height (as displayed, after EXIF orientation),
+        stored_width, stored_height (as encoded), format, mode and orientation
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        ValueError: If the file is not a readable image or exceeds MAX_INPUT_PIXELS
+    """
+    image_path = Path(image_path)
+    if not image_path.exists():
+        raise FileNotFoundError(f"Input file not found: {image_path}")
+
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            info = {
+                "stored_width": width,
+                "stored_height": height,
+                "format": img.format,
+                "mode": img.mode,
+                "orientation": _orientation(img),
+            }
+    except (Image.DecompressionBombError, OSError) as e:
+        raise ValueError(f"Could not read image header: {image_path}: {e}")
+
+    if info["orientation"] in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    info["width"] = width
+    info["height"] = height
+
+    pixels = width * height
+    if pixels > MAX_INPUT_PIXELS:
+        raise ValueError(
+            f"Input image too large: {width}x{height} ({pixels / 1e6:.1f} MP) "
+            f"exceeds the {MAX_INPUT_PIXELS / 1e6:.1f} MP limit"
+        )
+    return info
+
+
+def pick_draft_factor(info: dict, min_width: int, min_height: int) -> int:
+    """
+    Largest JPEG DCT reduction (8, 4, 2) whose output still covers
+    min_width x min_height, or 1 if the input can't be reduced.
+    """
+    if info["format"] != "JPEG":
+        return 1
+    for factor in DRAFT_FACTORS:
+        if -(-info["width"] // factor) >= min_width and -(-info["height"] // factor) >= min_height:
+            return factor
+    return 1
+
+
+class IngestedImage:
+    """A decoded RGB image and zero-copy views of it for each backend."""
+
+    def __init__(self, pixels: np.ndarray, info: dict, draft_factor: int = 1):
+        self.pixels = pixels
+        self.info = info
+        self.draft_factor = draft_factor
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    def tensor_nchw(self):
+        """(1, 3, H, W) uint8 tensor sharing memory with the buffer (ESRGAN layout)."""
+        import torch
+        return torch.from_numpy(self.pixels).permute(2, 0, 1).unsqueeze(0)
+
+    def tensor_nhwc(self):
+        """(1, H, W, 3) uint8 tensor sharing memory with the buffer (ComfyUI layout)."""
+        import torch
+        return torch.from_numpy(self.pixels).unsqueeze(0)
+
+    def pil(self) -> Image.Image:
+        """PIL image backed by the same buffer."""
+        return uint8_array_to_pil(self.pixels)
+
+
+def _decode_with_pil(image_path: Path) -> np.ndarray:
+    """Fallback decoder for formats OpenCV can't read."""
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return np.array(img)
+
+
+def load_image(image_path, info: dict = None, draft_factor: int = 1) -> IngestedImage:
+    """
+    Decode an image once into a contiguous (H, W, 3) uint8 RGB buffer.
+
+    Args:
+        image_path: Path to the image file
+        info: Result of probe_image(), probed here if not given
+        draft_factor: JPEG reduction factor from pick_draft_factor(); the
+            decoded image is about 1/draft_factor of the probed size
+
+    Returns:
+        IngestedImage
+    """
+    image_path = Path(image_path)
+    info = info or probe_image(image_path)
+    if info["format"] != "JPEG":
+        draft_factor = 1
+
+    # OpenCV decodes straight into a writable numpy buffer, applies EXIF
+    # orientation and does DCT-scaled JPEG decoding. Reduced decodes come out
+    # BGR, but they are small enough that the conversion copy is cheap.
+    if draft_factor == 1 and IMREAD_COLOR_RGB is not None:
+        pixels = cv2.imread(str(image_path), IMREAD_COLOR_RGB)
+    else:
+        bgr = cv2.imread(str(image_path), DRAFT_FLAGS.get(draft_factor, cv2.IMREAD_COLOR))
+        pixels = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB) if bgr is not None else None
+
+    if pixels is None:
+        pixels = _decode_with_pil(image_path)
+        draft_factor = 1
+
+    return IngestedImage(np.ascontiguousarray(pixels), info, draft_factor)
@@ -6,6 +6,7 @@ Extracted from the ESRGAN and Imagen upscaler notebooks.
 
 import base64
 import io
+import math
 import numpy as np
 from pathlib import Path
 from PIL import Image
@@ -51,12 +52,110 @@ def save_image_formats(
     return saved_paths
 
 
+def _uint8_memmap(path: str, shape: tuple) -> np.memmap:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+
+
+def tensor_to_uint8_memmap(image, path: str, strip_rows: int = 256) -> np.memmap:
+    """
+    Convert a float image tensor to a disk-backed uint8 array, strip by strip.
+
+    Avoids materializing a full float32 numpy copy of very large outputs.
+    Values are rounded and clipped, so VAE overshoot past [0, 1] saturates
+    instead of wrapping around.
+
+    Args:
+        image: Tensor (H, W, C) with values in [0, 1], on any device
+        path: File to back the array with (created or overwritten)
+        strip_rows: Rows converted per step
+
+    Returns:
+        np.memmap (H, W, C) uint8
+    """
+    h, w, c = image.shape
+    out = _uint8_memmap(path, (h, w, c))
+    for y in range(0, h, strip_rows):
+        strip = image[y:y + strip_rows].cpu().numpy()
+        out[y:y + strip_rows] = np.clip(strip * 255 + 0.5, 0, 255).astype(np.uint8)
+    out.flush()
+    return out
+
+
+def pil_to_uint8_memmap(img: Image.Image, path: str, strip_rows: int = 256) -> np.memmap:
+    """Copy an RGB PIL image to a disk-backed (H, W, 3) uint8 array, strip by strip."""
+    w, h = img.size
+    out = _uint8_memmap(path, (h, w, 3))
+    for y in range(0, h, strip_rows):
+        out[y:y + strip_rows] = np.asarray(img.crop((0, y, w, min(h, y + strip_rows))))
+    out.flush()
+    return out
+
+
+def resize_to_uint8_memmap(
+    rgb: np.ndarray,
+    size: tuple,
+    path: str,
+    box: tuple = None,
+    strip_rows: int = 256,
+) -> np.memmap:
+    """
+    LANCZOS-resize an (H, W, 3) uint8 array into a disk-backed array.
+
+    The output is produced strip_rows rows at a time from only the source
+    rows those need, so neither image has to fit in memory when rgb is a
+    memmap. Matches Image.resize(size, LANCZOS, box=box) to within one
+    level (the filter weights are rounded per strip).
+
+    Args:
+        rgb: Source image, e.g. a memmap
+        size: Output (width, height)
+        path: File to back the output with (created or overwritten)
+        box: Source region (x1, y1, x2, y2) in float pixels, default all
+
+    Returns:
+        np.memmap (height, width, 3) uint8
+    """
+    h, w = rgb.shape[:2]
+    out_w, out_h = size
+    x1, y1, x2, y2 = box if box is not None else (0, 0, w, h)
+    scale_y = (y2 - y1) / out_h
+    # LANCZOS kernel radius in source rows
+    support = 3 * max(scale_y, 1.0)
+
+    out = _uint8_memmap(path, (out_h, out_w, 3))
+    for oy in range(0, out_h, strip_rows):
+        oy2 = min(out_h, oy + strip_rows)
+        top, bottom = y1 + oy * scale_y, y1 + oy2 * scale_y
+        r1 = max(0, math.floor(top - support) - 1)
+        r2 = min(h, math.ceil(bottom + support) + 1)
+        band = Image.fromarray(np.ascontiguousarray(rgb[r1:r2]))
+        out[oy:oy2] = np.asarray(
+            band.resize((out_w, oy2 - oy), Image.LANCZOS, box=(x1, top - r1, x2, bottom - r1))
+        )
+    out.flush()
+    return out
+
+
+def uint8_array_to_pil(arr: np.ndarray) -> Image.Image:
+    """Wrap a contiguous (H, W, 3) uint8 array as a PIL Image without copying."""
+    h, w = arr.shape[:2]
+    return Image.frombuffer("RGB", (w, h), arr, "raw", "RGB", 0, 1)
+
+
 def encode_image_to_base64(image_path: str) -> str:
     """Read image file and encode to base64."""
     with open(image_path, "rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
 
+def encode_array_to_base64(arr: np.ndarray, format: str = "PNG") -> str:
+    """Encode a (H, W, C) uint8 array as an image file and base64 it."""
+    buffer = io.BytesIO()
+    Image.fromarray(arr).save(buffer, format=format)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
 def decode_base64_to_image(base64_string: str) -> Image.Image:
     """Decode base64 string to PIL Image."""
     image_data = base64.b64decode(base64_string)
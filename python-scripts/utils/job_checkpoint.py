@@ -0,0 +1,133 @@
+"""
+Tile-level checkpoints for long tiled jobs.
+
+When a worker crashes, NestJS rejects its pending jobs and resubmits them
+with the same job ID once a worker is ready again. Without checkpoints the
+resubmitted job starts over. JobCheckpoint wraps a tile runner and saves
+finished tile outputs under CHECKPOINT_DIR/{job_id}/pass{n}/. A
+resubmitted job reads those tiles back instead of running them again.
+
+The blend accumulators are not saved: they are rebuilt by blending the
+stored tiles in their original order, which yields exactly the output of
+an uninterrupted run. The stored tiles are still the job's whole float
+output (overlaps included), written on top of the final encode, so
+checkpoints only pay off for jobs long enough to be worth resuming.
+
+Checkpoints are opt-in: only jobs that set checkpoint_every > 0 are
+checkpointed, and of those only jobs with at least CHECKPOINT_MIN_TILES
+first-pass tiles (default 64); smaller ones are cheap to rerun. Tiles are
+buffered and written in batches of checkpoint_every, so a crash loses at
+most that many tiles of work. A checkpoint is only resumed for the same
+config and the same input file; it is deleted when the job completes, and
+abandoned ones are purged after CHECKPOINT_TTL_SECONDS (default 24h).
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from utils.job_context import JobContext
+from utils.tile_store import TileStore
+
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", "/app/temp/checkpoints")
+CHECKPOINT_MIN_TILES = int(os.environ.get("CHECKPOINT_MIN_TILES", 64))
+CHECKPOINT_TTL_SECONDS = float(os.environ.get("CHECKPOINT_TTL_SECONDS", 24 * 3600))
+
+# Config keys that may change on resubmission without changing the output
+# (the CPU tile pool yields in tile order, so it blends like the serial path)
+_VOLATILE_KEYS = {"priority", "timeout_seconds", "cpu_parallel"}
+
+
+def config_fingerprint(config: dict) -> str:
+    """Digest of the output-affecting config and the input file's size and mtime."""
+    h = hashlib.blake2b(digest_size=16)
+    stable = {k: v for k, v in config.items() if k not in _VOLATILE_KEYS}
+    h.update(json.dumps(stable, sort_keys=True, default=str).encode())
+    image_path = config.get("image_path")
+    if image_path and Path(image_path).exists():
+        stat = Path(image_path).stat()
+        h.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+class JobCheckpoint:
+    def __init__(self, job_id: str, config: dict, every: int = 4, root: str = None):
+        """
+        Open (or start) the checkpoint of a job. A checkpoint left by a
+        different config or input under the same job ID is discarded.
+        """
+        self.root = TileStore(root or CHECKPOINT_DIR, CHECKPOINT_TTL_SECONDS)
+        self.root.purge_stale()
+        self.dir = self.root._dir(job_id)
+        self.store = TileStore(self.dir)
+        self.every = max(1, every)
+        self.passes = 0
+        self.resumed = 0
+        self.saved = 0
+
+        manifest = self.dir / "manifest.json"
+        fingerprint = config_fingerprint(config)
+        if manifest.exists():
+            try:
+                if json.loads(manifest.read_text()).get("fingerprint") != fingerprint:
+                    self.delete()
+            except (OSError, ValueError):
+                self.delete()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        manifest.write_text(json.dumps({"job_id": job_id, "fingerprint": fingerprint}))
+
+    @classmethod
+    def from_config(cls, config: dict, ctx: JobContext = None, tiles: int = 0) -> "JobCheckpoint | None":
+        """
+        Checkpoint for a worker job of `tiles` first-pass tiles, or None
+        without a job context, unless the job sets checkpoint_every > 0, or
+        when it has fewer than CHECKPOINT_MIN_TILES.
+        """
+        every = int(config.get("checkpoint_every") or 0)
+        if ctx is None or every <= 0 or tiles < CHECKPOINT_MIN_TILES:
+            return None
+        return cls(ctx.job_id, config, every)
+
+    def runner(self, inner):
+        """
+        Wrap a tile_runner so that tiles saved by an earlier attempt are
+        read back and the rest are run by `inner` and saved. Each call is
+        one pass of the job, so the passes must run in the same order on
+        every attempt.
+
+        Tiles are yielded in the order given, stored or not, as long as
+        `inner` keeps that order, so the blend matches an uninterrupted run.
+        """
+        def run(img_tensor, tiles, origin=(0, 0), ctx: JobContext = None):
+            key = f"pass{self.passes}"
+            self.passes += 1
+            stored = {(t["i"], t["j"]) for t in tiles if self.store.has(key, t)}
+            todo = [t for t in tiles if (t["i"], t["j"]) not in stored]
+            self.resumed += len(stored)
+
+            fresh = inner(img_tensor, todo, origin, ctx) if todo else iter(())
+            pending = []
+            try:
+                for t in tiles:
+                    if (t["i"], t["j"]) in stored:
+                        yield t, self.store.get(key, t, img_tensor.device).to(img_tensor.dtype)
+                        continue
+                    done, tile_out = next(fresh)
+                    pending.append((done, tile_out.detach().to("cpu", copy=True)))
+                    if len(pending) >= self.every:
+                        self._flush(key, pending)
+                    yield done, tile_out
+            finally:
+                # Tiles finished before a cancellation or error are kept too
+                self._flush(key, pending)
+        return run
+
+    def _flush(self, key: str, pending: list):
+        for t, tile_out in pending:
+            self.store.put(key, t, tile_out)
+        self.saved += len(pending)
+        pending.clear()
+
+    def delete(self):
+        self.root.delete(self.dir.name)
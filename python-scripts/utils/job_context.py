@@ -0,0 +1,119 @@
+"""
+Cooperative cancellation and preemption for worker jobs.
+
+Upscalers call JobContext.checkpoint() at safe points: between ESRGAN
+tiles and between FLUX sampler steps. A checkpoint raises JobCancelled once
+the job has been cancelled or has run past its deadline. Otherwise it lets
+the worker run queued higher-priority jobs inline before the current job
+resumes, so an interactive job can suspend a bulk one at a tile boundary.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint when a job is cancelled or times out."""
+
+
+class JobContext:
+    """Cancellation flag, deadline and preemption hook for one job."""
+
+    def __init__(
+        self,
+        job_id: str,
+        priority: int = 0,
+        timeout_seconds: float = None,
+        on_checkpoint=None,
+    ):
+        self.job_id = job_id
+        self.priority = priority
+        self.received_at = time.time()
+        self.deadline = time.time() + timeout_seconds if timeout_seconds else None
+        self.on_checkpoint = on_checkpoint
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Request cancellation; takes effect at the job's next checkpoint."""
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled or its deadline passed."""
+        if self.deadline is not None and time.time() > self.deadline:
+            self.cancel("timeout")
+        if self._cancelled.is_set():
+            raise JobCancelled(self.reason)
+
+    def checkpoint(self):
+        """check(), then give the worker a chance to preempt this job."""
+        self.check()
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self)
+            # The job may have been cancelled while it was suspended
+            self.check()
+
+
+class JobQueue:
+    """Thread-safe queue of pending jobs, highest priority first, then FIFO."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, ctx: JobContext, job: dict):
+        with self._cond:
+            heapq.heappush(self._heap, (-ctx.priority, next(self._seq), ctx, job))
+            self._cond.notify()
+
+    def get(self):
+        """Block until a job is available; returns None once closed."""
+        with self._cond:
+            while not self._heap and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            _, _, ctx, job = heapq.heappop(self._heap)
+            return ctx, job
+
+    def pop_above(self, priority: int, blocked_methods=()):
+        """
+        Pop the next job with priority strictly above `priority`, skipping
+        jobs whose method is in blocked_methods. Returns None if there is none.
+        """
+        with self._cond:
+            for entry in sorted(self._heap):
+                _, _, ctx, job = entry
+                if ctx.priority <= priority:
+                    return None
+                if job.get("method") in blocked_methods:
+                    continue
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                return ctx, job
+            return None
+
+    def remove(self, job_id: str):
+        """Remove a queued job; returns its (ctx, job) or None if not queued."""
+        with self._cond:
+            for entry in self._heap:
+                if entry[2].job_id == job_id:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                    return entry[2], entry[3]
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,231 @@
+"""
+Memory policy for the worker process.
+
+Upscalers used to end every job with gc.collect() twice plus
+torch.cuda.empty_cache()/ipc_collect(). That costs time on every job, and
+handing cached blocks back to the driver only makes the next job allocate
+them again. MemoryPolicy tracks RSS and the CUDA allocator per job instead,
+and runs a full collection only when a threshold is crossed:
+
+- RSS grew by MEMORY_GC_RSS_MB (default 1024) since the last collection
+- the CUDA allocator reserves more than MEMORY_GC_CUDA_FRACTION (default
+  0.85) of the device
+- MEMORY_GC_EVERY_JOBS (default 25) jobs ran since the last collection
+
+Collections can still be forced, e.g. when a model is swapped out or a job
+was interrupted.
+
+A BufferPool keeps tiled upscalers' output/weight accumulators between
+jobs of similar size (up to MEMORY_BUFFER_POOL_MB, default 1024, freed on
+a full collection).
+
+Some growth is not reclaimable in-process (allocator fragmentation, native
+library caches), so recycle_reason() tells the worker when to ask NestJS
+to drain and restart it: after WORKER_RECYCLE_JOBS jobs (default 500) or
+WORKER_RECYCLE_RSS_MB of RSS growth since models loaded (default 4096).
+0 disables either.
+
+torch is only used once something else has imported it, so this module is
+safe to import before the models load.
+"""
+
+import gc
+import os
+import sys
+import threading
+
+MEMORY_GC_RSS_MB = float(os.environ.get("MEMORY_GC_RSS_MB", 1024))
+MEMORY_GC_CUDA_FRACTION = float(os.environ.get("MEMORY_GC_CUDA_FRACTION", 0.85))
+MEMORY_GC_EVERY_JOBS = int(os.environ.get("MEMORY_GC_EVERY_JOBS", 25))
+MEMORY_BUFFER_POOL_MB = float(os.environ.get("MEMORY_BUFFER_POOL_MB", 1024))
+WORKER_RECYCLE_JOBS = int(os.environ.get("WORKER_RECYCLE_JOBS", 500))
+WORKER_RECYCLE_RSS_MB = float(os.environ.get("WORKER_RECYCLE_RSS_MB", 4096))
+
+_MB = 1024 * 1024
+
+
+def _cuda():
+    """torch.cuda if torch is loaded and has a GPU, else None."""
+    torch = sys.modules.get("torch")
+    cuda = getattr(torch, "cuda", None)
+    if cuda is not None and cuda.is_available():
+        return cuda
+    return None
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB (0 if it can't be read)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / _MB
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / _MB
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def memory_usage() -> dict:
+    """Process RSS and, if torch is loaded with CUDA, allocator usage in MB."""
+    usage = {}
+    rss = rss_mb()
+    if rss:
+        usage["rss_mb"] = round(rss, 1)
+    cuda = _cuda()
+    if cuda is not None:
+        usage["gpu_allocated_mb"] = round(cuda.memory_allocated() / _MB, 1)
+        usage["gpu_reserved_mb"] = round(cuda.memory_reserved() / _MB, 1)
+    return usage
+
+
+class BufferPool:
+    """
+    Zeroed tensors carved from buffers kept between jobs. A request reuses
+    the smallest free buffer of the same device and dtype that holds it
+    without being more than twice its size.
+
+    Thread-safe: a full collection (and so clear()) can run on the
+    residency sweeper thread while a job takes buffers.
+    """
+
+    def __init__(self, max_mb: float = MEMORY_BUFFER_POOL_MB):
+        self.max_bytes = max_mb * _MB
+        self.free = []    # flat tensors, oldest first
+        self.lent = {}    # data_ptr of a lent view -> its buffer
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def take(self, shape: tuple, device, dtype):
+        import torch
+
+        numel = 1
+        for n in shape:
+            numel *= n
+        with self._lock:
+            # By index: list.remove() would compare tensors elementwise
+            fits = [
+                i for i, b in enumerate(self.free)
+                if b.device == torch.device(device) and b.dtype == dtype and numel <= b.numel() <= 2 * numel
+            ]
+            if not fits or self.max_bytes <= 0:
+                self.misses += 1
+                buffer = None
+            else:
+                buffer = self.free.pop(min(fits, key=lambda i: self.free[i].numel()))
+                self.hits += 1
+        if buffer is None:
+            return torch.zeros(shape, device=device, dtype=dtype)
+
+        # The buffer is no longer in the pool, so it is ours to zero
+        view = buffer[:numel].view(shape).zero_()
+        with self._lock:
+            self.lent[view.data_ptr()] = buffer
+        return view
+
+    def give(self, tensor):
+        """Return a tensor from take() (or any contiguous one) for reuse."""
+        with self._lock:
+            buffer = self.lent.pop(tensor.data_ptr(), None)
+            if buffer is None:
+                if not tensor.is_contiguous():
+                    return
+                buffer = tensor.view(-1)
+            self.free.append(buffer)
+            while self.free and self._nbytes() > self.max_bytes:
+                self.free.pop(0)
+
+    def _nbytes(self) -> int:
+        return sum(b.numel() * b.element_size() for b in self.free)
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._nbytes()
+
+    def clear(self):
+        """Drop the free buffers; lent ones still come back through give()."""
+        with self._lock:
+            self.free.clear()
+
+
+class MemoryPolicy:
+    def __init__(self):
+        self.buffers = BufferPool()
+        self.jobs = 0
+        self.jobs_since_collect = 0
+        self.baseline_rss = None
+        self.rss_at_collect = rss_mb()
+        self.collections = 0
+        self._rss_at_start = None
+
+    def mark_baseline(self):
+        """Call once models are loaded: recycling measures RSS growth from here."""
+        self.baseline_rss = self.rss_at_collect = rss_mb()
+
+    def job_started(self):
+        self._rss_at_start = rss_mb()
+
+    def job_finished(self, force: bool = False) -> dict:
+        """
+        Apply the collection thresholds after a job (force: collect anyway,
+        e.g. after an interrupted job); returns the job's memory stats.
+        """
+        self.jobs += 1
+        self.jobs_since_collect += 1
+        collected = self.release(force)
+        rss = rss_mb()
+        stats = {
+            **memory_usage(),
+            "rss_delta_mb": round(rss - (self._rss_at_start or rss), 1),
+            "collected": collected,
+            "jobs": self.jobs,
+        }
+        if self.baseline_rss is not None:
+            stats["rss_growth_mb"] = round(rss - self.baseline_rss, 1)
+        return stats
+
+    def _pressure(self) -> str | None:
+        if MEMORY_GC_EVERY_JOBS and self.jobs_since_collect >= MEMORY_GC_EVERY_JOBS:
+            return "jobs"
+        if MEMORY_GC_RSS_MB and rss_mb() - self.rss_at_collect >= MEMORY_GC_RSS_MB:
+            return "rss"
+        cuda = _cuda()
+        if cuda is not None:
+            total = cuda.get_device_properties(0).total_memory
+            if cuda.memory_reserved() > MEMORY_GC_CUDA_FRACTION * total:
+                return "cuda"
+        return None
+
+    def release(self, force: bool = False) -> bool:
+        """
+        Run a full collection (gc, empty_cache, ipc_collect, pooled buffers)
+        if forced or a threshold is crossed. Returns whether one ran.
+        """
+        if not force and self._pressure() is None:
+            return False
+        self.buffers.clear()
+        gc.collect()
+        cuda = _cuda()
+        if cuda is not None:
+            cuda.empty_cache()
+            cuda.ipc_collect()
+        self.jobs_since_collect = 0
+        self.rss_at_collect = rss_mb()
+        self.collections += 1
+        return True
+
+    def recycle_reason(self) -> str | None:
+        """Why this worker should be drained and restarted, or None."""
+        if WORKER_RECYCLE_JOBS and self.jobs >= WORKER_RECYCLE_JOBS:
+            return f"{self.jobs} jobs"
+        if WORKER_RECYCLE_RSS_MB and self.baseline_rss is not None:
+            growth = rss_mb() - self.baseline_rss
+            if growth >= WORKER_RECYCLE_RSS_MB:
+                return f"RSS grew {growth:.0f} MB"
+        return None
+
+
+# The worker process's policy, shared by the upscalers
+policy = MemoryPolicy()
@@ -0,0 +1,159 @@
+"""
+Safetensors model store for spandrel upscale models.
+
+Converts each .pth pickle in upscale_models/ to .safetensors once and loads
+it back through a memory map, so cold loads skip unpickling and the weight
+pages are shared by every worker process on the host. A manifest records
+hashes, sizes and architecture metadata so models can be validated without
+deserializing them.
+"""
+
+import hashlib
+import json
+import os
+import time
+import warnings
+from pathlib import Path
+
+import torch
+from safetensors.torch import load_file, save_file
+from spandrel import MAIN_REGISTRY, ImageModelDescriptor, ModelLoader
+
+MANIFEST_NAME = "manifest.json"
+SAFETENSORS_SUFFIX = ".safetensors"
+
+
+def sha256_file(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    def __init__(self, upscale_models_dir: Path):
+        self.upscale_models_dir = Path(upscale_models_dir)
+        self.manifest_path = self.upscale_models_dir / MANIFEST_NAME
+
+    def _read_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path.with_name(f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        tmp_path.replace(self.manifest_path)
+
+    def safetensors_path(self, model_name: str) -> Path:
+        return (self.upscale_models_dir / model_name).with_suffix(SAFETENSORS_SUFFIX)
+
+    def entry(self, model_name: str) -> dict | None:
+        """Manifest entry for a model, or None if it was never converted."""
+        return self._read_manifest().get(model_name)
+
+    def is_valid(self, model_name: str) -> bool:
+        """
+        Cheap validation from file metadata only: the converted file exists
+        with the recorded size and the source .pth has not changed since.
+        """
+        entry = self.entry(model_name)
+        if entry is None:
+            return False
+
+        converted = self.safetensors_path(model_name)
+        source = self.upscale_models_dir / model_name
+        if not converted.exists() or converted.stat().st_size != entry["size"]:
+            return False
+        if source.exists():
+            stat = source.stat()
+            if stat.st_size != entry["source_size"] or int(stat.st_mtime) != entry["source_mtime"]:
+                return False
+        return True
+
+    def verify(self, model_name: str) -> bool:
+        """Full validation: is_valid plus a SHA-256 check of the converted file."""
+        if not self.is_valid(model_name):
+            return False
+        return sha256_file(self.safetensors_path(model_name)) == self.entry(model_name)["sha256"]
+
+    def convert(self, model_name: str) -> dict:
+        """Convert a .pth model to safetensors and record it in the manifest."""
+        source = self.upscale_models_dir / model_name
+        if not source.exists():
+            raise FileNotFoundError(f"Model not found: {source}")
+
+        descriptor = ModelLoader().load_from_file(str(source))
+        assert isinstance(descriptor, ImageModelDescriptor), "Not an image model!"
+
+        state_dict = {
+            k: v.detach().cpu().contiguous().clone()
+            for k, v in descriptor.model.state_dict().items()
+        }
+        converted = self.safetensors_path(model_name)
+        tmp_path = converted.with_name(f"{converted.name}.{os.getpid()}.tmp")
+        save_file(state_dict, str(tmp_path), metadata={
+            "architecture": descriptor.architecture.id,
+            "scale": str(descriptor.scale),
+        })
+        tmp_path.replace(converted)
+
+        stat = source.stat()
+        entry = {
+            "file": converted.name,
+            "sha256": sha256_file(converted),
+            "size": converted.stat().st_size,
+            "source_size": stat.st_size,
+            "source_mtime": int(stat.st_mtime),
+            "architecture": descriptor.architecture.id,
+            "scale": descriptor.scale,
+            "input_channels": descriptor.input_channels,
+            "output_channels": descriptor.output_channels,
+            "tags": list(descriptor.tags),
+            "converted_at": time.time(),
+        }
+
+        manifest = self._read_manifest()
+        manifest[model_name] = entry
+        self._write_manifest(manifest)
+        return entry
+
+    def load(self, model_name: str) -> ImageModelDescriptor:
+        """
+        Load a model from its memory-mapped safetensors file, converting it
+        first if needed. Falls back to the .pth if conversion is not possible
+        (e.g. read-only model volume).
+        """
+        if not self.is_valid(model_name):
+            try:
+                self.convert(model_name)
+            except OSError:
+                return self._load_pth(model_name)
+
+        state_dict = load_file(str(self.safetensors_path(model_name)), device="cpu")
+
+        # Build the architecture on the meta device and assign the mmap-backed
+        # tensors directly, so weights are never copied into fresh storage.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with torch.device("meta"):
+                descriptor = MAIN_REGISTRY.load(state_dict)
+        descriptor.model.load_state_dict(state_dict, assign=True)
+
+        tensors = list(descriptor.model.parameters()) + list(descriptor.model.buffers())
+        if any(t.is_meta for t in tensors):
+            # Architecture has buffers that are not part of the state dict
+            descriptor = MAIN_REGISTRY.load(state_dict)
+
+        assert isinstance(descriptor, ImageModelDescriptor), "Not an image model!"
+        return descriptor
+
+    def _load_pth(self, model_name: str) -> ImageModelDescriptor:
+        descriptor = ModelLoader().load_from_file(str(self.upscale_models_dir / model_name))
+        assert isinstance(descriptor, ImageModelDescriptor), "Not an image model!"
+        return descriptor
@@ -0,0 +1,106 @@
+"""
+ONNX Runtime execution backend for spandrel upscale models.
+
+Exports a model to ONNX once (with dynamic tile height/width), caches the
+.onnx next to the source .pth, and runs tiles through ONNX Runtime's CPU
+execution provider. onnxruntime is imported lazily so workers that never
+use this backend don't pay for it.
+"""
+
+import copy
+import os
+from pathlib import Path
+from typing import Callable
+
+import torch
+from spandrel import ImageModelDescriptor
+
+ONNX_SUFFIX = ".onnx"
+ONNX_OPSET = 17
+
+
+class OnnxModel:
+    """Callable wrapper exposing the same interface the tiler expects."""
+
+    def __init__(self, session, scale: int):
+        self.session = session
+        self.scale = scale
+        self._input_name = session.get_inputs()[0].name
+
+    def __call__(self, tile: torch.Tensor) -> torch.Tensor:
+        tile_np = tile.float().cpu().contiguous().numpy()
+        out = self.session.run(None, {self._input_name: tile_np})[0]
+        return torch.from_numpy(out)
+
+
+def onnx_cache_path(model_path: Path) -> Path:
+    """Path of the cached ONNX export for a given .pth file."""
+    return model_path.with_suffix(ONNX_SUFFIX)
+
+
+def export_to_onnx(model: torch.nn.Module, scale: int, onnx_path: Path):
+    """Export a float model to ONNX with dynamic batch and spatial axes."""
+    float_model = copy.deepcopy(model).float().cpu().eval()
+    example = torch.rand(1, 3, 64, 64)
+
+    tmp_path = onnx_path.with_suffix(onnx_path.suffix + ".tmp")
+    with torch.no_grad():
+        torch.onnx.export(
+            float_model,
+            (example,),
+            str(tmp_path),
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={
+                "input": {0: "batch", 2: "height", 3: "width"},
+                "output": {0: "batch", 2: "out_height", 3: "out_width"},
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+
+    import onnx
+
+    proto = onnx.load(str(tmp_path))
+    onnx.helper.set_model_props(proto, {"scale": str(scale)})
+    onnx.save(proto, str(tmp_path))
+    tmp_path.replace(onnx_path)
+
+
+def _session_options():
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = int(
+        os.environ.get("ORT_INTRA_OP_THREADS", os.cpu_count() or 1)
+    )
+    options.inter_op_num_threads = int(os.environ.get("ORT_INTER_OP_THREADS", 1))
+    return options
+
+
+def load_or_export(
+    model_path: Path,
+    load_float_model: Callable[[], ImageModelDescriptor],
+) -> OnnxModel:
+    """
+    Open an ONNX Runtime session for model_path, exporting the .onnx first if
+    it does not exist yet or is older than the source .pth.
+
+    load_float_model is only called on a cache miss.
+    """
+    import onnxruntime as ort
+
+    onnx_path = onnx_cache_path(model_path)
+    if not onnx_path.exists() or onnx_path.stat().st_mtime < model_path.stat().st_mtime:
+        float_model = load_float_model()
+        export_to_onnx(float_model.model, float_model.scale, onnx_path)
+
+    session = ort.InferenceSession(
+        str(onnx_path),
+        sess_options=_session_options(),
+        providers=["CPUExecutionProvider"],
+    )
+    scale = int(session.get_modelmeta().custom_metadata_map["scale"])
+    return OnnxModel(session, scale)
@@ -0,0 +1,155 @@
+"""
+Message channels between NestJS and the Python worker.
+
+Two wire formats are supported:
+  - "jsonl":  one JSON object per line on stdin/stdout (the original protocol)
+  - "framed": 4-byte big-endian length prefix + UTF-8 JSON payload on a
+              dedicated file descriptor (WORKER_CHANNEL_FD, default 3), so
+              stray prints from ComfyUI/spandrel on stdout can't corrupt it
+
+NestJS offers the framed protocol by setting WORKER_PROTOCOL=framed and
+passing the extra fd. The worker announces which protocol it picked with a
+JSON line on stdout before anything else, so an older worker (or one that
+can't open the fd) keeps working in jsonl mode.
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def encode_frame(msg: dict) -> bytes:
+    """Serialize a message as a length-prefixed frame."""
+    payload = json.dumps(msg, separators=(",", ":")).encode("utf-8")
+    if len(payload) > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload)) + payload
+
+
+def parse_message(payload: bytes | str) -> dict:
+    """
+    Decode one JSON message. Malformed ones become {"type": "invalid"}
+    messages, so a single bad message never stops the reader.
+    """
+    try:
+        msg = json.loads(payload)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return {"type": "invalid", "error": f"Invalid JSON message: {e}"}
+    if not isinstance(msg, dict):
+        return {"type": "invalid", "error": f"Invalid message: expected a JSON object, got {type(msg).__name__}"}
+    return msg
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for length-prefixed frames.
+
+    A bad length prefix leaves no frame boundary to resync on: it is
+    reported as an invalid message, and `broken` is set so the caller can
+    stop reading.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.broken = False
+
+    def feed(self, data: bytes) -> list[dict]:
+        if self.broken:
+            return []
+        self._buffer.extend(data)
+        messages = []
+        while len(self._buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self._buffer)
+            if length > MAX_FRAME_BYTES:
+                self.broken = True
+                self._buffer.clear()
+                messages.append({"type": "invalid", "error": f"Frame too large: {length} bytes"})
+                break
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            messages.append(parse_message(bytes(self._buffer[HEADER.size:end])))
+            del self._buffer[:end]
+        return messages
+
+
+class JsonLineChannel:
+    """Newline-delimited JSON over stdin/stdout."""
+
+    protocol = "jsonl"
+
+    def __init__(self, reader=None, writer=None):
+        self._reader = reader or sys.stdin
+        self._writer = writer or sys.stdout
+        self._lock = threading.Lock()
+
+    def send(self, msg: dict):
+        line = json.dumps(msg)
+        with self._lock:
+            self._writer.write(line + "\n")
+            self._writer.flush()
+
+    def __iter__(self):
+        for line in self._reader:
+            line = line.strip()
+            if not line:
+                continue
+            yield parse_message(line)
+
+
+class FramedChannel:
+    """Length-prefixed JSON frames over a dedicated file descriptor."""
+
+    protocol = "framed"
+
+    def __init__(self, fd: int):
+        self._fd = fd
+        self._lock = threading.Lock()
+
+    def send(self, msg: dict):
+        data = memoryview(encode_frame(msg))
+        with self._lock:
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+
+    def __iter__(self):
+        decoder = FrameDecoder()
+        while True:
+            chunk = os.read(self._fd, READ_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield from decoder.feed(chunk)
+            if decoder.broken:
+                # End the stream, so the worker exits and is restarted
+                # instead of waiting on a channel it can't read
+                return
+
+
+def open_channel():
+    """
+    Open the channel NestJS asked for and announce the choice on stdout.
+
+    Falls back to jsonl if the framed fd is not usable.
+    """
+    channel = JsonLineChannel()
+    if os.environ.get("WORKER_PROTOCOL") == "framed":
+        fd = int(os.environ.get("WORKER_CHANNEL_FD", 3))
+        try:
+            os.fstat(fd)
+            channel = FramedChannel(fd)
+        except OSError:
+            pass
+
+    print(json.dumps({
+        "type": "status",
+        "message": "protocol",
+        "protocol": channel.protocol,
+    }), flush=True)
+    return channel
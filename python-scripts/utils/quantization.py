@@ -0,0 +1,139 @@
+"""
+Int8 quantization for spandrel upscale models on CPU.
+
+Converts a float model to a statically quantized int8 model using FX graph
+mode quantization, calibrated on a fixed synthetic tile set (see
+calibration_tiles), so the result does not depend on which job happened to
+trigger the conversion. The converted model is traced and saved next to the
+source .pth, keyed by CALIBRATION_VERSION, so worker restarts load it
+directly instead of re-quantizing.
+"""
+
+import copy
+from pathlib import Path
+from typing import Callable
+
+import torch
+from spandrel import ImageModelDescriptor
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+# Bump whenever calibration_tiles() changes, so cached models are rebuilt
+CALIBRATION_VERSION = 1
+CALIBRATION_TILE_SIZE = 128
+QUANTIZED_SUFFIX = f".int8-cal{CALIBRATION_VERSION}.pt"
+
+
+class QuantizedModel:
+    """Callable wrapper exposing the same interface the tiler expects."""
+
+    def __init__(self, module: torch.jit.ScriptModule, scale: int):
+        self.module = module
+        self.scale = scale
+
+    def __call__(self, tile: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(tile.float().cpu())
+
+
+def quantized_cache_path(model_path: Path) -> Path:
+    """Path of the cached int8 model for a given .pth file."""
+    return model_path.with_name(model_path.stem + QUANTIZED_SUFFIX)
+
+
+def calibration_tiles(tile_size: int = CALIBRATION_TILE_SIZE) -> list[torch.Tensor]:
+    """
+    Fixed calibration set: (1, 3, tile_size, tile_size) float32 tiles in
+    [0, 1] covering what upscale inputs contain (smooth gradients, flat and
+    dark areas, hard edges, fine texture and noise), generated from a fixed
+    seed so every host quantizes a model the same way.
+    """
+    generator = torch.Generator().manual_seed(0)
+    y, x = torch.meshgrid(
+        torch.linspace(0, 1, tile_size), torch.linspace(0, 1, tile_size), indexing="ij"
+    )
+    gradient = torch.stack([x, y, (x + y) / 2])
+    checker = ((x * 8).floor() + (y * 8).floor()) % 2
+    radius = ((x - 0.5) ** 2 + (y - 0.5) ** 2).sqrt()
+
+    tiles = [
+        gradient,
+        gradient + 0.05 * torch.randn(3, tile_size, tile_size, generator=generator),
+        torch.rand(3, 1, 1, generator=generator).expand(3, tile_size, tile_size),
+        (0.1 + 0.8 * checker).expand(3, tile_size, tile_size),
+        (0.5 + 0.5 * torch.sin(2 * torch.pi * 24 * (x + 0.3 * y))).expand(3, tile_size, tile_size),
+        (0.5 + 0.5 * torch.cos(2 * torch.pi * 10 * radius)) * torch.rand(3, 1, 1, generator=generator),
+        torch.rand(3, tile_size, tile_size, generator=generator),
+        0.1 + 0.05 * torch.rand(3, tile_size, tile_size, generator=generator),
+    ]
+    return [tile.clamp(0, 1).unsqueeze(0).contiguous() for tile in tiles]
+
+
+def quantize_model(
+    model: torch.nn.Module,
+    calibration_tiles: list[torch.Tensor],
+) -> torch.jit.ScriptModule:
+    """
+    Statically quantize a float model to int8 and return a frozen traced module.
+
+    Args:
+        model: Float torch module (e.g. ImageModelDescriptor.model)
+        calibration_tiles: Input tiles (1, C, H, W) float32 in [0, 1]
+
+    Returns:
+        Frozen TorchScript module taking and returning float tensors
+    """
+    if not calibration_tiles:
+        raise ValueError("At least one calibration tile is required")
+
+    engine = torch.backends.quantized.engine
+    float_model = copy.deepcopy(model).float().cpu().eval()
+    example = calibration_tiles[0]
+
+    prepared = prepare_fx(
+        float_model,
+        get_default_qconfig_mapping(engine),
+        example_inputs=(example,),
+    )
+    with torch.no_grad():
+        for tile in calibration_tiles:
+            prepared(tile)
+
+    converted = convert_fx(prepared).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(converted, example)
+    return torch.jit.freeze(traced)
+
+
+def load_or_quantize(
+    model_path: Path,
+    load_float_model: Callable[[], ImageModelDescriptor],
+) -> QuantizedModel:
+    """
+    Load the cached int8 model for model_path, quantizing and caching it first
+    if it does not exist yet, is older than the source .pth or was calibrated
+    by another CALIBRATION_VERSION.
+
+    load_float_model is only called on a cache miss.
+    """
+    cache_path = quantized_cache_path(model_path)
+    if cache_path.exists() and cache_path.stat().st_mtime >= model_path.stat().st_mtime:
+        extra_files = {"scale": "", "calibration": ""}
+        module = torch.jit.load(str(cache_path), map_location="cpu", _extra_files=extra_files)
+        calibration = extra_files["calibration"]
+        if isinstance(calibration, bytes):
+            calibration = calibration.decode()
+        if calibration == str(CALIBRATION_VERSION):
+            return QuantizedModel(module, int(extra_files["scale"]))
+
+    float_model = load_float_model()
+    module = quantize_model(float_model.model, calibration_tiles())
+
+    tmp_path = cache_path.with_suffix(cache_path.suffix + ".tmp")
+    torch.jit.save(module, str(tmp_path), _extra_files={
+        "scale": str(float_model.scale),
+        "calibration": str(CALIBRATION_VERSION),
+    })
+    tmp_path.replace(cache_path)
+
+    return QuantizedModel(module, float_model.scale)
@@ -0,0 +1,122 @@
+"""
+Retained raw outputs for deferred crop finalization.
+
+Outputs for print targets are deliberately oversized along one axis
+(crop_info), and customers often pick the crop offset later. Instead of
+re-running the job or re-decoding a huge PNG, the upscalers keep the final
+uncompressed RGB output as a raw file with a JSON sidecar. finalize_crop
+then memory-maps it and encodes only the chosen window.
+
+Retention is opt-in: a job sets retain_raw=True, or the node sets
+RETAIN_RAW_OUTPUT=true. Raw outputs expire after RAW_OUTPUT_TTL_SECONDS
+(default 24h, 0 disables retention). Expired files are purged whenever a
+new output is retained.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+RETAIN_RAW_OUTPUT = os.environ.get("RETAIN_RAW_OUTPUT", "false") == "true"
+RAW_SUFFIX = ".rgb"
+META_SUFFIX = ".json"
+
+
+class RawStore:
+    def __init__(self, root: str = None, ttl_seconds: float = None):
+        self.root = Path(root or os.environ.get("RAW_OUTPUT_DIR", "/app/temp/raw"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("RAW_OUTPUT_TTL_SECONDS", 24 * 3600))
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        if not key or "/" in key or "\\" in key or key.startswith("."):
+            raise ValueError(f"Invalid raw output key: {key!r}")
+        return self.root / f"{key}{RAW_SUFFIX}", self.root / f"{key}{META_SUFFIX}"
+
+    def save(self, key: str, rgb: np.ndarray, meta: dict) -> float:
+        """
+        Write an (H, W, 3) uint8 image and its metadata. Returns the expiry
+        time (unix seconds).
+        """
+        raw_path, meta_path = self._paths(key)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.purge_expired()
+
+        tmp_path = raw_path.with_name(raw_path.name + ".tmp")
+        out = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=rgb.shape)
+        out[:] = rgb
+        out.flush()
+        del out
+        tmp_path.replace(raw_path)
+
+        expires_at = time.time() + self.ttl_seconds
+        meta_path.write_text(json.dumps({
+            **meta,
+            "shape": list(rgb.shape),
+            "expires_at": expires_at,
+        }))
+        return expires_at
+
+    def open(self, key: str) -> tuple[np.memmap, dict]:
+        """Memory-map a retained output read-only. Raises FileNotFoundError if missing or expired."""
+        raw_path, meta_path = self._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            raise FileNotFoundError(f"No retained raw output for {key}")
+
+        if meta["expires_at"] < time.time() or not raw_path.exists():
+            self.delete(key)
+            raise FileNotFoundError(f"Retained raw output for {key} has expired")
+
+        arr = np.memmap(raw_path, dtype=np.uint8, mode="r", shape=tuple(meta["shape"]))
+        return arr, meta
+
+    def delete(self, key: str):
+        for path in self._paths(key):
+            path.unlink(missing_ok=True)
+
+    def purge_expired(self):
+        """Delete retained outputs past their TTL."""
+        if not self.root.exists():
+            return
+        now = time.time()
+        for meta_path in self.root.glob(f"*{META_SUFFIX}"):
+            try:
+                expired = json.loads(meta_path.read_text())["expires_at"] < now
+            except (OSError, json.JSONDecodeError, KeyError):
+                expired = True
+            if expired:
+                meta_path.with_suffix(RAW_SUFFIX).unlink(missing_ok=True)
+                meta_path.unlink(missing_ok=True)
+
+
+def retain_for_crop(config: dict, output_name: str, rgb: np.ndarray, crop_info: dict) -> float | None:
+    """
+    Retain an oversized output so its crop can be finalized later.
+
+    Only outputs that still need cropping are kept, and only when
+    the job enables retention (config retain_raw, default RETAIN_RAW_OUTPUT).
+    Returns the expiry time, or None if nothing was retained.
+    """
+    if not crop_info or "offset_px" in crop_info or not config.get("retain_raw", RETAIN_RAW_OUTPUT):
+        return None
+    store = RawStore()
+    if not store.enabled:
+        return None
+    try:
+        return store.save(output_name, rgb, {
+            "crop_info": crop_info,
+            "output_format": config.get("output_format", "png"),
+        })
+    except OSError:
+        # Retention is an optimization; never fail the job over it
+        return None
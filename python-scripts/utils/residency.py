@@ -0,0 +1,190 @@
+"""
+Model residency for the worker process.
+
+FLUX keeps a UNet, VAE and upscale model loaded (~12GB) once the first FLUX
+job arrives, which pins that memory even if the worker only sees ESRGAN
+jobs afterwards. A ResidencyManager tracks when each registered component
+was last used and moves idle ones down a tier:
+
+  device    on the GPU, ready to run
+  host      offloaded to CPU RAM; back on the GPU in a few seconds
+  released  dropped; reloaded from disk (GGUF/safetensors are memory-mapped,
+            so this mostly costs page-cache reads)
+
+after FLUX_OFFLOAD_SECONDS (default 300) and FLUX_RELEASE_SECONDS (default
+1800) of idleness respectively; 0 disables either step. Components are
+brought back on demand by use(), and prefetch() warms them from disk in the
+background when a job that needs them is queued, so only the GPU transfer
+is left when it starts.
+
+Components are plain callables, so stand-in modules can be registered to
+check the transitions (see the counters in state()).
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+FLUX_OFFLOAD_SECONDS = float(os.environ.get("FLUX_OFFLOAD_SECONDS", 300))
+FLUX_RELEASE_SECONDS = float(os.environ.get("FLUX_RELEASE_SECONDS", 1800))
+RESIDENCY_SWEEP_SECONDS = float(os.environ.get("RESIDENCY_SWEEP_SECONDS", 15))
+
+DEVICE, HOST, RELEASED = "device", "host", "released"
+
+
+class Component:
+    def __init__(self, name, to_device, to_host, load=None, release=None, state=HOST, clock=time.monotonic):
+        self.name = name
+        self.to_device = to_device
+        self.to_host = to_host
+        self.load = load
+        self.release = release
+        self.state = state
+        self.busy = 0
+        self.last_used = clock()
+        self.counts = {"loads": 0, "to_device": 0, "to_host": 0, "releases": 0}
+
+
+class ResidencyManager:
+    """
+    Tracks a group of components. Transitions and jobs run under one lock,
+    so a sweep never offloads or releases anything while a job uses the
+    group, and a job waits for a prefetch that is already loading its
+    component.
+    """
+
+    def __init__(
+        self,
+        offload_after: float = FLUX_OFFLOAD_SECONDS,
+        release_after: float = FLUX_RELEASE_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.offload_after = offload_after
+        self.release_after = release_after
+        self.clock = clock
+        self.components = {}
+        self._lock = threading.RLock()
+        self._sweeper = None
+
+    def register(self, name: str, to_device, to_host, load=None, release=None, state: str = HOST):
+        """
+        Add a component in the given state. to_device/to_host move it
+        between GPU and CPU; load/release (optional: without them it is
+        never released) read it from disk and drop it.
+        """
+        if state == RELEASED and load is None:
+            raise ValueError(f"{name}: a released component needs a load callable")
+        with self._lock:
+            self.components[name] = Component(name, to_device, to_host, load, release, state, self.clock)
+
+    def _warm(self, component: Component):
+        if component.state == RELEASED:
+            component.load()
+            component.state = HOST
+            component.counts["loads"] += 1
+
+    def _ensure(self, component: Component):
+        self._warm(component)
+        if component.state == HOST:
+            component.to_device()
+            component.state = DEVICE
+            component.counts["to_device"] += 1
+
+    @contextmanager
+    def use(self, *names: str):
+        """
+        Bring components to the device and keep them there until the block
+        exits. The lock is held for the whole block, so no sweep or prefetch
+        can move any component of this manager while the job runs (jobs
+        that preempt it run on the same thread and may nest use()).
+        """
+        names = names or tuple(self.components)
+        with self._lock:
+            for name in names:
+                self.components[name].busy += 1
+            try:
+                for name in names:
+                    self._ensure(self.components[name])
+                yield
+            finally:
+                now = self.clock()
+                for name in names:
+                    component = self.components[name]
+                    component.busy -= 1
+                    component.last_used = now
+
+    def prefetch(self, *names: str, background: bool = True):
+        """
+        Hint that a job will need these components soon: reload released
+        ones into host memory (GPU transfer is left to use(), so a job
+        running meanwhile keeps the device to itself).
+        """
+        def warm():
+            with self._lock:
+                now = self.clock()
+                for name in names or tuple(self.components):
+                    component = self.components[name]
+                    self._warm(component)
+                    component.last_used = max(component.last_used, now)
+
+        if not background:
+            warm()
+            return None
+        thread = threading.Thread(target=warm, daemon=True)
+        thread.start()
+        return thread
+
+    def sweep(self) -> list:
+        """Move idle components down a tier; returns the (name, state) transitions made."""
+        transitions = []
+        with self._lock:
+            now = self.clock()
+            for component in self.components.values():
+                if component.busy:
+                    continue
+                idle = now - component.last_used
+                if component.state == DEVICE and self.offload_after and idle >= self.offload_after:
+                    component.to_host()
+                    component.state = HOST
+                    component.counts["to_host"] += 1
+                    transitions.append((component.name, HOST))
+                if (
+                    component.state == HOST
+                    and component.release is not None
+                    and self.release_after
+                    and idle >= self.release_after
+                ):
+                    component.release()
+                    component.state = RELEASED
+                    component.counts["releases"] += 1
+                    transitions.append((component.name, RELEASED))
+        return transitions
+
+    def start(self, interval: float = RESIDENCY_SWEEP_SECONDS, on_transition=None):
+        """Sweep on a daemon thread every interval seconds (once per manager)."""
+        if self._sweeper is not None or not (self.offload_after or self.release_after):
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                transitions = self.sweep()
+                if transitions and on_transition is not None:
+                    on_transition(transitions)
+
+        self._sweeper = threading.Thread(target=loop, daemon=True)
+        self._sweeper.start()
+
+    def state(self) -> dict:
+        """Per-component state, idle time and transition counts (read without the lock)."""
+        now = self.clock()
+        return {
+            name: {
+                "state": c.state,
+                "busy": c.busy > 0,
+                "idle_seconds": round(now - c.last_used, 1),
+                **c.counts,
+            }
+            for name, c in list(self.components.items())
+        }
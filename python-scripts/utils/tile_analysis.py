@@ -0,0 +1,128 @@
+"""
+Content-adaptive tile skipping and tile deduplication.
+
+Large print inputs often contain flat regions (sky, studio backdrops,
+scanned margins) and repeated content (borders, solid fills, synthetic
+patterns). The model adds nothing to a flat tile that interpolation can't,
+and an identical tile always produces the same output. AdaptiveTiles wraps
+a tile runner with an analysis pass over the input tiles:
+
+- Flat tiles, whose detail score (the larger of the pixel standard
+  deviation and the mean absolute gradient, on the 0-1 scale) is below
+  flat_threshold, are upscaled with bicubic interpolation instead of the
+  model. The threshold defaults to 0 (off), as this changes the output.
+- Byte-identical tiles are hashed (BLAKE2b over the tile's pixels and
+  shape). Only the first of each group goes to the model; the others reuse
+  its output. Deduplication does not change the output and is on by default.
+
+bench.py adaptive measures the quality cost of a threshold against full
+model runs.
+"""
+
+import hashlib
+
+import torch
+import torch.nn.functional as F
+
+from utils.job_context import JobContext
+
+
+def detail_score(tile: torch.Tensor) -> float:
+    """Larger of the standard deviation and mean absolute gradient of an NCHW tile in [0, 1]."""
+    tile = tile.float()
+    std = tile.std()
+    grad = (
+        (tile[:, :, :, 1:] - tile[:, :, :, :-1]).abs().mean()
+        + (tile[:, :, 1:, :] - tile[:, :, :-1, :]).abs().mean()
+    ) / 2
+    return torch.maximum(std, grad).item()
+
+
+def tile_digest(tile: torch.Tensor) -> bytes:
+    """BLAKE2b digest of a tile's shape, dtype and pixel bytes."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{tuple(tile.shape)}{tile.dtype}".encode())
+    h.update(tile.detach().cpu().contiguous().numpy().tobytes())
+    return h.digest()
+
+
+def interpolate_tile(tile: torch.Tensor, scale: int) -> torch.Tensor:
+    """Bicubic stand-in for the model on a flat tile."""
+    out = F.interpolate(tile.float(), scale_factor=scale, mode="bicubic", align_corners=False)
+    return out.clamp_(0, 1).to(tile.dtype)
+
+
+class AdaptiveTiles:
+    def __init__(self, scale: int, flat_threshold: float = 0.0, dedup: bool = True):
+        """
+        Args:
+            scale: model scale factor, for the interpolated tiles
+            flat_threshold: detail score below which a tile is interpolated
+                (0 disables skipping)
+            dedup: reuse model output for byte-identical tiles
+        """
+        self.scale = scale
+        self.flat_threshold = flat_threshold
+        self.dedup = dedup
+        self.tiles = 0
+        self.flat = 0
+        self.duplicate = 0
+
+    @classmethod
+    def from_config(cls, config: dict, scale: int) -> "AdaptiveTiles | None":
+        """From job config flat_threshold (default 0) and dedup_tiles (default True); None if both are off."""
+        flat_threshold = float(config.get("flat_threshold", 0.0))
+        dedup = config.get("dedup_tiles", True)
+        if flat_threshold <= 0 and not dedup:
+            return None
+        return cls(scale, flat_threshold, dedup)
+
+    def runner(self, inner):
+        """
+        Wrap a tile_runner (callable(img_tensor, tiles, origin, ctx)
+        yielding (tile, output)) so that only distinct, detailed tiles reach
+        it. Yields (tile, output) for every tile; a duplicate shares its
+        group's output tensor, yielded right after it.
+        """
+        def run(img_tensor, tiles, origin=(0, 0), ctx: JobContext = None):
+            oy, ox = origin
+            flat, distinct, copies, seen = [], [], {}, {}
+
+            for t in tiles:
+                tile = img_tensor[:, :, t["y1"] - oy:t["y2"] - oy, t["x1"] - ox:t["x2"] - ox]
+                if self.flat_threshold > 0 and detail_score(tile) < self.flat_threshold:
+                    flat.append((t, tile))
+                    continue
+                if self.dedup:
+                    digest = tile_digest(tile)
+                    first = seen.get(digest)
+                    if first is not None:
+                        copies[(first["i"], first["j"])].append(t)
+                        continue
+                    seen[digest] = t
+                    copies[(t["i"], t["j"])] = []
+                distinct.append(t)
+
+            self.tiles += len(tiles)
+            self.flat += len(flat)
+            self.duplicate += len(tiles) - len(flat) - len(distinct)
+
+            for t, tile in flat:
+                yield t, interpolate_tile(tile, self.scale)
+            if distinct:
+                for t, tile_out in inner(img_tensor, distinct, origin, ctx):
+                    yield t, tile_out
+                    for copy in copies.get((t["i"], t["j"]), ()):
+                        yield copy, tile_out
+        return run
+
+    def stats(self) -> dict:
+        """Counts across every pass run so far, with skip and dedup ratios."""
+        total = max(self.tiles, 1)
+        return {
+            "tiles": self.tiles,
+            "flat": self.flat,
+            "duplicate": self.duplicate,
+            "skip_ratio": round(self.flat / total, 4),
+            "dedup_ratio": round(self.duplicate / total, 4),
+        }
@@ -0,0 +1,237 @@
+"""
+Deep-zoom tile pyramids and previews for results.
+
+Full-resolution outputs are often hundreds of megabytes, far too much to
+send to a browser just to look at them. build_pyramid() writes a DZI
+(Deep Zoom Image) pyramid of small JPEG/WebP tiles plus a preview image
+next to the saved output:
+
+    {output_dir}/{name}.dzi
+    {output_dir}/{name}_files/{level}/{col}_{row}.{format}
+    {output_dir}/{name}_preview.jpg
+
+The pyramid is built in a single streaming pass over the output rows: each
+level buffers only about one tile row and feeds 2x2-averaged rows to the
+next level down, so the output is never decoded again or copied whole.
+
+Pyramids are opt-in: a job sets pyramid=True, or the node sets
+PYRAMID_ENABLED=true. Set PYRAMID_TILE_SIZE / PYRAMID_FORMAT /
+PYRAMID_QUALITY to tune.
+"""
+
+import math
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PYRAMID_ENABLED = os.environ.get("PYRAMID_ENABLED", "false") == "true"
+PYRAMID_TILE_SIZE = int(os.environ.get("PYRAMID_TILE_SIZE", 254))
+PYRAMID_OVERLAP = 1
+PYRAMID_FORMAT = os.environ.get("PYRAMID_FORMAT", "jpg")
+PYRAMID_QUALITY = int(os.environ.get("PYRAMID_QUALITY", 85))
+PREVIEW_MAX_SIDE = 1024
+
+# Rows pulled from the source per step
+STRIP_ROWS = 256
+
+_PIL_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def _halve(rows: np.ndarray) -> np.ndarray:
+    """
+    Average 2x2 blocks of an (H, W, 3) strip with H even, or the single
+    last row of an odd-height level. The last row/column is replicated when
+    odd, as the next level is ceil(W / 2) x ceil(H / 2).
+    """
+    if rows.shape[0] == 1:
+        rows = np.concatenate([rows, rows])
+    if rows.shape[1] % 2:
+        rows = np.concatenate([rows, rows[:, -1:]], axis=1)
+    # INTER_AREA at exactly half size is a 2x2 box average
+    h, w = rows.shape[:2]
+    return cv2.resize(rows, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+
+
+class _LevelWriter:
+    """
+    Receives the rows of one pyramid level top to bottom, writes each tile
+    row as soon as its rows (plus overlap) are buffered, and forwards
+    downsampled row pairs to the next level.
+    """
+
+    def __init__(self, level: int, width: int, height: int, tiles_dir: Path,
+                 tile_size: int, overlap: int, fmt: str, quality: int,
+                 keep: bool = False, lower: "_LevelWriter" = None):
+        self.level = level
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.fmt = fmt
+        self.quality = quality
+        self.lower = lower
+        self.keep = [] if keep else None
+
+        self.dir = tiles_dir / str(level)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        self.buffer = np.empty((0, width, 3), dtype=np.uint8)
+        self.buffer_y = 0     # level row of buffer[0]
+        self.received = 0     # level rows received so far
+        self.next_row = 0     # next tile row to write
+        self.pending = None   # odd row waiting for its pair
+
+    def push(self, rows: np.ndarray):
+        if self.keep is not None:
+            self.keep.append(rows.copy())
+        self.buffer = np.concatenate([self.buffer, rows])
+        self.received += len(rows)
+        self._flush_tiles()
+        self._forward(rows)
+
+    def _flush_tiles(self):
+        ts, ov = self.tile_size, self.overlap
+        while self.next_row * ts < self.height:
+            y1 = max(0, self.next_row * ts - ov)
+            y2 = min(self.height, (self.next_row + 1) * ts + ov)
+            if self.received < y2:
+                return
+            band = self.buffer[y1 - self.buffer_y:y2 - self.buffer_y]
+            for col in range(math.ceil(self.width / ts)):
+                x1 = max(0, col * ts - ov)
+                x2 = min(self.width, (col + 1) * ts + ov)
+                self._save(band[:, x1:x2], col, self.next_row)
+            self.next_row += 1
+
+            # Drop rows no later tile row needs
+            keep_from = max(0, self.next_row * ts - ov)
+            self.buffer = self.buffer[keep_from - self.buffer_y:]
+            self.buffer_y = keep_from
+
+    def _save(self, tile: np.ndarray, col: int, row: int):
+        path = self.dir / f"{col}_{row}.{self.fmt}"
+        Image.fromarray(np.ascontiguousarray(tile)).save(
+            str(path), _PIL_FORMATS[self.fmt], quality=self.quality
+        )
+
+    def _forward(self, rows: np.ndarray):
+        if self.lower is None:
+            return
+        if self.pending is not None:
+            rows = np.concatenate([self.pending, rows])
+            self.pending = None
+        even = len(rows) - len(rows) % 2
+        if len(rows) % 2:
+            self.pending = rows[even:]
+        if even:
+            self.lower.push(_halve(rows[:even]))
+
+    def finish(self):
+        if self.lower is None:
+            return
+        if self.pending is not None:
+            self.lower.push(_halve(self.pending))
+            self.pending = None
+        self.lower.finish()
+
+
+def build_pyramid(
+    rgb: np.ndarray,
+    output_dir: str,
+    name: str,
+    tile_size: int = None,
+    fmt: str = None,
+    quality: int = None,
+    preview_max_side: int = PREVIEW_MAX_SIDE,
+) -> dict:
+    """
+    Write a DZI tile pyramid and a preview for an (H, W, 3) uint8 image.
+
+    rgb may be a memmap; it is read once, STRIP_ROWS rows at a time.
+
+    Returns:
+        dict with dzi, tiles_dir and preview (filenames relative to
+        output_dir), width, height, tile_size, overlap, format and levels
+    """
+    tile_size = tile_size or PYRAMID_TILE_SIZE
+    fmt = (fmt or PYRAMID_FORMAT).lower()
+    quality = quality or PYRAMID_QUALITY
+    if fmt not in _PIL_FORMATS:
+        raise ValueError(f"Unsupported pyramid format: {fmt} (expected jpg or webp)")
+    fmt = "jpg" if fmt == "jpeg" else fmt
+
+    output_dir = Path(output_dir)
+    tiles_dir = output_dir / f"{name}_files"
+    height, width = rgb.shape[:2]
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+
+    def level_size(level):
+        shrink = 2 ** (max_level - level)
+        return math.ceil(width / shrink), math.ceil(height / shrink)
+
+    # The smallest level at least preview_max_side wide is kept whole and
+    # shrunk for the preview
+    preview_level = min(
+        [level for level in range(max_level + 1) if max(level_size(level)) >= preview_max_side],
+        default=max_level,
+    )
+
+    # Chain of writers from level 0 (1x1) up to full resolution
+    writer = None
+    for level in range(max_level + 1):
+        writer = _LevelWriter(
+            level, *level_size(level), tiles_dir, tile_size, PYRAMID_OVERLAP, fmt, quality,
+            keep=level == preview_level, lower=writer,
+        )
+        if level == preview_level:
+            preview_writer = writer
+
+    for y in range(0, height, STRIP_ROWS):
+        writer.push(np.asarray(rgb[y:y + STRIP_ROWS]))
+    writer.finish()
+
+    preview_name = f"{name}_preview.jpg"
+    preview = Image.fromarray(np.concatenate(preview_writer.keep))
+    preview.thumbnail((preview_max_side, preview_max_side), Image.LANCZOS)
+    preview.save(str(output_dir / preview_name), "JPEG", quality=quality)
+
+    dzi_name = f"{name}.dzi"
+    (output_dir / dzi_name).write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{fmt}" Overlap="{PYRAMID_OVERLAP}" TileSize="{tile_size}">\n'
+        f'  <Size Width="{width}" Height="{height}"/>\n'
+        '</Image>\n'
+    )
+
+    return {
+        "dzi": dzi_name,
+        "tiles_dir": tiles_dir.name,
+        "preview": preview_name,
+        "preview_width": preview.width,
+        "preview_height": preview.height,
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "overlap": PYRAMID_OVERLAP,
+        "format": fmt,
+        "levels": max_level + 1,
+    }
+
+
+def build_for_output(config: dict, output_name: str, output_dir: str, rgb: np.ndarray) -> dict | None:
+    """
+    Build the preview pyramid for a job's output if the job asks for one
+    (config pyramid, default PYRAMID_ENABLED). Returns the pyramid
+    metadata, or None.
+    """
+    if not config.get("pyramid", PYRAMID_ENABLED):
+        return None
+    try:
+        return build_pyramid(rgb, output_dir, output_name)
+    except OSError:
+        # Previews are a convenience; the full output is already saved
+        return None
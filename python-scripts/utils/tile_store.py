@@ -0,0 +1,79 @@
+"""
+Tile outputs of split jobs.
+
+A split job runs one image's tiles on several workers: each shard writes
+its tile outputs here and the merge step reads them back in tile order.
+Tiles are stored raw in the model's output dtype, so the merge blends
+exactly the values a single worker would have.
+
+Shards and the merge may run on different hosts, so TILE_STORE_DIR must be
+shared storage between them (like OUTPUT_DIR). The merge deletes a split's
+tiles; those of failed or cancelled splits are purged once untouched for
+TILE_STORE_TTL_SECONDS (default 24h).
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+class TileStore:
+    def __init__(self, root: str = None, ttl_seconds: float = None):
+        self.root = Path(root or os.environ.get("TILE_STORE_DIR", "/app/temp/tiles"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("TILE_STORE_TTL_SECONDS", 24 * 3600))
+        self.ttl_seconds = ttl_seconds
+
+    def _dir(self, split_id: str) -> Path:
+        if not split_id or "/" in split_id or "\\" in split_id or split_id.startswith("."):
+            raise ValueError(f"Invalid split id: {split_id!r}")
+        return self.root / split_id
+
+    def _path(self, split_id: str, tile: dict) -> Path:
+        return self._dir(split_id) / f"{tile['i']}_{tile['j']}.npy"
+
+    def has(self, split_id: str, tile: dict) -> bool:
+        return self._path(split_id, tile).exists()
+
+    def put(self, split_id: str, tile: dict, output: torch.Tensor):
+        """Store one tile's model output (1, 3, h, w)."""
+        path = self._path(split_id, tile)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, output.detach().cpu().numpy())
+        tmp_path.replace(path)
+
+    def get(self, split_id: str, tile: dict, device: torch.device) -> torch.Tensor:
+        path = self._path(split_id, tile)
+        if not path.exists():
+            raise FileNotFoundError(f"Missing tile {tile['i']},{tile['j']} for split {split_id}")
+        return torch.from_numpy(np.load(path)).to(device)
+
+    def runner(self, split_id: str, device: torch.device, dtype: torch.dtype):
+        """A tile_runner for EsrganUpscaler._upscale_region that reads stored tiles in order."""
+        def run(img_tensor, tiles, origin, ctx=None):
+            for n, t in enumerate(tiles):
+                if ctx is not None and n:
+                    ctx.checkpoint()
+                yield t, self.get(split_id, t, device).to(dtype)
+        return run
+
+    def delete(self, split_id: str):
+        shutil.rmtree(self._dir(split_id), ignore_errors=True)
+
+    def purge_stale(self):
+        """Delete splits whose tiles have not been written to for ttl_seconds."""
+        if not self.root.exists():
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for split_dir in self.root.iterdir():
+            try:
+                if split_dir.is_dir() and split_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(split_dir, ignore_errors=True)
+            except OSError:
+                pass
@@ -0,0 +1,83 @@
+"""
+Tiled VAE encode/decode for the FLUX upscaler.
+
+UltimateSDUpscale calls vae.encode()/vae.decode() on each diffusion tile.
+TiledVAE wraps a ComfyUI VAE so those calls go through ComfyUI's tiled
+implementations (which blend overlapping tiles), keeping VAE memory bounded
+no matter how large the diffusion tiles are. The tile size can be given
+explicitly or derived from a memory budget.
+"""
+
+import os
+
+import torch
+
+# Rough peak activation memory of the FLUX VAE decoder per output pixel
+# (128-512 channel feature maps in bf16 plus temporaries). Used only to turn
+# a memory budget into a tile size, so it errs on the high side.
+VAE_BYTES_PER_PIXEL = 1536
+
+MIN_TILE_SIZE = 256
+MAX_TILE_SIZE = 2048
+TILE_MULTIPLE = 64
+
+
+def default_memory_budget_mb() -> int:
+    """Half of the free device memory, or FLUX_VAE_MEMORY_BUDGET_MB if set."""
+    if os.environ.get("FLUX_VAE_MEMORY_BUDGET_MB"):
+        return int(os.environ["FLUX_VAE_MEMORY_BUDGET_MB"])
+    if torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info()
+        return int(free_bytes / (1024 * 1024) / 2)
+    return 4096
+
+
+def max_pixels_for_budget(budget_mb: int) -> int:
+    """Largest VAE input/output area (pixels) that fits the memory budget."""
+    return int(budget_mb * 1024 * 1024 / VAE_BYTES_PER_PIXEL)
+
+
+def pick_tile_size(budget_mb: int) -> int:
+    """Square VAE tile size (pixels) for a memory budget, in multiples of 64."""
+    side = int(max_pixels_for_budget(budget_mb) ** 0.5)
+    side = side // TILE_MULTIPLE * TILE_MULTIPLE
+    return max(MIN_TILE_SIZE, min(MAX_TILE_SIZE, side))
+
+
+class TiledVAE:
+    """
+    Proxy around a ComfyUI VAE whose encode/decode are always tiled.
+
+    All other attributes are forwarded to the wrapped VAE, so it can be
+    passed anywhere ComfyUI expects a VAE.
+    """
+
+    def __init__(self, vae, tile_size: int, overlap: int = 64):
+        self._vae = vae
+        self.tile_size = tile_size
+        self.overlap = overlap
+
+    def __getattr__(self, name):
+        return getattr(self._vae, name)
+
+    @property
+    def _latent_ratio(self) -> int:
+        ratio = getattr(self._vae, "downscale_ratio", 8)
+        return ratio if isinstance(ratio, int) else 8
+
+    def decode(self, samples):
+        ratio = self._latent_ratio
+        return self._vae.decode_tiled(
+            samples,
+            tile_x=self.tile_size // ratio,
+            tile_y=self.tile_size // ratio,
+            overlap=max(1, self.overlap // ratio),
+        )
+
+    def encode(self, pixel_samples):
+        return self._vae.encode_tiled(
+            pixel_samples,
+            tile_x=self.tile_size,
+            tile_y=self.tile_size,
+            overlap=self.overlap,
+        )
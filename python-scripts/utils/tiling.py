@@ -0,0 +1,71 @@
+"""
+Tile grid planning for tiled upscaling.
+
+The grid is always laid out over the full image, so running only a subset
+of tiles (for a region of interest) gives exactly the same pixels in that
+region as running all of them.
+"""
+
+
+def tile_grid(height: int, width: int, tile_size: int, tile_overlap: int) -> list[dict]:
+    """
+    Tiles covering a height x width image with the given overlap.
+
+    Returns:
+        list of dicts with i, j (grid position), rows, cols (grid shape)
+        and y1, y2, x1, x2 (input pixel bounds, end-exclusive)
+    """
+    stride = tile_size - tile_overlap
+    rows = max(1, (height - tile_overlap) // stride + (1 if (height - tile_overlap) % stride else 0))
+    cols = max(1, (width - tile_overlap) // stride + (1 if (width - tile_overlap) % stride else 0))
+
+    tiles = []
+    for i in range(rows):
+        for j in range(cols):
+            y1 = min(i * stride, height - tile_size) if height > tile_size else 0
+            x1 = min(j * stride, width - tile_size) if width > tile_size else 0
+            tiles.append({
+                "i": i,
+                "j": j,
+                "rows": rows,
+                "cols": cols,
+                "y1": y1,
+                "y2": min(y1 + tile_size, height),
+                "x1": x1,
+                "x2": min(x1 + tile_size, width),
+            })
+    return tiles
+
+
+def tiles_in_region(tiles: list[dict], region: tuple) -> list[dict]:
+    """Tiles that intersect region (y1, y2, x1, x2), end-exclusive."""
+    ry1, ry2, rx1, rx2 = region
+    return [
+        t for t in tiles
+        if t["y1"] < ry2 and t["y2"] > ry1 and t["x1"] < rx2 and t["x2"] > rx1
+    ]
+
+
+def tiles_extent(tiles: list[dict]) -> tuple:
+    """Bounding box (y1, y2, x1, x2) of a set of tiles."""
+    return (
+        min(t["y1"] for t in tiles),
+        max(t["y2"] for t in tiles),
+        min(t["x1"] for t in tiles),
+        max(t["x2"] for t in tiles),
+    )
+
+
+def tiles_area(tiles: list[dict]) -> int:
+    return sum((t["y2"] - t["y1"]) * (t["x2"] - t["x1"]) for t in tiles)
+
+
+def shard_tiles(tiles: list[dict], shards: int, index: int) -> list[dict]:
+    """
+    Contiguous slice of tiles for shard `index` of `shards`. Slices differ
+    in length by at most one tile and together cover every tile once.
+    """
+    if not 0 <= index < shards:
+        raise ValueError(f"Shard {index} out of range for {shards} shards")
+    n = len(tiles)
+    return tiles[index * n // shards:(index + 1) * n // shards]
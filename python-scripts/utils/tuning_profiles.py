@@ -0,0 +1,128 @@
+"""
+Per-host tuning profiles for tiled upscalers.
+
+The best tile size, overlap, batch and dtype depend on the host: a 24 GB
+GPU wants far bigger tiles than an 8 GB one, and a CPU node wants different
+ones again. autotune.py measures them on the current host and saves a
+profile per model here; EsrganUpscaler and FluxUpscaler use the profile's
+values for any of those keys a job leaves out.
+
+Profiles live in one JSON file, TUNING_PROFILES_PATH (default
+{MODEL_CACHE_DIR}/tuning_profiles.json), keyed by host fingerprint and then
+model name. The fingerprint covers the accelerator (or CPU) model, its
+memory, the core count and the torch version, so a shared model volume can
+hold profiles for several kinds of host and each host only reads its own.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+import torch
+
+from utils.cpu_tile_pool import available_cores
+
+_cache = {"path": None, "mtime": None, "data": {}, "fingerprint": None}
+
+
+def profiles_path() -> Path:
+    path = os.environ.get("TUNING_PROFILES_PATH")
+    if path:
+        return Path(path)
+    return Path(os.environ.get("MODEL_CACHE_DIR", "/app/models")) / "tuning_profiles.json"
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _total_ram_gb() -> float:
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3)
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def host_info() -> dict:
+    """What the fingerprint is made of, kept in the profile file for reference."""
+    info = {
+        "cpu": _cpu_model(),
+        "cores": available_cores(),
+        "ram_gb": _total_ram_gb(),
+        "torch": ".".join(torch.__version__.split(".")[:2]),
+    }
+    if torch.cuda.is_available():
+        props = torch.cuda.get_device_properties(0)
+        info["gpu"] = props.name
+        info["gpu_memory_gb"] = round(props.total_memory / 1024 ** 3)
+    return info
+
+
+def host_fingerprint(info: dict = None) -> str:
+    """Fingerprint of host_info(); this host's is computed once per process."""
+    if info is None:
+        if _cache["fingerprint"] is None:
+            _cache["fingerprint"] = host_fingerprint(host_info())
+        return _cache["fingerprint"]
+    return hashlib.blake2b(json.dumps(info, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def _read() -> dict:
+    """The profile file, re-read only when it changes on disk."""
+    path = profiles_path()
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return {}
+    if _cache["path"] != path or _cache["mtime"] != mtime:
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        _cache.update(path=path, mtime=mtime, data=data)
+    return _cache["data"]
+
+
+def load_profile(model_name: str) -> dict | None:
+    """This host's profile for a model: {"params": {...}, ...}, or None."""
+    host = _read().get(host_fingerprint())
+    if host is None:
+        return None
+    return host.get("models", {}).get(model_name)
+
+
+def tuned_defaults(model_name: str) -> dict:
+    """Config defaults from this host's profile for a model; {} if untuned."""
+    profile = load_profile(model_name)
+    return dict(profile["params"]) if profile else {}
+
+
+def save_profile(model_name: str, engine: str, params: dict, metrics: dict) -> Path:
+    """Record a model's tuned params and the measurements behind them for this host."""
+    path = profiles_path()
+    data = dict(_read())
+    info = host_info()
+    host = data.setdefault(host_fingerprint(info), {"host": info, "models": {}})
+    host["host"] = info
+    host["models"][model_name] = {
+        "engine": engine,
+        "params": params,
+        "metrics": metrics,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(data, indent=2))
+    tmp_path.replace(path)
+    return path
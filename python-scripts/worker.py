@@ -1,41 +1,236 @@
 """
 Persistent Python Worker Process.
 
-Communicates with NestJS via stdin/stdout JSON-line protocol.
+Communicates with NestJS over a message channel (see utils/protocol.py).
 Loads ML models once at startup, processes jobs from NestJS.
 
 Protocol:
-  - Reads one JSON object per line from stdin
-  - Writes one JSON object per line to stdout
+  - First line on stdout announces the wire format:
+    {"type": "status", "message": "protocol", "protocol": "jsonl|framed"}
+  - jsonl: one JSON object per line on stdin/stdout
+  - framed: length-prefixed JSON frames on WORKER_CHANNEL_FD (stdout is logs only)
   - Status messages: {"type": "status", "message": "ready|loading_models"}
-  - Results: {"type": "result", "job_id": "...", "output_path": "...", "status": "completed", ...}
+  - Recycle request: {"type": "status", "message": "recycle", "reason": "..."}
+    once utils/memory_policy.py wants the process restarted
+  - Heartbeats: {"type": "heartbeat", "stage": "...", "job_id": "...", "rss_mb": ...,
+                 "residency": {"flux": {"unet": {"state": "device|host|released", ...}}}}
+  - Residency changes: {"type": "status", "message": "residency", "method": "flux",
+                        "transitions": [["unet", "host"], ...]} (see utils/residency.py)
+  - Jobs: {"job_id": "...", "method": "...", "config": {..., "priority": 0, "timeout_seconds": 600}}
+  - Cancel: {"type": "cancel", "job_id": "...", "reason": "..."}
+  - Results: {"type": "result", "job_id": "...", "output_path": "...", "status": "completed",
+               "timings": {"received_at": ..., "started_at": ..., "finished_at": ...}, ...}
+  - Cancelled: {"type": "result", "job_id": "...", "status": "cancelled", "reason": "cancelled|timeout"}
   - Errors: {"type": "error", "job_id": "...", "error": "...", "traceback": "..."}
+
+Jobs are read on a separate thread into a priority queue, so cancel messages
+are seen while a job runs. Running jobs stop at their next checkpoint (see
+utils/job_context.py); a higher-priority job that arrives meanwhile runs at
+that checkpoint and the suspended job resumes afterwards.
+
+With WORKER_SYNTHETIC set, no models load and every method is simulated by
+services/synthetic_upscaler.py, for load-testing the NestJS side.
 """
 
-import sys
 import os
-import json
+import threading
+import time
 import traceback
 
+from utils.job_context import JobCancelled, JobContext, JobQueue
+from utils.memory_policy import memory_usage, policy as memory_policy
+from utils.protocol import open_channel
+
 # Ensure unbuffered output
 os.environ["PYTHONUNBUFFERED"] = "1"
 
+HEARTBEAT_INTERVAL = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", 5))
+
+# Methods that must not be started while another job of the same method is
+# suspended further up the stack (ComfyUI's sampler is not re-entrant)
+NON_REENTRANT_METHODS = {"flux"}
+
+channel = None
+state = {"stage": "starting", "job_id": None, "job_started": None}
+started_at = time.time()
+
+jobs = JobQueue()
+contexts = {}  # job_id -> JobContext for queued, running and suspended jobs
+running_methods = []  # methods of the running job and any jobs it preempted
+upscalers = {}  # method -> callable(config, ctx), filled in once models load
+resident = {}  # method -> ResidencyManager of its loaded models
+
 
 def send_message(msg: dict):
-    """Send a JSON message to stdout (NestJS)."""
-    print(json.dumps(msg), flush=True)
+    """Send a message to NestJS over the negotiated channel."""
+    channel.send(msg)
 
 
-def main():
-    send_message({"type": "status", "message": "loading_models"})
+def set_stage(stage: str, job_id: str = None):
+    state["stage"] = stage
+    state["job_id"] = job_id
+    state["job_started"] = time.time() if job_id else None
+
+
+def heartbeat_loop():
+    """Periodically report liveness, current stage and memory usage."""
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        job_started = state["job_started"]
+        send_message({
+            "type": "heartbeat",
+            "stage": state["stage"],
+            "job_id": state["job_id"],
+            "job_elapsed": round(time.time() - job_started, 1) if job_started else None,
+            "uptime": round(time.time() - started_at, 1),
+            "jobs_run": memory_policy.jobs,
+            "residency": {method: manager.state() for method, manager in list(resident.items())},
+            **memory_usage(),
+        })
+
+
+def cancel_job(job_id: str, reason: str = "cancelled"):
+    """Cancel a queued job immediately, or flag a running one for its next checkpoint."""
+    ctx = contexts.get(job_id)
+    if ctx is None:
+        return
+    ctx.cancel(reason)
+    if jobs.remove(job_id) is not None:
+        contexts.pop(job_id, None)
+        send_message({"type": "result", "job_id": job_id, "status": "cancelled", "reason": reason})
+
+
+def reader_loop():
+    """Read messages from NestJS: queue jobs, apply cancellations."""
+    for msg in channel:
+        if msg.get("type") == "invalid":
+            send_message({"type": "error", "job_id": "unknown", "error": msg["error"], "traceback": ""})
+            continue
+
+        if msg.get("type") == "cancel":
+            cancel_job(msg.get("job_id"), msg.get("reason", "cancelled"))
+            continue
+
+        config = msg.get("config") or {}
+        ctx = JobContext(
+            msg.get("job_id", "unknown"),
+            priority=int(config.get("priority") or 0),
+            timeout_seconds=config.get("timeout_seconds"),
+            on_checkpoint=preempt,
+        )
+        contexts[ctx.job_id] = ctx
+        jobs.put(ctx, msg)
+        prefetch(msg.get("method"))
+
+    jobs.close()
+
+
+def prefetch(method: str):
+    """
+    A job was queued behind the running one: start reloading any models its
+    method has released, so it only waits for the GPU transfer.
+    """
+    manager = resident.get(method)
+    if manager is not None and state["job_id"] is not None:
+        manager.prefetch()
+
+
+def preempt(ctx: JobContext):
+    """Checkpoint hook: run queued jobs that outrank the current one."""
+    blocked = NON_REENTRANT_METHODS.intersection(running_methods)
+    while (entry := jobs.pop_above(ctx.priority, blocked)) is not None:
+        send_message({
+            "type": "status",
+            "message": "preempted",
+            "job_id": ctx.job_id,
+            "by": entry[0].job_id,
+        })
+        run_job(*entry)
+
+
+def run_job(ctx: JobContext, job: dict):
+    """Run one job and report its result, cancellation or error."""
+    previous_state = dict(state)
+    interrupted = False
+    running_methods.append(job.get("method"))
+    memory_policy.job_started()
+    started_at = time.time()
 
+    try:
+        method = job["method"]
+        config = job["config"]
+        job_id = job["job_id"]
+
+        set_stage(method, job_id)
+        ctx.check()
+
+        if method not in upscalers:
+            raise ValueError(f"Unknown method: {method}")
+        result = upscalers[method](config, ctx)
+        memory = memory_policy.job_finished()
+
+        # Upscalers may report extra fields (e.g. compute_skipped); pass them through
+        send_message({
+            **result,
+            "type": "result",
+            "job_id": job_id,
+            "output_paths": result.get("output_paths", []),
+            "status": "completed",
+            "memory": memory,
+            # Epoch seconds: read off the channel, started, finished
+            "timings": {
+                "received_at": ctx.received_at,
+                "started_at": started_at,
+                "finished_at": time.time(),
+            },
+        })
+
+    except JobCancelled as e:
+        interrupted = True
+        send_message({
+            "type": "result",
+            "job_id": ctx.job_id,
+            "status": "cancelled",
+            "reason": str(e),
+        })
+    except Exception as e:
+        interrupted = True
+        send_message({
+            "type": "error",
+            "job_id": job.get("job_id", "unknown"),
+            "error": str(e),
+            "traceback": traceback.format_exc(),
+        })
+    finally:
+        contexts.pop(ctx.job_id, None)
+        running_methods.pop()
+        state.update(previous_state)
+
+    if interrupted:
+        # Free tensors left behind by the interrupted job
+        memory_policy.job_finished(force=True)
+
+
+def load_synthetic(settings: dict):
+    """Simulated upscalers for every method (WORKER_SYNTHETIC)."""
+    from services.synthetic_upscaler import SyntheticUpscaler
+
+    for method, method_settings in settings.items():
+        upscalers[method] = SyntheticUpscaler(method, method_settings).upscale
+    send_message({"type": "warning", "message": "Synthetic mode: jobs are simulated, no models loaded"})
+
+
+def load_upscalers():
+    """Import the services and pre-load what is cheap to keep resident."""
     # Import services (adds ComfyUI to path internally)
+    from services.crop_finalizer import CropFinalizer
     from services.esrgan_upscaler import EsrganUpscaler
     from services.imagen_upscaler import ImagenUpscaler
 
     # Initialize upscalers
     esrgan = EsrganUpscaler()
     imagen = ImagenUpscaler()
+    finalizer = CropFinalizer()
 
     # FLUX is heavy (~12GB VRAM) — lazy load only when first requested
     flux = None
@@ -49,6 +244,13 @@ def main():
             flux = FluxUpscaler()
             flux.load_models()
             flux_loaded = True
+            resident["flux"] = flux.residency
+            flux.residency.start(on_transition=lambda transitions: send_message({
+                "type": "status",
+                "message": "residency",
+                "method": "flux",
+                "transitions": transitions,
+            }))
             send_message({"type": "status", "message": "flux_models_loaded"})
         return flux
 
@@ -61,50 +263,48 @@ def main():
             "message": f"Could not pre-load ESRGAN model: {e}"
         })
 
-    send_message({"type": "status", "message": "ready"})
+    upscalers.update({
+        "esrgan": lambda config, ctx: esrgan.upscale(config, ctx),
+        "flux": lambda config, ctx: get_flux().upscale(config, ctx),
+        "imagen": lambda config, ctx: imagen.upscale(config, ctx),
+        # Crops a retained raw output; never loads a model
+        "finalize_crop": lambda config, ctx: finalizer.finalize(config),
+    })
 
-    # Process jobs from stdin
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
 
-        job = {}
-        try:
-            job = json.loads(line)
-            method = job["method"]
-            config = job["config"]
-            job_id = job["job_id"]
-
-            if method == "esrgan":
-                result = esrgan.upscale(config)
-            elif method == "flux":
-                flux_instance = get_flux()
-                result = flux_instance.upscale(config)
-            elif method == "imagen":
-                result = imagen.upscale(config)
-            else:
-                raise ValueError(f"Unknown method: {method}")
-
-            send_message({
-                "type": "result",
-                "job_id": job_id,
-                "output_path": result.get("output_path"),
-                "output_paths": result.get("output_paths", []),
-                "output_width": result.get("output_width"),
-                "output_height": result.get("output_height"),
-                "crop_info": result.get("crop_info"),
-                "processing_time": result.get("processing_time"),
-                "status": "completed",
-            })
-
-        except Exception as e:
-            send_message({
-                "type": "error",
-                "job_id": job.get("job_id", "unknown"),
-                "error": str(e),
-                "traceback": traceback.format_exc(),
-            })
+def main():
+    global channel
+    channel = open_channel()
+
+    threading.Thread(target=heartbeat_loop, daemon=True).start()
+
+    set_stage("loading_models")
+    send_message({"type": "status", "message": "loading_models"})
+
+    from services.synthetic_upscaler import synthetic_settings
+
+    synthetic = synthetic_settings()
+    if synthetic is not None:
+        load_synthetic(synthetic)
+    else:
+        load_upscalers()
+
+    threading.Thread(target=reader_loop, daemon=True).start()
+
+    memory_policy.mark_baseline()
+    set_stage("idle")
+    send_message({"type": "status", "message": "ready"})
+
+    # Process jobs from NestJS, highest priority first. Once the memory
+    # policy says so, ask NestJS to drain this worker and start a fresh one;
+    # jobs keep running until it stops sending them
+    recycle_requested = False
+    while (entry := jobs.get()) is not None:
+        run_job(*entry)
+        reason = memory_policy.recycle_reason()
+        if reason and not recycle_requested:
+            recycle_requested = True
+            send_message({"type": "status", "message": "recycle", "reason": reason, **memory_usage()})
 
 
 if __name__ == "__main__":
@@ -5,7 +5,7 @@ Model Downloader for Upscaler API.
 Downloads all required AI models from HuggingFace Hub.
 Run this once before starting the container, or let the entrypoint handle it.
 
-Models downloaded (~18GB total):
+Models downloaded (~18GB total, listed in models-manifest.json):
   - FLUX UNet GGUF: flux1-dev-Q8_0.gguf (~12GB)
   - FLUX VAE: ae.sft (~335MB)
   - FLUX CLIP: clip_l.safetensors (~246MB)
@@ -13,84 +13,381 @@ Models downloaded (~18GB total):
   - Upscale: 4x-UltraSharp.pth (~67MB)
   - Upscale: 4x_foolhardy_Remacri.pth (~67MB)
   - Upscale: 4x-AnimeSharp.pth (~67MB)
+
+Files are fetched concurrently into <name>.part and resumed with HTTP Range
+requests if interrupted. Each file is verified against the size and SHA-256
+pinned in the manifest and only then renamed into place. Entries without a
+pinned SHA-256 are refused unless --allow-unverified is given; then they are
+checked against the values the hub reports for the LFS object, or installed
+unverified if the hub reports none. --pin writes the values of every
+verified file back into the manifest, so `--allow-unverified --pin` on a
+trusted network pins the hub's hashes.
+
+A <name>.sha256 sidecar records a verified file, so later runs skip it
+without re-hashing or asking the hub.
+
+Usage:
+  python download-models.py [--jobs 4] [--endpoint http://localhost:8080]
+  python download-models.py --allow-unverified --pin    # then commit models-manifest.json
 """
 
+import argparse
+import hashlib
+import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-try:
-    from huggingface_hub import hf_hub_download
-except ImportError:
-    print("Installing huggingface_hub...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "huggingface_hub"])
-    from huggingface_hub import hf_hub_download
+import requests
+
+DEFAULT_ENDPOINT = "https://huggingface.co"
+MANIFEST_PATH = Path(__file__).resolve().parent / "models-manifest.json"
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTEMPTS = 5
+
+
+class Progress:
+    """Aggregate byte counter shared by all download threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.started = time.time()
+
+    def add(self, n: int):
+        with self._lock:
+            self.bytes_downloaded += n
+
+    def throughput_mb(self) -> float:
+        elapsed = max(time.time() - self.started, 1e-6)
+        return self.bytes_downloaded / (1024 * 1024) / elapsed
+
+
+_print_lock = threading.Lock()
+
+
+def log(message: str):
+    """Print a whole line at once so concurrent downloads don't interleave."""
+    with _print_lock:
+        sys.stdout.write(message + "\n")
+        sys.stdout.flush()
+
+
+def _hf_headers() -> dict:
+    token = os.environ.get("HF_TOKEN")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def _file_url(endpoint: str, model: dict) -> str:
+    path = f"{model['subfolder']}/{model['filename']}" if model.get("subfolder") else model["filename"]
+    revision = model.get("revision", "main")
+    return f"{endpoint.rstrip('/')}/{model['repo_id']}/resolve/{revision}/{path}"
 
 
-def download_model(repo_id: str, filename: str, dest_dir: Path, subfolder: str = None):
-    """Download a model file from HuggingFace Hub if not already present."""
+def _sha256_of(path: Path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest
+
+
+def resolve_expected(url: str, model: dict) -> tuple[int | None, str | None]:
+    """
+    Expected size and SHA-256 for a file: pinned values from the manifest,
+    otherwise the LFS metadata the hub returns on the (unfollowed) redirect.
+    Either may still be None if neither source has it.
+    """
+    size, sha256 = model.get("size"), model.get("sha256")
+    if size is not None and sha256 is not None:
+        return size, sha256
+
+    response = requests.head(url, headers=_hf_headers(), allow_redirects=False, timeout=30)
+    if response.status_code >= 400:
+        response.raise_for_status()
+
+    linked_size = response.headers.get("X-Linked-Size") or response.headers.get("Content-Length")
+    etag = (response.headers.get("X-Linked-Etag") or response.headers.get("ETag") or "").strip('"')
+    if etag.startswith("W/"):
+        etag = ""
+
+    if size is None and linked_size:
+        size = int(linked_size)
+    if sha256 is None and len(etag) == 64:
+        sha256 = etag.lower()
+    return size, sha256
+
+
+def _sidecar_path(dest_path: Path) -> Path:
+    return dest_path.with_name(dest_path.name + ".sha256")
+
+
+def _is_verified(dest_path: Path, size: int | None, sha256: str | None, trusted_only: bool = False) -> bool:
+    """
+    True if dest_path exists and matches a previous verification. With
+    trusted_only, that verification must have been against a known SHA-256
+    (not an --allow-unverified download).
+    """
+    if not dest_path.exists():
+        return False
+    stat = dest_path.stat()
+    if size is not None and stat.st_size != size:
+        return False
+
+    sidecar = _sidecar_path(dest_path)
+    if not sidecar.exists():
+        return False
+    try:
+        record = json.loads(sidecar.read_text())
+    except (OSError, json.JSONDecodeError):
+        return False
+
+    if trusted_only and record.get("source") not in ("manifest", "hub"):
+        return False
+    return (
+        record.get("size") == stat.st_size
+        and record.get("mtime") == int(stat.st_mtime)
+        and (sha256 is None or record.get("sha256") == sha256)
+    )
+
+
+def _write_sidecar(dest_path: Path, sha256: str, source: str):
+    """source: what the hash was checked against, "manifest", "hub" or "unverified"."""
+    stat = dest_path.stat()
+    _sidecar_path(dest_path).write_text(json.dumps({
+        "sha256": sha256,
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "source": source,
+    }))
+
+
+def _read_sidecar(dest_path: Path) -> dict:
+    return json.loads(_sidecar_path(dest_path).read_text())
+
+
+def _fetch(url: str, part_path: Path, size: int | None, progress: Progress):
+    """
+    Download url into part_path, resuming from its current length.
+
+    Returns the running SHA-256 digest of the complete part file.
+    """
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if size is not None and offset > size:
+        part_path.unlink()
+        offset = 0
+
+    digest = _sha256_of(part_path) if offset else hashlib.sha256()
+    if size is not None and offset == size:
+        return digest
+
+    headers = _hf_headers()
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:
+            return digest
+        response.raise_for_status()
+
+        mode = "ab"
+        if offset and response.status_code != 206:
+            # Server ignored the Range header; start over
+            mode, digest = "wb", hashlib.sha256()
+
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                progress.add(len(chunk))
+
+    return digest
+
+
+def download_model(
+    model: dict,
+    models_dir: Path,
+    endpoint: str,
+    progress: Progress,
+    allow_unverified: bool = False,
+) -> bool:
+    """Download, verify and atomically install one manifest entry."""
+    filename = model["filename"]
+    dest_dir = models_dir / model["dest"]
     dest_path = dest_dir / filename
-    if dest_path.exists():
-        size_mb = dest_path.stat().st_size / (1024 * 1024)
-        print(f"  [SKIP] {filename} already exists ({size_mb:.1f} MB)")
-        return True
+    part_path = dest_dir / f"{filename}.part"
+    url = _file_url(endpoint, model)
 
     try:
-        hf_filename = f"{subfolder}/{filename}" if subfolder else filename
-        print(f"  [DOWNLOADING] {filename}...", flush=True)
-        hf_hub_download(
-            repo_id=repo_id,
-            filename=hf_filename,
-            local_dir=str(dest_dir),
-            local_dir_use_symlinks=False,
-        )
-
-        # If downloaded to subfolder, move to dest_dir root
-        if subfolder:
-            src = dest_dir / subfolder / filename
-            if src.exists():
-                src.rename(dest_path)
-                try:
-                    (dest_dir / subfolder).rmdir()
-                except OSError:
-                    pass
-
-        size_mb = dest_path.stat().st_size / (1024 * 1024)
-        print(f"  [OK] {filename} ({size_mb:.1f} MB)")
+        if model.get("sha256") is None and not allow_unverified:
+            raise ValueError(
+                "no sha256 pinned in the manifest; pin it (--allow-unverified --pin) "
+                "or pass --allow-unverified"
+            )
+
+        # Verified by an earlier run: no need to ask the hub
+        if _is_verified(dest_path, model.get("size"), model.get("sha256"), trusted_only=True):
+            size_mb = dest_path.stat().st_size / (1024 * 1024)
+            log(f"  [SKIP] {filename} already verified ({size_mb:.1f} MB)")
+            return True
+
+        size, sha256 = resolve_expected(url, model)
+        if model.get("sha256") is not None:
+            source = "manifest"
+        elif sha256 is not None:
+            source = "hub"
+            log(f"  [WARN] {filename}: no sha256 pinned in the manifest, checking against the hub's (--allow-unverified)")
+        else:
+            source = "unverified"
+            log(f"  [WARN] {filename}: NO SHA-256 AVAILABLE, installing UNVERIFIED (--allow-unverified)")
+
+        if _is_verified(dest_path, size, sha256, trusted_only=not allow_unverified):
+            size_mb = dest_path.stat().st_size / (1024 * 1024)
+            log(f"  [SKIP] {filename} already verified ({size_mb:.1f} MB)")
+            return True
+
+        if dest_path.exists():
+            # Unverified leftover (e.g. from the old downloader): check it in place
+            actual = _sha256_of(dest_path).hexdigest()
+            if (size is None or dest_path.stat().st_size == size) and (sha256 is None or actual == sha256):
+                _write_sidecar(dest_path, actual, source)
+                log(f"  [OK] {filename} verified existing file")
+                return True
+            log(f"  [CORRUPT] {filename} does not match manifest, re-downloading")
+            dest_path.unlink()
+
+        log(f"  [DOWNLOADING] {filename}...")
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                digest = _fetch(url, part_path, size, progress)
+                actual_size = part_path.stat().st_size
+                if size is not None and actual_size < size:
+                    raise requests.ConnectionError(f"transfer ended at {actual_size}/{size} bytes")
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                log(f"  [RETRY {attempt}] {filename}: {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+        actual_sha256 = digest.hexdigest()
+        if size is not None and actual_size != size:
+            part_path.unlink()
+            raise ValueError(f"size mismatch: expected {size}, got {actual_size}")
+        if sha256 is not None and actual_sha256 != sha256:
+            part_path.unlink()
+            raise ValueError(f"sha256 mismatch: expected {sha256}, got {actual_sha256}")
+
+        part_path.replace(dest_path)
+        _write_sidecar(dest_path, actual_sha256, source)
+
+        size_mb = actual_size / (1024 * 1024)
+        log(f"  [OK] {filename} ({size_mb:.1f} MB, sha256 checked against {source})")
         return True
     except Exception as e:
-        print(f"  [FAIL] {filename}: {e}")
+        log(f"  [FAIL] {filename}: {e}")
         return False
 
 
+def pin_manifest(manifest_path: Path, models: list[dict], models_dir: Path) -> int:
+    """Write the size and SHA-256 of every verified file into the manifest."""
+    pinned = 0
+    for model in models:
+        dest_path = models_dir / model["dest"] / model["filename"]
+        if not _is_verified(dest_path, model.get("size"), model.get("sha256"), trusted_only=True):
+            continue
+        record = _read_sidecar(dest_path)
+        if (model.get("size"), model.get("sha256")) != (record["size"], record["sha256"]):
+            model["size"], model["sha256"] = record["size"], record["sha256"]
+            pinned += 1
+    manifest_path.write_text(json.dumps({"models": models}, indent=2) + "\n")
+    return pinned
+
+
+def convert_upscale_models(upscale_dir: Path, filenames: list[str]):
+    """Convert downloaded .pth upscale models to memory-mappable safetensors."""
+    scripts_dir = Path(__file__).resolve().parent.parent / "python-scripts"
+    sys.path.insert(0, str(scripts_dir))
+    try:
+        from utils.model_store import ModelStore
+    except ImportError as e:
+        print(f"  [SKIP] safetensors conversion unavailable: {e}")
+        return
+
+    store = ModelStore(upscale_dir)
+    for filename in filenames:
+        if not (upscale_dir / filename).exists():
+            continue
+        if store.is_valid(filename):
+            print(f"  [SKIP] {filename} already converted")
+            continue
+        try:
+            entry = store.convert(filename)
+            print(f"  [OK] {filename} -> {entry['file']} ({entry['architecture']}, x{entry['scale']})")
+        except Exception as e:
+            print(f"  [FAIL] {filename}: {e}")
+
+
+def _report_progress(progress: Progress, done: threading.Event, interval: float = 5.0):
+    while not done.wait(interval):
+        mb = progress.bytes_downloaded / (1024 * 1024)
+        log(f"  ... {mb:.0f} MB downloaded, {progress.throughput_mb():.1f} MB/s")
+
+
 def main():
-    models_dir = Path(os.environ.get("MODEL_CACHE_DIR", "/app/models"))
+    parser = argparse.ArgumentParser(description="Download upscaler models")
+    parser.add_argument("--models-dir", default=os.environ.get("MODEL_CACHE_DIR", "/app/models"))
+    parser.add_argument("--manifest", default=str(MANIFEST_PATH))
+    parser.add_argument("--endpoint", default=os.environ.get("HF_ENDPOINT", DEFAULT_ENDPOINT))
+    parser.add_argument("--jobs", type=int, default=int(os.environ.get("DOWNLOAD_JOBS", 4)))
+    parser.add_argument("--allow-unverified", action="store_true",
+                        default=os.environ.get("DOWNLOAD_ALLOW_UNVERIFIED", "").lower() in ("1", "true"),
+                        help="Install entries without a pinned sha256 (checked against the hub's when it reports one)")
+    parser.add_argument("--pin", action="store_true",
+                        help="Write verified sizes and sha256s into the manifest")
+    args = parser.parse_args()
+
+    models_dir = Path(args.models_dir)
+    models = json.loads(Path(args.manifest).read_text())["models"]
 
-    upscale_dir = models_dir / "upscale_models"
-    unet_dir = models_dir / "unet"
-    vae_dir = models_dir / "vae"
-    clip_dir = models_dir / "clip"
+    unpinned = [m["filename"] for m in models if m.get("sha256") is None]
+    if unpinned and not args.allow_unverified:
+        print(f"ERROR: {len(unpinned)} manifest entries have no pinned sha256 and will be refused: {', '.join(unpinned)}")
+        print("       Pin them (--allow-unverified --pin, then commit the manifest) or pass --allow-unverified.")
+    elif unpinned:
+        print(f"WARNING: {len(unpinned)} manifest entries have no pinned sha256: {', '.join(unpinned)}")
+        print("         They are checked against the hub's hashes (--allow-unverified).")
 
-    for d in [upscale_dir, unet_dir, vae_dir, clip_dir]:
-        d.mkdir(parents=True, exist_ok=True)
+    for dest in {m["dest"] for m in models}:
+        (models_dir / dest).mkdir(parents=True, exist_ok=True)
 
-    results = []
+    print(f"\n=== Downloading {len(models)} models ({args.jobs} parallel) ===")
+    progress = Progress()
+    done = threading.Event()
+    reporter = threading.Thread(target=_report_progress, args=(progress, done), daemon=True)
+    reporter.start()
 
-    print("\n=== Downloading Upscale Models (~200MB) ===")
-    results.append(download_model("Isi99999/Upscalers", "4x-UltraSharp.pth", upscale_dir))
-    results.append(download_model("Isi99999/Upscalers", "4x_foolhardy_Remacri.pth", upscale_dir))
-    results.append(download_model("Isi99999/Upscalers", "4x-AnimeSharp.pth", upscale_dir))
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(
+            lambda m: download_model(m, models_dir, args.endpoint, progress, args.allow_unverified),
+            models,
+        ))
+    done.set()
 
-    print("\n=== Downloading FLUX UNet GGUF (~12GB) ===")
-    results.append(download_model("city96/FLUX.1-dev-gguf", "flux1-dev-Q8_0.gguf", unet_dir))
+    elapsed = time.time() - progress.started
+    mb = progress.bytes_downloaded / (1024 * 1024)
+    print(f"\nTransferred {mb:.1f} MB in {elapsed:.1f}s ({progress.throughput_mb():.1f} MB/s)")
 
-    print("\n=== Downloading FLUX VAE (~335MB) ===")
-    results.append(download_model("Isi99999/Upscalers", "ae.sft", vae_dir, subfolder="Flux"))
+    if args.pin:
+        pinned = pin_manifest(Path(args.manifest), models, models_dir)
+        print(f"Pinned {pinned} manifest entries in {args.manifest}")
 
-    print("\n=== Downloading FLUX CLIP Models (~5GB) ===")
-    results.append(download_model("Isi99999/Upscalers", "clip_l.safetensors", clip_dir, subfolder="Flux"))
-    results.append(download_model("Isi99999/Upscalers", "t5xxl_fp8_e4m3fn.safetensors", clip_dir, subfolder="Flux"))
+    upscale_models = [m["filename"] for m in models if m["dest"] == "upscale_models"]
+    print("\n=== Converting Upscale Models to safetensors ===")
+    convert_upscale_models(models_dir / "upscale_models", upscale_models)
 
     success = sum(results)
     total = len(results)
@@ -10,13 +10,16 @@ echo "============================================"
 # Check if essential models exist (at minimum, one upscale model for ESRGAN)
 UPSCALE_MODEL="$MODEL_DIR/upscale_models/4x-UltraSharp.pth"
 
-if [ ! -f "$UPSCALE_MODEL" ]; then
+if [ ! -f "$UPSCALE_MODEL" ] || [ ! -f "$UPSCALE_MODEL.sha256" ]; then
     echo ""
-    echo "Models not found at $MODEL_DIR"
+    echo "Models missing or unverified at $MODEL_DIR"
     echo "Downloading models from HuggingFace (~18GB)..."
-    echo "This only happens on first run."
+    echo "This only happens on first run; verified files are skipped."
     echo ""
-    python3 /app/scripts/download-models.py
+    if ! python3 /app/scripts/download-models.py; then
+        echo "WARNING: Some models failed to download or verify."
+        echo "         Entries without a pinned sha256 need DOWNLOAD_ALLOW_UNVERIFIED=true."
+    fi
     echo ""
 fi
 
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Load generator for the Upscaler API.
+
+Submits jobs over the HTTP API, polls each one to completion and reports
+throughput and latency percentiles per method. Run it against a server
+whose workers are synthetic (WORKER_SYNTHETIC, see
+python-scripts/services/synthetic_upscaler.py) to measure the overhead of
+UpscalerService, BullMQ, UpscalerProcessor and PythonExecutorService
+without models, in LOCAL_MODE or with a local Redis.
+
+Latencies come from the timestamps in each job's status:
+  queue wait   created_at -> started_at (BullMQ queue; ~0 in LOCAL_MODE)
+  dispatch     started_at -> worker_started_at (executor, channel and the
+               worker's own priority queue)
+  service      worker_started_at -> worker_finished_at
+  return       worker_finished_at -> finished_at (result back to NestJS)
+  end to end   created_at -> finished_at, and submit -> done as seen by
+               this client (which includes the --poll interval)
+
+Usage:
+  WORKER_SYNTHETIC=true LOCAL_MODE=true npm run start:dev
+  python load-test.py --jobs 200 --rate 20 --mix esrgan=9,flux=1
+  python load-test.py --jobs 100 --concurrency 8 --field priority=5 --output report.json
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "not_found"}
+
+STAGES = {
+    "queue_wait": ("created_at", "started_at"),
+    "dispatch": ("started_at", "worker_started_at"),
+    "service": ("worker_started_at", "worker_finished_at"),
+    "return": ("worker_finished_at", "finished_at"),
+    "end_to_end": ("created_at", "finished_at"),
+}
+
+
+def parse_mix(value: str) -> list:
+    """"esrgan=9,flux=1" -> [("esrgan", 9.0), ("flux", 1.0)]"""
+    mix = []
+    for part in value.split(","):
+        method, _, weight = part.partition("=")
+        mix.append((method.strip(), float(weight or 1)))
+    return mix
+
+
+def test_image(path: str = None, size: int = 256) -> bytes:
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (90, 140, 200)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def percentile(values: list, q: float) -> float | None:
+    """Nearest-rank percentile of values (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.image = test_image(args.image, args.image_size)
+        self.fields = dict(f.split("=", 1) for f in args.field)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(args.concurrency or 0, args.max_in_flight))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.records = []
+        self._lock = threading.Lock()
+
+    def run_job(self, method: str) -> dict:
+        """Submit one job and poll it until it finishes."""
+        url = self.args.url.rstrip("/")
+        record = {"method": method, "submitted_at": time.time()}
+        try:
+            response = self.session.post(
+                f"{url}/api/upscale/{method}",
+                files={"file": ("load-test.png", self.image, "image/png")},
+                data=self.fields,
+                timeout=60,
+            )
+            response.raise_for_status()
+            job_id = response.json()["jobId"]
+            record["submit_seconds"] = time.time() - record["submitted_at"]
+
+            deadline = record["submitted_at"] + self.args.job_timeout
+            while True:
+                status = self.session.get(f"{url}/api/upscale/status/{job_id}", timeout=30).json()
+                if status.get("status") in TERMINAL_STATUSES or time.time() > deadline:
+                    break
+                time.sleep(self.args.poll)
+            record.update(
+                job_id=job_id,
+                status=status.get("status", "unknown"),
+                done_at=time.time(),
+                timings=status.get("timings") or {},
+            )
+            if status.get("status") not in TERMINAL_STATUSES:
+                record["status"] = "timeout"
+        except (requests.RequestException, ValueError, KeyError) as e:
+            record.update(status="rejected", error=str(e), done_at=time.time())
+
+        with self._lock:
+            self.records.append(record)
+            done = len(self.records)
+        if done % max(1, self.args.jobs // 10) == 0:
+            print(f"  {done}/{self.args.jobs} jobs done")
+        return record
+
+    def run(self):
+        rng = random.Random(self.args.seed)
+        methods, weights = zip(*parse_mix(self.args.mix))
+        plan = rng.choices(methods, weights, k=self.args.jobs)
+
+        start = time.time()
+        if self.args.concurrency:
+            # Closed loop: a fixed number of jobs in flight
+            with ThreadPoolExecutor(self.args.concurrency) as pool:
+                list(pool.map(self.run_job, plan))
+        else:
+            # Open loop: submit at --rate regardless of completions
+            with ThreadPoolExecutor(self.args.max_in_flight) as pool:
+                for n, method in enumerate(plan):
+                    delay = start + n / self.args.rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.run_job, method)
+        return time.time() - start
+
+
+def summarize(records: list, wall_seconds: float) -> dict:
+    def stats(values):
+        return {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    groups = {"all": records}
+    for r in records:
+        groups.setdefault(r["method"], []).append(r)
+
+    summary = {}
+    for name, group in groups.items():
+        completed = [r for r in group if r["status"] == "completed"]
+        counts = {}
+        for r in group:
+            counts[r["status"]] = counts.get(r["status"], 0) + 1
+
+        latencies = {}
+        for stage, (begin, end) in STAGES.items():
+            values = [
+                (r["timings"][end] - r["timings"][begin]) / 1000
+                for r in completed
+                if r["timings"].get(begin) is not None and r["timings"].get(end) is not None
+            ]
+            latencies[stage] = stats(values)
+        latencies["client_end_to_end"] = stats([r["done_at"] - r["submitted_at"] for r in completed])
+        latencies["submit"] = stats([r["submit_seconds"] for r in group if "submit_seconds" in r])
+
+        summary[name] = {
+            "jobs": len(group),
+            "statuses": counts,
+            "throughput_per_second": len(completed) / wall_seconds if wall_seconds else None,
+            "latency_seconds": latencies,
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    for name, s in summary.items():
+        statuses = ", ".join(f"{k} {v}" for k, v in sorted(s["statuses"].items()))
+        print(f"\n{name}: {s['jobs']} jobs ({statuses}), {s['throughput_per_second']:.2f} completed/s")
+        print(f"  {'stage':<18} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        for stage, v in s["latency_seconds"].items():
+            cells = " ".join(f"{v[k]:>9.3f}" if v[k] is not None else f"{'-':>9}" for k in ("p50", "p90", "p99", "max"))
+            print(f"  {stage:<18} {cells}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load-test the Upscaler API")
+    parser.add_argument("--url", default="http://localhost:3000")
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--mix", default="esrgan", help='Method weights, e.g. "esrgan=9,flux=1"')
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=float, default=10, help="Open loop: jobs submitted per second")
+    load.add_argument("--concurrency", type=int, default=None, help="Closed loop: jobs kept in flight")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on outstanding jobs")
+    parser.add_argument("--field", action="append", default=[], help="Extra form field key=value (repeatable)")
+    parser.add_argument("--image", default=None, help="Input image (default: a generated flat PNG)")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--poll", type=float, default=0.1, help="Status poll interval in seconds")
+    parser.add_argument("--job-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the summary and per-job records as JSON")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    mode = f"{args.concurrency} in flight" if args.concurrency else f"{args.rate}/s"
+    print(f"Submitting {args.jobs} jobs ({args.mix}) to {args.url} at {mode}")
+    wall_seconds = test.run()
+    summary = summarize(test.records, wall_seconds)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"wall_seconds": wall_seconds, "summary": summary, "jobs": test.records}, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,7 @@ export class HealthController {
     return {
       status: 'healthy',
       python_worker_ready: this.pythonExecutor.getIsReady(),
+      python_worker: this.pythonExecutor.getWorkerStatus(),
       timestamp: new Date().toISOString(),
       environment: process.env.NODE_ENV || 'development',
     };
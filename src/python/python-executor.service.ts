@@ -7,6 +7,7 @@ import {
 import { spawn, ChildProcess } from 'child_process';
 import { join } from 'path';
 import { createInterface, Interface } from 'readline';
+import { Duplex } from 'stream';
 import { v4 as uuidv4 } from 'uuid';
 
 interface PendingJob {
@@ -14,29 +15,147 @@ interface PendingJob {
   reject: (reason: any) => void;
 }
 
-@Injectable()
-export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
-  private readonly logger = new Logger(PythonExecutorService.name);
+type WorkerProtocol = 'jsonl' | 'framed';
+
+export type WorkerMethod = 'flux' | 'esrgan' | 'imagen' | 'finalize_crop';
+
+/**
+ * The job never got a result because its worker crashed or no worker was
+ * ready. Unlike errors reported by the worker, these are worth retrying:
+ * tiled jobs that set checkpoint_every resume from their checkpoint.
+ */
+export class WorkerUnavailableError extends Error {}
+
+// fd used for the framed protocol; stdout stays free for Python logging
+const CHANNEL_FD = 3;
+const FRAME_HEADER_BYTES = 4;
+// Same limit as utils/protocol.py; larger lengths can only be corruption
+const MAX_FRAME_BYTES = 64 * 1024 * 1024;
+const HEARTBEAT_INTERVAL_SECONDS = parseFloat(
+  process.env.WORKER_HEARTBEAT_SECONDS || '5',
+);
+// A job that has taken down this many workers (e.g. OOM on a huge input)
+// fails instead of being resubmitted to the next one
+const MAX_JOB_CRASHES = Math.max(
+  1,
+  parseInt(process.env.WORKER_MAX_JOB_CRASHES || '2', 10),
+);
+
+// job ID -> number of worker processes that died while running it, shared by
+// the pool so a retry on another worker still counts
+const jobCrashes = new Map<string, number>();
+
+/**
+ * Incremental decoder for length-prefixed (uint32 BE) JSON frames, the
+ * counterpart of utils/protocol.py FrameDecoder.
+ *
+ * A frame with bad JSON is still delimited by its length, so it becomes an
+ * { type: 'invalid' } message and decoding goes on. A length over
+ * MAX_FRAME_BYTES leaves no boundary to resync on: `broken` is set and
+ * nothing more is decoded.
+ */
+class FrameDecoder {
+  private buffer = Buffer.alloc(0);
+  broken = false;
+
+  feed(chunk: Buffer): any[] {
+    if (this.broken) return [];
+    this.buffer = this.buffer.length
+      ? Buffer.concat([this.buffer, chunk])
+      : chunk;
+    const messages = [];
+    while (this.buffer.length >= FRAME_HEADER_BYTES) {
+      const length = this.buffer.readUInt32BE(0);
+      if (length > MAX_FRAME_BYTES) {
+        this.broken = true;
+        this.buffer = Buffer.alloc(0);
+        messages.push({ type: 'invalid', error: `Frame too large: ${length} bytes` });
+        break;
+      }
+      const end = FRAME_HEADER_BYTES + length;
+      if (this.buffer.length < end) break;
+      messages.push(
+        parseMessage(this.buffer.subarray(FRAME_HEADER_BYTES, end).toString('utf8')),
+      );
+      this.buffer = this.buffer.subarray(end);
+    }
+    return messages;
+  }
+}
+
+function parseMessage(payload: string): any {
+  let msg;
+  try {
+    msg = JSON.parse(payload);
+  } catch (err) {
+    return { type: 'invalid', error: `Invalid JSON message: ${err.message}` };
+  }
+  if (msg === null || typeof msg !== 'object' || Array.isArray(msg)) {
+    return { type: 'invalid', error: 'Invalid message: expected a JSON object' };
+  }
+  return msg;
+}
+
+function encodeFrame(msg: any): Buffer {
+  const payload = Buffer.from(JSON.stringify(msg), 'utf8');
+  const header = Buffer.alloc(FRAME_HEADER_BYTES);
+  header.writeUInt32BE(payload.length, 0);
+  return Buffer.concat([header, payload]);
+}
+
+/**
+ * One persistent worker.py process and its message channel.
+ */
+class PythonWorker {
+  private readonly logger: Logger;
   private pythonProcess: ChildProcess;
   private readline: Interface;
-  private pendingJobs = new Map<string, PendingJob>();
-  private isReady = false;
+  readonly pendingJobs = new Map<string, PendingJob>();
+  isReady = false;
   private restartAttempts = 0;
   private readonly maxRestartAttempts = 3;
+  private stopped = false;
+  protocol: WorkerProtocol = 'jsonl';
+  private channel: Duplex;
+  lastHeartbeat: any = null;
+  lastHeartbeatAt = 0;
+  private livenessTimer: NodeJS.Timeout;
+  // Set when the worker asks to be recycled: no new jobs are sent, and the
+  // process is restarted once its pending jobs finish
+  draining = false;
+  private recycling = false;
+  recycles = 0;
 
-  async onModuleInit() {
-    await this.startWorker();
+  constructor(
+    readonly index: number,
+    private readonly cudaDevice: string,
+  ) {
+    this.logger = new Logger(`${PythonExecutorService.name}#${index}`);
   }
 
-  onModuleDestroy() {
+  stop() {
+    this.stopped = true;
+    clearInterval(this.livenessTimer);
     this.pythonProcess?.kill();
   }
 
-  getIsReady(): boolean {
-    return this.isReady;
+  getStatus() {
+    return {
+      worker: this.index,
+      ready: this.isReady,
+      draining: this.draining,
+      recycles: this.recycles,
+      protocol: this.protocol,
+      pending_jobs: this.pendingJobs.size,
+      last_heartbeat: this.lastHeartbeat,
+      residency: this.lastHeartbeat?.residency ?? {},
+      seconds_since_heartbeat: this.lastHeartbeatAt
+        ? (Date.now() - this.lastHeartbeatAt) / 1000
+        : null,
+    };
   }
 
-  private startWorker(): Promise<void> {
+  start(): Promise<void> {
     return new Promise((resolve) => {
       const workerPath = join(__dirname, '../../python-scripts/worker.py');
       const pythonPath = process.env.PYTHON_PATH || 'python3';
@@ -47,46 +166,40 @@ export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
         env: {
           ...process.env,
           PYTHONUNBUFFERED: '1',
-          CUDA_VISIBLE_DEVICES: process.env.CUDA_VISIBLE_DEVICES || '0',
+          CUDA_VISIBLE_DEVICES: this.cudaDevice,
+          WORKER_PROTOCOL: process.env.WORKER_PROTOCOL || 'framed',
+          WORKER_CHANNEL_FD: String(CHANNEL_FD),
         },
-        stdio: ['pipe', 'pipe', 'pipe'],
+        stdio: ['pipe', 'pipe', 'pipe', 'pipe'],
         cwd: join(__dirname, '../../python-scripts'),
       });
+      // Until the worker announces otherwise, assume the JSON-line protocol
+      this.protocol = 'jsonl';
+      this.channel = this.pythonProcess.stdio[CHANNEL_FD] as Duplex;
+
+      const onReady = () => resolve();
 
       this.readline = createInterface({ input: this.pythonProcess.stdout });
 
       this.readline.on('line', (line) => {
-        try {
-          const msg = JSON.parse(line);
-
-          if (msg.type === 'status') {
-            this.logger.log(`Python worker status: ${msg.message}`);
-            if (msg.message === 'ready') {
-              this.isReady = true;
-              resolve();
-            }
-            return;
-          }
-
-          if (msg.type === 'warning') {
-            this.logger.warn(`Python worker warning: ${msg.message}`);
-            return;
-          }
+        if (this.protocol === 'framed') {
+          this.logger.debug(`Python stdout: ${line}`);
+          return;
+        }
 
-          if (msg.type === 'result' || msg.type === 'error') {
-            const pending = this.pendingJobs.get(msg.job_id);
-            if (pending) {
-              this.pendingJobs.delete(msg.job_id);
-              if (msg.type === 'result') {
-                pending.resolve(msg);
-              } else {
-                pending.reject(new Error(msg.error));
-              }
-            }
-          }
+        let msg;
+        try {
+          msg = JSON.parse(line);
         } catch (err) {
           this.logger.warn(`Non-JSON from Python: ${line}`);
+          return;
+        }
+
+        if (msg.type === 'status' && msg.message === 'protocol') {
+          this.useProtocol(msg.protocol, onReady);
+          return;
         }
+        this.handleMessage(msg, onReady);
       });
 
       this.pythonProcess.stderr.on('data', (data) => {
@@ -96,20 +209,43 @@ export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
       this.pythonProcess.on('exit', (code) => {
         this.logger.error(`Python worker exited with code ${code}`);
         this.isReady = false;
+        this.lastHeartbeat = null;
+        this.lastHeartbeatAt = 0;
 
-        // Reject all pending jobs
+        // Reject all pending jobs; only those that have not crashed a
+        // worker too often are worth retrying
         for (const [jobId, pending] of this.pendingJobs) {
-          pending.reject(new Error('Python worker crashed'));
+          const crashes = (jobCrashes.get(jobId) ?? 0) + 1;
+          if (crashes >= MAX_JOB_CRASHES) {
+            jobCrashes.delete(jobId);
+            pending.reject(
+              new Error(`Python worker crashed ${crashes} times running this job — not retrying`),
+            );
+          } else {
+            jobCrashes.set(jobId, crashes);
+            pending.reject(new WorkerUnavailableError('Python worker crashed'));
+          }
           this.pendingJobs.delete(jobId);
         }
 
         // Resolve startup promise so NestJS can finish booting
         resolve();
 
+        if (this.stopped) return;
+
+        if (this.recycling) {
+          // Planned restart, not a crash
+          this.recycling = false;
+          this.draining = false;
+          this.recycles++;
+          this.start();
+          return;
+        }
+
         // Auto-restart with retry limit
         this.restartAttempts++;
         if (this.restartAttempts < this.maxRestartAttempts) {
-          setTimeout(() => this.startWorker(), 5000);
+          setTimeout(() => this.start(), 5000);
         } else {
           this.logger.warn(
             `Python worker failed ${this.maxRestartAttempts} times — stopping retries. Install Python deps or run in Docker.`,
@@ -117,6 +253,8 @@ export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
         }
       });
 
+      this.startLivenessCheck();
+
       // Timeout for initial startup (models can take 30-60s to load)
       setTimeout(() => {
         if (!this.isReady) {
@@ -129,26 +267,237 @@ export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
     });
   }
 
-  async executeUpscaler(
-    method: 'flux' | 'esrgan' | 'imagen',
-    config: any,
-  ): Promise<any> {
-    if (!this.isReady) {
-      throw new Error('Python worker not ready — models still loading');
+  private useProtocol(protocol: WorkerProtocol, onReady: () => void) {
+    this.logger.log(`Python worker protocol: ${protocol}`);
+    if (protocol !== 'framed') return;
+
+    this.protocol = 'framed';
+    const decoder = new FrameDecoder();
+    this.channel.on('data', (chunk: Buffer) => {
+      if (decoder.broken) return;
+      for (const msg of decoder.feed(chunk)) {
+        if (msg.type === 'invalid') {
+          this.logger.warn(`Dropped frame from Python worker: ${msg.error}`);
+          continue;
+        }
+        this.handleMessage(msg, onReady);
+      }
+      if (decoder.broken) {
+        // No frame boundary left to read on; restart the worker
+        this.logger.error('Corrupt frame length from Python worker — restarting it');
+        this.pythonProcess.kill();
+      }
+    });
+  }
+
+  private handleMessage(msg: any, onReady: () => void) {
+    if (msg.type === 'heartbeat') {
+      this.lastHeartbeat = msg;
+      this.lastHeartbeatAt = Date.now();
+      return;
+    }
+
+    if (msg.type === 'status') {
+      this.logger.log(`Python worker status: ${msg.message}`);
+      if (msg.message === 'ready') {
+        this.isReady = true;
+        // Only consecutive failures to start count against the restart limit
+        this.restartAttempts = 0;
+        onReady();
+      } else if (msg.message === 'recycle') {
+        this.logger.log(
+          `Draining Python worker for recycling (${msg.reason}, RSS ${msg.rss_mb} MB)`,
+        );
+        this.draining = true;
+        this.recycleIfDrained();
+      } else if (msg.message === 'residency') {
+        const moves = msg.transitions
+          .map(([name, state]) => `${name} -> ${state}`)
+          .join(', ');
+        this.logger.log(`Python worker ${msg.method} residency: ${moves}`);
+      }
+      return;
+    }
+
+    if (msg.type === 'warning') {
+      this.logger.warn(`Python worker warning: ${msg.message}`);
+      return;
+    }
+
+    if (msg.type === 'result' || msg.type === 'error') {
+      const pending = this.pendingJobs.get(msg.job_id);
+      if (pending) {
+        this.pendingJobs.delete(msg.job_id);
+        jobCrashes.delete(msg.job_id);
+        if (msg.type === 'result') {
+          pending.resolve(msg);
+        } else {
+          pending.reject(new Error(msg.error));
+        }
+      }
+      this.recycleIfDrained();
     }
+  }
 
-    const jobId = uuidv4();
+  /**
+   * Stop a draining worker once it is idle by closing its input, so it
+   * exits cleanly; the exit handler starts a fresh process.
+   */
+  private recycleIfDrained() {
+    if (!this.draining || this.recycling || this.pendingJobs.size > 0) return;
+    this.recycling = true;
+    this.isReady = false;
+    this.pythonProcess.stdin.end();
+    this.channel?.end();
+    const child = this.pythonProcess;
+    setTimeout(() => {
+      if (child.exitCode === null) child.kill();
+    }, 10000);
+  }
+
+  /**
+   * Warn when a busy worker stops sending heartbeats. The worker is not
+   * killed: a long native call can legitimately hold the GIL for a while.
+   */
+  private startLivenessCheck() {
+    clearInterval(this.livenessTimer);
+    const staleAfterMs = HEARTBEAT_INTERVAL_SECONDS * 1000 * 6;
+    let warned = false;
+
+    this.livenessTimer = setInterval(() => {
+      if (!this.lastHeartbeatAt || this.pendingJobs.size === 0) return;
+      const silentMs = Date.now() - this.lastHeartbeatAt;
+      if (silentMs > staleAfterMs && !warned) {
+        warned = true;
+        this.logger.warn(
+          `No heartbeat from Python worker for ${Math.round(silentMs / 1000)}s ` +
+            `(last stage: ${this.lastHeartbeat?.stage})`,
+        );
+      } else if (silentMs <= staleAfterMs) {
+        warned = false;
+      }
+    }, HEARTBEAT_INTERVAL_SECONDS * 1000);
+  }
+
+  send(msg: any) {
+    if (this.protocol === 'framed') {
+      this.channel.write(encodeFrame(msg));
+    } else {
+      this.pythonProcess.stdin.write(JSON.stringify(msg) + '\n');
+    }
+  }
 
+  /**
+   * Send a job; resolves with the worker's result message.
+   */
+  execute(method: WorkerMethod, config: any, jobId: string): Promise<any> {
     return new Promise((resolve, reject) => {
       this.pendingJobs.set(jobId, { resolve, reject });
 
-      const job = JSON.stringify({
+      this.send({
         job_id: jobId,
         method,
         config,
       });
-
-      this.pythonProcess.stdin.write(job + '\n');
     });
   }
 }
+
+/**
+ * Pool of PYTHON_WORKER_COUNT worker processes (default 1). Jobs go to the
+ * ready worker with the fewest pending jobs. PYTHON_WORKER_GPUS
+ * (comma-separated) assigns CUDA devices round-robin; otherwise every
+ * worker uses CUDA_VISIBLE_DEVICES.
+ */
+@Injectable()
+export class PythonExecutorService implements OnModuleInit, OnModuleDestroy {
+  private readonly workers: PythonWorker[] = [];
+
+  constructor() {
+    const count = Math.max(1, parseInt(process.env.PYTHON_WORKER_COUNT || '1', 10));
+    const gpus = (process.env.PYTHON_WORKER_GPUS || '')
+      .split(',')
+      .map((gpu) => gpu.trim())
+      .filter(Boolean);
+    for (let i = 0; i < count; i++) {
+      const device = gpus.length
+        ? gpus[i % gpus.length]
+        : process.env.CUDA_VISIBLE_DEVICES || '0';
+      this.workers.push(new PythonWorker(i, device));
+    }
+  }
+
+  async onModuleInit() {
+    await Promise.all(this.workers.map((worker) => worker.start()));
+  }
+
+  onModuleDestroy() {
+    this.workers.forEach((worker) => worker.stop());
+  }
+
+  getIsReady(): boolean {
+    return this.workers.some((worker) => worker.isReady && !worker.draining);
+  }
+
+  getWorkerCount(): number {
+    return this.workers.length;
+  }
+
+  getWorkerStatus() {
+    const first = this.workers[0].getStatus();
+    return {
+      protocol: first.protocol,
+      pending_jobs: this.workers.reduce((n, w) => n + w.pendingJobs.size, 0),
+      last_heartbeat: first.last_heartbeat,
+      seconds_since_heartbeat: first.seconds_since_heartbeat,
+      workers: this.workers.map((worker) => worker.getStatus()),
+    };
+  }
+
+  /**
+   * Resolve once any worker is ready, e.g. after a crash restart; false on
+   * timeout.
+   */
+  async waitUntilReady(timeoutMs = 120000): Promise<boolean> {
+    const deadline = Date.now() + timeoutMs;
+    while (!this.getIsReady()) {
+      if (Date.now() >= deadline) return false;
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+    return true;
+  }
+
+  /**
+   * Run an upscale job on the least busy ready worker. Resolves with the
+   * worker's result message, whose status is 'completed' or 'cancelled'.
+   */
+  async executeUpscaler(
+    method: WorkerMethod,
+    config: any,
+    jobId: string = uuidv4(),
+  ): Promise<any> {
+    const ready = this.workers.filter((worker) => worker.isReady && !worker.draining);
+    if (!ready.length) {
+      throw new WorkerUnavailableError('Python worker not ready — models still loading');
+    }
+
+    const worker = ready.reduce((best, w) =>
+      w.pendingJobs.size < best.pendingJobs.size ? w : best,
+    );
+    return worker.execute(method, config, jobId);
+  }
+
+  /**
+   * Ask the worker running a job to cancel it. Queued jobs are dropped
+   * immediately; running jobs stop at their next tile or sampler step and
+   * resolve with status 'cancelled'. Returns false if no worker has the job.
+   */
+  cancel(jobId: string, reason = 'cancelled'): boolean {
+    const worker = this.workers.find((w) => w.pendingJobs.has(jobId));
+    if (!worker) {
+      return false;
+    }
+    worker.send({ type: 'cancel', job_id: jobId, reason });
+    return true;
+  }
+}
@@ -1,4 +1,4 @@
-import { IsOptional, IsNumber, IsString, IsBoolean, Min, Max } from 'class-validator';
+import { IsOptional, IsNumber, IsString, IsBoolean, IsIn, Min, Max } from 'class-validator';
 
 export class EsrganUpscaleDto {
   @IsOptional()
@@ -19,23 +19,94 @@ export class EsrganUpscaleDto {
   @IsNumber()
   target_height_inches?: number;
 
+  @IsOptional()
+  @IsIn(['offset', 'center', 'saliency'])
+  crop_policy?: string;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  crop_offset?: number;
+
   @IsOptional()
   @IsString()
   model?: string = '4x-UltraSharp.pth';
 
+  // Unset: this host's autotune profile for the model, else 512
   @IsOptional()
   @IsNumber()
-  tile_size?: number = 512;
+  tile_size?: number;
 
   @IsOptional()
   @IsBoolean()
-  use_fp16?: boolean = true;
+  use_fp16?: boolean;
+
+  @IsOptional()
+  @IsIn(['torch', 'int8', 'onnx'])
+  backend?: string = 'torch';
 
   @IsOptional()
   @IsBoolean()
   use_two_pass?: boolean = false;
 
+  @IsOptional()
+  @IsBoolean()
+  draft_decode?: boolean = false;
+
+  // Interpolate tiles with less detail than this instead of running the model; 0 is off
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  @Max(1)
+  flat_threshold?: number;
+
+  @IsOptional()
+  @IsBoolean()
+  dedup_tiles?: boolean;
+
+  // CPU-only nodes: run tiles in a process pool (default CPU_TILE_PARALLEL, off)
+  @IsOptional()
+  @IsBoolean()
+  cpu_parallel?: boolean;
+
+  // Split the tile grid across this many Python workers; 1 runs unsplit
+  @IsOptional()
+  @IsNumber()
+  @Min(1)
+  @Max(32)
+  shards?: number;
+
+  // Save finished tiles every this many tiles so a retry after a worker
+  // crash resumes; 0 (default) is off
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  checkpoint_every?: number;
+
+  // Keep the uncompressed output of a job that still needs cropping, for
+  // /finalize (default RETAIN_RAW_OUTPUT on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  retain_raw?: boolean;
+
+  // Write a deep-zoom tile pyramid and preview for the viewer (default
+  // PYRAMID_ENABLED on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  pyramid?: boolean;
+
   @IsOptional()
   @IsString()
   output_format?: string = 'png';
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  @Max(10)
+  priority?: number = 0;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(1)
+  timeout_seconds?: number;
 }
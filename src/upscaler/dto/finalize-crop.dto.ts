@@ -0,0 +1,15 @@
+import { IsOptional, IsNumber, IsString, IsBoolean, Min } from 'class-validator';
+
+export class FinalizeCropDto {
+  @IsNumber()
+  @Min(0)
+  crop_offset: number;
+
+  @IsOptional()
+  @IsString()
+  output_format?: string;
+
+  @IsOptional()
+  @IsBoolean()
+  pyramid?: boolean;
+}
@@ -1,4 +1,4 @@
-import { IsOptional, IsNumber, IsString, Min, Max } from 'class-validator';
+import { IsOptional, IsNumber, IsString, IsBoolean, IsIn, Min, Max } from 'class-validator';
 
 export class FluxUpscaleDto {
   @IsOptional()
@@ -19,6 +19,15 @@ export class FluxUpscaleDto {
   @IsNumber()
   target_height_inches?: number;
 
+  @IsOptional()
+  @IsIn(['offset', 'center', 'saliency'])
+  crop_policy?: string;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  crop_offset?: number;
+
   @IsOptional()
   @IsNumber()
   @Min(0)
@@ -31,14 +40,40 @@ export class FluxUpscaleDto {
   @Max(100)
   steps?: number = 20;
 
+  // Unset: this host's autotune profile for the model, else 512
+  @IsOptional()
+  @IsNumber()
+  tile_size?: number;
+
+  @IsOptional()
+  @IsIn(['auto', 'true', 'false'])
+  tiled_vae?: string = 'auto';
+
+  @IsOptional()
+  @IsNumber()
+  @Min(256)
+  vae_tile_size?: number;
+
   @IsOptional()
   @IsNumber()
-  tile_size?: number = 512;
+  vae_memory_budget_mb?: number;
 
   @IsOptional()
   @IsString()
   upscale_model?: string = '4x-UltraSharp.pth';
 
+  // Keep the uncompressed output of a job that still needs cropping, for
+  // /finalize (default RETAIN_RAW_OUTPUT on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  retain_raw?: boolean;
+
+  // Write a deep-zoom tile pyramid and preview for the viewer (default
+  // PYRAMID_ENABLED on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  pyramid?: boolean;
+
   @IsOptional()
   @IsString()
   output_format?: string = 'png';
@@ -66,4 +101,15 @@ export class FluxUpscaleDto {
   @IsOptional()
   @IsString()
   scheduler?: string = 'normal';
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  @Max(10)
+  priority?: number = 0;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(1)
+  timeout_seconds?: number;
 }
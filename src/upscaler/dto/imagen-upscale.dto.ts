@@ -1,4 +1,5 @@
-import { IsOptional, IsNumber, IsString } from 'class-validator';
+import { IsOptional, IsNumber, IsString, IsBoolean, IsIn, Min, Max } from 'class-validator';
+import { Transform } from 'class-transformer';
 
 export class ImagenUpscaleDto {
   @IsOptional()
@@ -25,6 +26,18 @@ export class ImagenUpscaleDto {
   @IsString()
   gcp_region?: string;
 
+  // Keep the uncompressed output of a job that still needs cropping, for
+  // /finalize (default RETAIN_RAW_OUTPUT on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  retain_raw?: boolean;
+
+  // Write a deep-zoom tile pyramid and preview for the viewer (default
+  // PYRAMID_ENABLED on the worker, off)
+  @IsOptional()
+  @IsBoolean()
+  pyramid?: boolean;
+
   @IsOptional()
   @IsString()
   output_format?: string = 'png';
@@ -32,4 +45,45 @@ export class ImagenUpscaleDto {
   @IsOptional()
   @IsString()
   prompt?: string;
+
+  // "auto": tile inputs whose upscaled size exceeds the API's output limit.
+  // JSON booleans and "true"/"false" (form fields) are both accepted
+  @IsOptional()
+  @Transform(({ value }) => (value === 'true' ? true : value === 'false' ? false : value))
+  @IsIn(['auto', true, false])
+  tiling?: boolean | 'auto' = 'auto';
+
+  // Unset: the largest square tile within the API's limit
+  @IsOptional()
+  @IsNumber()
+  @Min(64)
+  tile_size?: number;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  tile_overlap?: number = 64;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(1)
+  @Max(32)
+  max_concurrency?: number;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  @Max(5)
+  tile_retries?: number;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(0)
+  @Max(10)
+  priority?: number = 0;
+
+  @IsOptional()
+  @IsNumber()
+  @Min(1)
+  timeout_seconds?: number;
 }
@@ -1,3 +1,4 @@
 export { FluxUpscaleDto } from './flux-upscale.dto';
 export { EsrganUpscaleDto } from './esrgan-upscale.dto';
 export { ImagenUpscaleDto } from './imagen-upscale.dto';
+export { FinalizeCropDto } from './finalize-crop.dto';
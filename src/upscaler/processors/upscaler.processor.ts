@@ -1,10 +1,20 @@
 import { Processor, WorkerHost } from '@nestjs/bullmq';
-import { Job } from 'bullmq';
+import { Job, UnrecoverableError } from 'bullmq';
 import { Logger } from '@nestjs/common';
-import { PythonExecutorService } from '../../python/python-executor.service';
+import {
+  PythonExecutorService,
+  WorkerUnavailableError,
+} from '../../python/python-executor.service';
+import { CANCELLED_REASON_PREFIX } from '../upscaler.service';
 
 @Processor('upscaler', {
-  concurrency: 1, // One GPU job at a time
+  // Each Python worker runs one job at a time, but keeping one more job
+  // than there are workers lets an urgent job preempt a bulk one
+  concurrency: parseInt(
+    process.env.WORKER_QUEUE_CONCURRENCY ||
+      String(parseInt(process.env.PYTHON_WORKER_COUNT || '1', 10) + 1),
+    10,
+  ),
 })
 export class UpscalerProcessor extends WorkerHost {
   private readonly logger = new Logger(UpscalerProcessor.name);
@@ -19,9 +29,21 @@ export class UpscalerProcessor extends WorkerHost {
     this.logger.log(`Processing ${method} upscale job: ${jobId}`);
 
     try {
+      if (job.data.cancelled) {
+        // Merge of a split job cancelled while its shards ran
+        throw new UnrecoverableError(`${CANCELLED_REASON_PREFIX}: cancelled`);
+      }
+
+      // A retry after a crash waits for the restarted worker
+      await this.pythonExecutor.waitUntilReady();
       await job.updateProgress(10);
 
-      const result = await this.pythonExecutor.executeUpscaler(method, config);
+      const result = await this.pythonExecutor.executeUpscaler(method, config, jobId);
+
+      if (result.status === 'cancelled') {
+        // Not retried: the job was stopped on purpose
+        throw new UnrecoverableError(`${CANCELLED_REASON_PREFIX}: ${result.reason}`);
+      }
 
       await job.updateProgress(100);
 
@@ -31,12 +53,29 @@ export class UpscalerProcessor extends WorkerHost {
         output_width: result.output_width,
         output_height: result.output_height,
         crop_info: result.crop_info,
+        compute_skipped: result.compute_skipped,
+        tile_stats: result.tile_stats,
+        resumed_tiles: result.resumed_tiles,
+        tile_retries: result.tile_retries,
+        timings: result.timings,
+        memory: result.memory,
+        raw_expires_at: result.raw_expires_at,
+        pyramid: result.pyramid,
+        shard: result.shard,
+        tiles: result.tiles,
         processing_time: result.processing_time,
         status: 'completed',
       };
     } catch (error) {
       this.logger.error(`Job ${jobId} failed: ${error.message}`);
-      throw error;
+      if (
+        error instanceof WorkerUnavailableError ||
+        error instanceof UnrecoverableError
+      ) {
+        throw error;
+      }
+      // Only crashes are retried; the worker reported this error itself
+      throw new UnrecoverableError(error.message);
     }
   }
 }
@@ -13,7 +13,12 @@ import {
 } from '@nestjs/common';
 import { FileInterceptor } from '@nestjs/platform-express';
 import { UpscalerService } from './upscaler.service';
-import { FluxUpscaleDto, EsrganUpscaleDto, ImagenUpscaleDto } from './dto';
+import {
+  FluxUpscaleDto,
+  EsrganUpscaleDto,
+  ImagenUpscaleDto,
+  FinalizeCropDto,
+} from './dto';
 import { Response } from 'express';
 import { diskStorage } from 'multer';
 import { v4 as uuidv4 } from 'uuid';
@@ -69,6 +74,35 @@ export class UpscalerController {
     return this.upscalerService.getJobStatus(jobId);
   }
 
+  @Post('finalize/:jobId')
+  async finalizeCrop(
+    @Param('jobId') jobId: string,
+    @Body() dto: FinalizeCropDto,
+  ) {
+    return this.upscalerService.queueFinalizeCrop(jobId, dto);
+  }
+
+  @Post('cancel/:jobId')
+  async cancel(@Param('jobId') jobId: string) {
+    return this.upscalerService.cancelJob(jobId);
+  }
+
+  @Get('tiles/:jobId/:level/:tile')
+  async getTile(
+    @Param('jobId') jobId: string,
+    @Param('level') level: string,
+    @Param('tile') tile: string,
+    @Res() res: Response,
+  ) {
+    try {
+      const filePath = await this.upscalerService.getTilePath(jobId, level, tile);
+      // Tiles never change once a job has finished
+      res.sendFile(filePath, { maxAge: '7d', immutable: true });
+    } catch {
+      throw new NotFoundException('Tile not found');
+    }
+  }
+
   @Get('result/:filename')
   async downloadResult(
     @Param('filename') filename: string,
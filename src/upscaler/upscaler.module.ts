@@ -13,6 +13,7 @@ const optionalProviders = [];
 if (!isLocalMode) {
   optionalImports.push(
     BullModule.registerQueue({ name: 'upscaler' }),
+    BullModule.registerFlowProducer({ name: 'upscaler-flow' }),
   );
   optionalProviders.push(UpscalerProcessor);
 }
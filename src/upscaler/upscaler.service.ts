@@ -1,20 +1,66 @@
-import { Injectable, Logger, Optional, Inject } from '@nestjs/common';
-import { InjectQueue } from '@nestjs/bullmq';
-import { Queue } from 'bullmq';
+import {
+  Injectable,
+  Logger,
+  Optional,
+  Inject,
+  BadRequestException,
+} from '@nestjs/common';
+import { InjectFlowProducer, InjectQueue } from '@nestjs/bullmq';
+import { FlowProducer, Queue } from 'bullmq';
 import { v4 as uuidv4 } from 'uuid';
-import { join } from 'path';
+import { join, resolve } from 'path';
 import { existsSync } from 'fs';
-import { PythonExecutorService } from '../python/python-executor.service';
+import {
+  PythonExecutorService,
+  WorkerMethod,
+  WorkerUnavailableError,
+} from '../python/python-executor.service';
+import { FinalizeCropDto } from './dto';
 
 const isLocalMode = process.env.LOCAL_MODE === 'true';
 
+// Request priority 0 (bulk, default) .. MAX_PRIORITY (most urgent). BullMQ
+// treats lower numbers as more urgent, so the value is inverted when queued.
+export const MAX_PRIORITY = 10;
+export const CANCELLED_REASON_PREFIX = 'Job cancelled';
+
+const TILE_NAME = /^\d+_\d+\.(jpg|webp)$/;
+
 interface LocalJob {
   jobId: string;
   method: string;
-  status: 'queued' | 'processing' | 'completed' | 'failed';
+  status: 'queued' | 'processing' | 'completed' | 'failed' | 'cancelled';
   progress: number;
   result?: any;
   error?: string;
+  shardIds?: string[];
+  cancelRequested?: boolean;
+  createdAt: number;
+  startedAt?: number;
+  finishedAt?: number;
+}
+
+// Resubmissions after a worker crash; tiled jobs that set checkpoint_every
+// resume from their tile checkpoint (shards from the tile store). The executor stops these
+// early for a job that keeps crashing workers (WORKER_MAX_JOB_CRASHES)
+export const WORKER_CRASH_RETRIES = parseInt(
+  process.env.WORKER_CRASH_RETRIES || '2',
+  10,
+);
+const CRASH_RETRY_DELAY_MS = 5000;
+
+const RETRY_OPTIONS = {
+  attempts: 1 + WORKER_CRASH_RETRIES,
+  backoff: { type: 'fixed', delay: CRASH_RETRY_DELAY_MS },
+};
+
+const JOB_RETENTION = {
+  removeOnComplete: { age: 3600 },
+  removeOnFail: { age: 7200 },
+};
+
+function shardJobIds(jobId: string, shards: number): string[] {
+  return Array.from({ length: shards }, (_, k) => `${jobId}-shard-${k}`);
 }
 
 @Injectable()
@@ -24,6 +70,9 @@ export class UpscalerService {
 
   constructor(
     @Optional() @InjectQueue('upscaler') private readonly upscalerQueue: Queue,
+    @Optional()
+    @InjectFlowProducer('upscaler-flow')
+    private readonly flowProducer: FlowProducer,
     private readonly pythonExecutor: PythonExecutorService,
   ) {}
 
@@ -45,8 +94,123 @@ export class UpscalerService {
     if (options.model) config.model = options.model;
     if (options.upscale_model) config.upscale_model = options.upscale_model;
 
+    const shards = method === 'esrgan' ? options.shards || 1 : 1;
+    delete config.shards;
+    if (shards > 1) {
+      if (options.use_two_pass) {
+        throw new BadRequestException('Two-pass jobs cannot be split into shards');
+      }
+      return this.dispatchSplit(jobId, config, shards, options.priority || 0);
+    }
+
+    return this.dispatch(jobId, method, config, options.priority || 0);
+  }
+
+  /**
+   * Split one ESRGAN job's tile grid across workers: `shards` child jobs
+   * each run a slice of the tiles into the shared tile store, then a merge
+   * job (with the original jobId) blends them and saves the output. The
+   * result is identical to an unsplit run.
+   */
+  private async dispatchSplit(
+    jobId: string,
+    config: any,
+    shards: number,
+    priority: number,
+  ) {
+    const shardIds = shardJobIds(jobId, shards);
+    const shardConfig = (shard: number) => ({
+      ...config,
+      split: { split_id: jobId, shard, shards },
+    });
+    const mergeConfig = { ...config, split: { split_id: jobId, merge: true } };
+
     if (isLocalMode) {
-      return this.runLocal(jobId, method, config);
+      return this.runLocal(jobId, 'esrgan', async (localJob) => {
+        localJob.shardIds = shardIds;
+        let done = 0;
+        try {
+          const results = await Promise.all(
+            shardIds.map((shardId, k) =>
+              this.retryOnCrash(localJob, shardId, () =>
+                this.pythonExecutor.executeUpscaler('esrgan', shardConfig(k), shardId),
+              ).then((result) => {
+                done++;
+                localJob.progress = 10 + Math.round((80 * done) / shards);
+                return result;
+              }),
+            ),
+          );
+          const cancelled = results.find((r) => r.status === 'cancelled');
+          if (cancelled) return cancelled;
+        } catch (err) {
+          // One shard failed; stop the others
+          shardIds.forEach((shardId) => this.pythonExecutor.cancel(shardId));
+          throw err;
+        }
+        return this.retryOnCrash(localJob, jobId, () =>
+          this.pythonExecutor.executeUpscaler('esrgan', mergeConfig, jobId),
+        );
+      });
+    }
+
+    // Remote mode: a BullMQ flow, the merge runs once every shard completes
+    const bullPriority = MAX_PRIORITY + 1 - priority;
+    await this.flowProducer.add({
+      name: 'esrgan-merge',
+      queueName: 'upscaler',
+      data: { method: 'esrgan', config: mergeConfig, jobId, shardIds },
+      opts: { jobId, priority: bullPriority, ...RETRY_OPTIONS, ...JOB_RETENTION },
+      children: shardIds.map((shardId, k) => ({
+        name: 'esrgan-shard',
+        queueName: 'upscaler',
+        data: { method: 'esrgan', config: shardConfig(k), jobId: shardId },
+        opts: {
+          jobId: shardId,
+          priority: bullPriority,
+          ...RETRY_OPTIONS,
+          failParentOnFailure: true,
+          ...JOB_RETENTION,
+        },
+      })),
+    });
+
+    this.logger.log(`Queued esrgan split job: ${jobId} (${shards} shards)`);
+
+    return { jobId, status: 'queued', method: 'esrgan', shards };
+  }
+
+  /**
+   * Crop a finished job's retained raw output at the chosen offset. Runs
+   * at top priority since it never touches a model and takes seconds.
+   */
+  async queueFinalizeCrop(sourceJobId: string, options: FinalizeCropDto) {
+    const jobId = uuidv4();
+    const config = {
+      source_job_id: sourceJobId,
+      crop_offset: options.crop_offset,
+      output_dir: process.env.OUTPUT_DIR || './results',
+      output_name: jobId,
+      output_format: options.output_format,
+      pyramid: options.pyramid,
+      priority: MAX_PRIORITY,
+    };
+
+    return this.dispatch(jobId, 'finalize_crop', config, MAX_PRIORITY);
+  }
+
+  private async dispatch(
+    jobId: string,
+    method: WorkerMethod,
+    config: any,
+    priority: number,
+  ) {
+    if (isLocalMode) {
+      return this.runLocal(jobId, method, (localJob) =>
+        this.retryOnCrash(localJob, jobId, () =>
+          this.pythonExecutor.executeUpscaler(method, config, jobId),
+        ),
+      );
     }
 
     // Remote mode: use BullMQ
@@ -57,9 +221,9 @@ export class UpscalerService {
       jobId,
     }, {
       jobId,
-      attempts: 1,
-      removeOnComplete: { age: 3600 },
-      removeOnFail: { age: 7200 },
+      priority: MAX_PRIORITY + 1 - priority,
+      ...RETRY_OPTIONS,
+      ...JOB_RETENTION,
     });
 
     this.logger.log(`Queued ${method} upscale job: ${jobId}`);
@@ -67,16 +231,46 @@ export class UpscalerService {
     return { jobId, status: 'queued', method };
   }
 
+  /**
+   * Local-mode counterpart of the queue's retry options: resubmit the job
+   * with the same ID once a worker is ready again, if its worker crashed.
+   */
+  private async retryOnCrash(
+    localJob: LocalJob,
+    jobId: string,
+    execute: () => Promise<any>,
+  ): Promise<any> {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await execute();
+      } catch (err) {
+        if (!(err instanceof WorkerUnavailableError) || attempt >= WORKER_CRASH_RETRIES) {
+          throw err;
+        }
+        this.logger.warn(
+          `[LOCAL] Job ${jobId}: ${err.message}, retrying (${attempt + 1}/${WORKER_CRASH_RETRIES})`,
+        );
+        await new Promise((resolve) => setTimeout(resolve, CRASH_RETRY_DELAY_MS));
+        await this.pythonExecutor.waitUntilReady();
+        if (localJob.cancelRequested) {
+          // Cancelled while no worker held the job
+          return { status: 'cancelled', reason: 'cancelled' };
+        }
+      }
+    }
+  }
+
   private async runLocal(
     jobId: string,
-    method: 'flux' | 'esrgan' | 'imagen',
-    config: any,
+    method: WorkerMethod,
+    execute: (localJob: LocalJob) => Promise<any>,
   ) {
     const localJob: LocalJob = {
       jobId,
       method,
       status: 'queued',
       progress: 0,
+      createdAt: Date.now(),
     };
     this.localJobs.set(jobId, localJob);
 
@@ -87,8 +281,16 @@ export class UpscalerService {
       try {
         localJob.status = 'processing';
         localJob.progress = 10;
+        localJob.startedAt = Date.now();
 
-        const result = await this.pythonExecutor.executeUpscaler(method, config);
+        const result = await execute(localJob);
+
+        if (result.status === 'cancelled') {
+          localJob.status = 'cancelled';
+          localJob.error = `${CANCELLED_REASON_PREFIX}: ${result.reason}`;
+          this.logger.log(`[LOCAL] Job ${jobId} cancelled (${result.reason})`);
+          return;
+        }
 
         localJob.status = 'completed';
         localJob.progress = 100;
@@ -97,6 +299,8 @@ export class UpscalerService {
         localJob.status = 'failed';
         localJob.error = err.message;
         this.logger.error(`[LOCAL] Job ${jobId} failed: ${err.message}`);
+      } finally {
+        localJob.finishedAt = Date.now();
       }
     })();
 
@@ -122,6 +326,12 @@ export class UpscalerService {
       jobId,
       status: state,
       progress: typeof progress === 'number' ? progress : 0,
+      timings: this.jobTimings(
+        job.timestamp,
+        job.processedOn,
+        job.finishedOn,
+        job.returnvalue?.timings,
+      ),
     };
 
     if (state === 'completed' && job.returnvalue) {
@@ -129,6 +339,12 @@ export class UpscalerService {
       result.output_width = job.returnvalue.output_width;
       result.output_height = job.returnvalue.output_height;
       result.crop_info = job.returnvalue.crop_info;
+      result.compute_skipped = job.returnvalue.compute_skipped;
+      result.tile_stats = job.returnvalue.tile_stats;
+      result.resumed_tiles = job.returnvalue.resumed_tiles;
+      result.tile_retries = job.returnvalue.tile_retries;
+      result.raw_expires_at = job.returnvalue.raw_expires_at;
+      result.pyramid = this.pyramidUrls(jobId, job.returnvalue.pyramid);
       result.processing_time = job.returnvalue.processing_time;
 
       if (job.returnvalue.output_path) {
@@ -137,8 +353,23 @@ export class UpscalerService {
       }
     }
 
+    if (state === 'waiting-children') {
+      // Split job: the merge waits for its shards
+      const { processed = 0, unprocessed = 0 } = await job.getDependenciesCount();
+      const total = processed + unprocessed;
+      result.shards = { done: processed, total };
+      result.progress = 10 + Math.round((80 * processed) / Math.max(total, 1));
+    }
+
     if (state === 'failed') {
       result.error = job.failedReason;
+      if (job.failedReason?.startsWith(CANCELLED_REASON_PREFIX)) {
+        result.status = 'cancelled';
+      }
+    }
+
+    if (job.data?.cancelled && state !== 'completed') {
+      result.status = 'cancelled';
     }
 
     return result;
@@ -154,6 +385,12 @@ export class UpscalerService {
       jobId,
       status: job.status,
       progress: job.progress,
+      timings: this.jobTimings(
+        job.createdAt,
+        job.startedAt,
+        job.finishedAt,
+        job.result?.timings,
+      ),
     };
 
     if (job.status === 'completed' && job.result) {
@@ -161,6 +398,12 @@ export class UpscalerService {
       result.output_width = job.result.output_width;
       result.output_height = job.result.output_height;
       result.crop_info = job.result.crop_info;
+      result.compute_skipped = job.result.compute_skipped;
+      result.tile_stats = job.result.tile_stats;
+      result.resumed_tiles = job.result.resumed_tiles;
+      result.tile_retries = job.result.tile_retries;
+      result.raw_expires_at = job.result.raw_expires_at;
+      result.pyramid = this.pyramidUrls(jobId, job.result.pyramid);
       result.processing_time = job.result.processing_time;
 
       if (job.result.output_path) {
@@ -169,13 +412,117 @@ export class UpscalerService {
       }
     }
 
-    if (job.status === 'failed') {
+    if (job.status === 'failed' || job.status === 'cancelled') {
       result.error = job.error;
     }
 
     return result;
   }
 
+  /**
+   * Cancel a job. Jobs still waiting in the queue are removed outright;
+   * jobs on the Python worker stop at their next tile or sampler step.
+   */
+  async cancelJob(jobId: string) {
+    if (isLocalMode) {
+      const job = this.localJobs.get(jobId);
+      if (!job) {
+        return { jobId, status: 'not_found' };
+      }
+      if (job.status !== 'queued' && job.status !== 'processing') {
+        return { jobId, status: job.status };
+      }
+      job.cancelRequested = true;
+      [jobId, ...(job.shardIds || [])].forEach((id) => this.pythonExecutor.cancel(id));
+      return { jobId, status: 'cancelling' };
+    }
+
+    const job = await this.upscalerQueue.getJob(jobId);
+    if (!job) {
+      return { jobId, status: 'not_found' };
+    }
+
+    const state = await job.getState();
+    if (state === 'waiting' || state === 'delayed' || state === 'prioritized') {
+      await job.remove();
+      this.logger.log(`Removed queued job: ${jobId}`);
+      return { jobId, status: 'cancelled' };
+    }
+    if (state === 'active' && this.pythonExecutor.cancel(jobId)) {
+      return { jobId, status: 'cancelling' };
+    }
+    if (state === 'waiting-children') {
+      // Split job: flag the merge so it never runs, then stop the shards
+      await job.updateData({ ...job.data, cancelled: true });
+      for (const shardId of job.data.shardIds || []) {
+        const shard = await this.upscalerQueue.getJob(shardId);
+        const shardState = await shard?.getState();
+        if (['waiting', 'delayed', 'prioritized'].includes(shardState)) {
+          await shard.remove();
+        } else if (shardState === 'active') {
+          this.pythonExecutor.cancel(shardId);
+        }
+      }
+      this.logger.log(`Cancelling split job: ${jobId}`);
+      return { jobId, status: 'cancelling' };
+    }
+
+    return { jobId, status: state };
+  }
+
+  /**
+   * Epoch-millisecond timestamps of a job's way through the service: queued,
+   * picked up (by the queue processor, or at once in local mode), finished,
+   * and as seen by the worker: read off its channel, started, finished.
+   * scripts/load-test.py derives queue wait and dispatch latency from them.
+   */
+  private jobTimings(
+    createdAt: number,
+    startedAt: number | undefined,
+    finishedAt: number | undefined,
+    worker?: { received_at: number; started_at: number; finished_at: number },
+  ) {
+    const ms = (seconds?: number) =>
+      seconds === undefined ? undefined : Math.round(seconds * 1000);
+    return {
+      created_at: createdAt,
+      started_at: startedAt,
+      finished_at: finishedAt,
+      worker_received_at: ms(worker?.received_at),
+      worker_started_at: ms(worker?.started_at),
+      worker_finished_at: ms(worker?.finished_at),
+    };
+  }
+
+  /**
+   * Add browser URLs to the worker's tile pyramid metadata. Outputs are
+   * named after the job, so tiles live under `${jobId}_files`.
+   */
+  private pyramidUrls(jobId: string, pyramid: any) {
+    if (!pyramid) return undefined;
+    return {
+      ...pyramid,
+      dzi_url: `/api/results/${pyramid.dzi}`,
+      preview_url: `/api/results/${pyramid.preview}`,
+      tile_url: `/api/upscale/tiles/${jobId}/{level}/{col}_{row}.${pyramid.format}`,
+    };
+  }
+
+  async getTilePath(jobId: string, level: string, tile: string): Promise<string> {
+    if (!/^[\w-]+$/.test(jobId) || !/^\d+$/.test(level) || !TILE_NAME.test(tile)) {
+      throw new Error(`Invalid tile: ${jobId}/${level}/${tile}`);
+    }
+
+    const outputDir = process.env.OUTPUT_DIR || './results';
+    const filePath = resolve(outputDir, `${jobId}_files`, level, tile);
+
+    if (!existsSync(filePath)) {
+      throw new Error(`Tile not found: ${jobId}/${level}/${tile}`);
+    }
+
+    return filePath;
+  }
+
   async getResultPath(filename: string): Promise<string> {
     const outputDir = process.env.OUTPUT_DIR || './results';
     const filePath = join(outputDir, filename);